@@ -0,0 +1,458 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+import tempfile
+import threading
+import itertools
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.supermarket.database import Database
+from src.supermarket.item import Item
+from src.supermarket.catalog import get_catalog
+from src.supermarket.scheme import Scheme
+from src.supermarket.checkout import Checkout
+from src.supermarket import pricing_category as pc
+from src.supermarket import money
+from src.supermarket import snapshot
+from src.supermarket.allocation import PromotionAllocator
+from src.supermarket.scan_log import ScanLog
+
+# benchmarks for the scan, total and scheme load hot paths.
+# every run generates a synthetic catalog and scheme of the requested sizes into a scratch database,
+#   times each benchmark `repeat` times and writes the timings as JSON. a results file from an earlier
+#   release can be passed with --compare to fail the run when a benchmark got slower than a threshold.
+
+RESULTS_FORMAT_VERSION = 1
+TAX_RATES = [5, 7.25, 8.875, 9.25]
+
+# a synthetic catalog of `sku_count` products with `promotion_count` pricing categories, spread evenly
+#   over the BuyXGetYFree, AdditionalTaxes and Bundled types, all attached to one scheme
+class Workload:
+    def __init__(self, sku_count, promotion_count, basket_count, basket_size, seed):
+        self.sku_count = sku_count
+        self.promotion_count = promotion_count
+        self.basket_count = basket_count
+        self.basket_size = basket_size
+        self.rng = random.Random(seed)
+        self.skus = ['%07d' % i for i in range(sku_count)]
+        self.products = [(sku, 'product_' + sku, self.rng.randint(50, 5000)) for sku in self.skus]
+        self.prices = {product[0]: product[2] for product in self.products}
+        self.baskets = [self.make_basket() for i in range(basket_count)]
+
+    def make_basket(self):
+        size = min(self.basket_size, self.sku_count)
+        return {sku: self.rng.randint(1, 5) for sku in self.rng.sample(self.skus, size)}
+
+    def get_params(self):
+        return {'skus': self.sku_count, 'promotions': self.promotion_count,
+                'baskets': self.basket_count, 'basket_size': self.basket_size}
+
+    # writes the pricing categories and the 'benchmark' scheme with bulk inserts, the one at a time
+    #   create_pricing_category path would dominate the setup time for large schemes
+    def create_scheme(self, database_path):
+        pcrefs = []
+        buyxgety = []
+        taxes = []
+        bundled = []
+        for pcrefid in range(1, self.promotion_count + 1):
+            name = 'promotion_%d' % pcrefid
+            kind = pcrefid % 3
+            if kind == 1:
+                pcrefs.append((pcrefid, pc.BuyXGetYFree.pc_type_string, name))
+                buyxgety.append((self.rng.choice(self.skus), self.rng.randint(1, 3), self.rng.randint(1, 2), name, pcrefid))
+            elif kind == 2:
+                pcrefs.append((pcrefid, pc.AdditionalTaxes.pc_type_string, name))
+                taxes.append((self.rng.choice(self.skus), self.rng.choice(TAX_RATES), name, pcrefid))
+            else:
+                pcrefs.append((pcrefid, pc.Bundled.pc_type_string, name))
+                skus = self.rng.sample(self.skus, min(self.rng.randint(2, 3), self.sku_count))
+                price = int(sum([self.prices[sku] for sku in skus]) * 0.8)
+                bundled.append((price, ','.join(skus), name, pcrefid))
+        with Database(database_path) as db:
+            db.executemany('INSERT INTO pcrefs(pcrefid, pctype, name) VALUES (?, ?, ?)', pcrefs)
+            db.executemany('INSERT INTO pc_buyxgety(sku, x, y, name, pcrefid) VALUES (?, ?, ?, ?, ?)', buyxgety)
+            db.executemany('INSERT INTO pc_taxes(sku, tax_rate, name, pcrefid) VALUES (?, ?, ?, ?)', taxes)
+            db.executemany('INSERT INTO pc_bundled(price, skus, name, pcrefid) VALUES (?, ?, ?, ?)', bundled)
+            for price, skus, name, pcrefid in bundled:
+                pc.Bundled.write_skus(db, pcrefid, skus.split(','))
+            pcrefids = ','.join([str(pcrefid) for pcrefid in range(1, self.promotion_count + 1)])
+            db.execute('INSERT INTO schemes(name, pcrefids) VALUES (?, ?)', ('benchmark', pcrefids))
+            Scheme.write_pcrefids(db, db.lastrowid, range(1, self.promotion_count + 1))
+        pc.PricingCategory.definitions_version += 1
+
+def remove_database(database_path):
+    get_catalog(database_path).invalidate()
+    Scheme.clear_cache()
+    Database.close_connections(database_path)
+    for path in (database_path, database_path + '-wal', database_path + '-shm'):
+        if os.path.isfile(path):
+            os.remove(path)
+
+# runs `function` `repeat` times, calling `setup` (untimed) before each run. returns the list of
+#   run times in seconds.
+def measure(function, repeat, setup = None):
+    timings = []
+    for i in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(state)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def summarize(name, params, timings, operations):
+    median = statistics.median(timings)
+    return {
+        'name': name,
+        'params': params,
+        'repeat': len(timings),
+        'operations': operations,
+        'min': min(timings),
+        'median': median,
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'per_operation_us': median / operations * 1e6 if operations else None,
+        'operations_per_second': operations / median if median else None
+    }
+
+# each benchmark takes (workload, database_path, repeat) and returns (timings, operations)
+
+def bench_create_products(workload, database_path, repeat):
+    def setup():
+        remove_database(database_path)
+    def run(state):
+        Item.create_products(workload.products)
+    timings = measure(run, repeat, setup)
+    return timings, workload.sku_count
+
+def bench_read_scheme_cold(workload, database_path, repeat):
+    def setup():
+        Scheme.clear_cache()
+    def run(state):
+        Scheme.read_scheme('benchmark')
+    return measure(run, repeat, setup), 1
+
+def bench_read_scheme_cached(workload, database_path, repeat):
+    Scheme.read_scheme('benchmark')
+    def run(state):
+        for i in range(1000):
+            Scheme.read_scheme('benchmark')
+    return measure(run, repeat), 1000
+
+# catalog bulk load plus plan compilation, what the first checkout of a process pays
+def bench_compile(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    def setup():
+        get_catalog().invalidate()
+    def run(state):
+        scheme.compile()
+    return measure(run, repeat, setup), 1
+
+def scan_items(workload):
+    return [(index, sku) for index, basket in enumerate(workload.baskets)
+            for sku, quantity in basket.items() for i in range(quantity)]
+
+def bench_checkout_scan(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    scheme.compile()
+    scans = scan_items(workload)
+    def setup():
+        return [Checkout(scheme) for basket in workload.baskets]
+    def run(checkouts):
+        for index, sku in scans:
+            checkouts[index].scan(sku)
+    return measure(run, repeat, setup), len(scans)
+
+# scans written behind through a scan log (appended and flushed to the OS per scan, not fsynced),
+#   including the final group commit
+def bench_checkout_scan_logged(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    scheme.compile()
+    scans = scan_items(workload)
+    log_path = database_path + '.scanlog'
+    def setup():
+        log = ScanLog(log_path, database_path, fsync=False)
+        return log, [Checkout(scheme, scan_log=log, lane=str(index)) for index in range(len(workload.baskets))]
+    def run(state):
+        log, checkouts = state
+        for index, sku in scans:
+            checkouts[index].scan(sku)
+        log.close()
+    try:
+        return measure(run, repeat, setup), len(scans)
+    finally:
+        os.remove(log_path)
+
+# lanes scanning in several threads at once against one shared snapshot, the baskets split between the
+#   threads. every thread count scans the same items, so their operations_per_second (scans/s) compare.
+THREAD_COUNTS = [1, 2, 4, 8]
+
+def bench_checkout_scan_threads(threads):
+    def benchmark(workload, database_path, repeat):
+        shared = Scheme.read_scheme('benchmark').snapshot()
+        scans = scan_items(workload)
+        lanes = [[(index, sku) for index, sku in scans if index % threads == lane] for lane in range(threads)]
+        def setup():
+            return [Checkout(shared) for basket in workload.baskets]
+        def scan_lane(checkouts, lane_scans):
+            for index, sku in lane_scans:
+                checkouts[index].scan(sku)
+        def run(checkouts):
+            workers = [threading.Thread(target=scan_lane, args=(checkouts, lane_scans)) for lane_scans in lanes]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return measure(run, repeat, setup), len(scans)
+    return benchmark
+
+def bench_checkout_total(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    checkouts = [Checkout(scheme) for basket in workload.baskets]
+    for index, sku in scan_items(workload):
+        checkouts[index].scan(sku)
+    def run(state):
+        for checkout in checkouts:
+            checkout.getTotal()
+    return measure(run, repeat), len(checkouts)
+
+def bench_scheme_total(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    def run(state):
+        for basket in workload.baskets:
+            scheme.get_total(basket)
+    return measure(run, repeat), workload.basket_count
+
+# a replay job pricing every basket four times, through a cold LRU total cache
+def bench_scheme_total_cached(workload, database_path, repeat):
+    scheme = Scheme.load_scheme('benchmark')
+    def setup():
+        scheme.use_total_cache(workload.basket_count)
+    def run(state):
+        for i in range(4):
+            for basket in workload.baskets:
+                scheme.get_total(basket)
+    return measure(run, repeat, setup), 4 * workload.basket_count
+
+# totals with each unit in at most one promotion, solving every basket from a cold allocator
+def bench_allocated_total(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    plan = scheme.compile()
+    def setup():
+        return PromotionAllocator(plan)
+    def run(allocator):
+        for basket in workload.baskets:
+            allocator.get_total(basket)
+    return measure(run, repeat, setup), workload.basket_count
+
+def bench_batch_totals(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    scheme.compile()
+    def run(state):
+        scheme.get_totals(workload.baskets)
+    return measure(run, repeat), workload.basket_count
+
+def bench_batch_totals_cents(workload, database_path, repeat):
+    scheme = Scheme.read_scheme('benchmark')
+    scheme.compile()
+    def run(state):
+        scheme.get_totals_cents(workload.baskets, money.ROUND_HALF_UP)
+    return measure(run, repeat), workload.basket_count
+
+# what a lane terminal pays from process start to its first scan: loading the catalog and compiling
+#   the plan from the database, or mapping a catalog snapshot
+def bench_first_scan(workload, database_path, repeat):
+    sku = next(iter(workload.baskets[0]))
+    def setup():
+        get_catalog().invalidate()
+        Scheme.clear_cache()
+    def run(state):
+        Checkout(Scheme.read_scheme('benchmark')).scan(sku)
+    return measure(run, repeat, setup), 1
+
+def bench_snapshot_first_scan(workload, database_path, repeat):
+    sku = next(iter(workload.baskets[0]))
+    snapshot_path = database_path + '.snapshot'
+    snapshot.export_snapshot(snapshot_path, ['benchmark'], database_path)
+    def run(state):
+        with snapshot.CatalogSnapshot(snapshot_path) as mapped:
+            Checkout(mapped.get_scheme('benchmark')).scan(sku)
+    try:
+        return measure(run, repeat), 1
+    finally:
+        os.remove(snapshot_path)
+
+# cold start of a fresh interpreter, in a subprocess: importing the lane modules, then pricing a first
+#   basket from the database or from a catalog snapshot. `python3 -X importtime` on the same script shows
+#   where the import time goes.
+COLD_START_SCRIPT = """
+import sys
+sys.path.insert(0, %(root)r)
+from src.supermarket.checkout import Checkout
+from src.supermarket.database import Database
+from src.supermarket.scheme import Scheme
+from src.supermarket import snapshot
+mode = %(mode)r
+if mode == 'database':
+    Database.database_path = %(database_path)r
+    scheme = Scheme.read_scheme('benchmark')
+elif mode == 'snapshot':
+    scheme = snapshot.CatalogSnapshot(%(snapshot_path)r).get_scheme('benchmark')
+if mode != 'import':
+    checkout = Checkout(scheme)
+    for sku in %(skus)r:
+        checkout.scan(sku)
+    checkout.getTotal()
+"""
+
+def measure_cold_start(workload, database_path, repeat, mode, snapshot_path = None):
+    script = COLD_START_SCRIPT % {'root': os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mode': mode,
+                                  'database_path': database_path, 'snapshot_path': snapshot_path,
+                                  'skus': list(workload.baskets[0])}
+    def run(state):
+        subprocess.run([sys.executable, '-c', script], check=True)
+    return measure(run, repeat), 1
+
+def bench_cold_import(workload, database_path, repeat):
+    return measure_cold_start(workload, database_path, repeat, 'import')
+
+def bench_cold_start(workload, database_path, repeat):
+    return measure_cold_start(workload, database_path, repeat, 'database')
+
+def bench_cold_start_snapshot(workload, database_path, repeat):
+    snapshot_path = database_path + '.snapshot'
+    snapshot.export_snapshot(snapshot_path, ['benchmark'], database_path)
+    try:
+        return measure_cold_start(workload, database_path, repeat, 'snapshot', snapshot_path)
+    finally:
+        os.remove(snapshot_path)
+
+# in run order; create_products leaves the catalog in the database for the benchmarks after it
+BENCHMARKS = [
+    ('create_products', bench_create_products),
+    ('read_scheme_cold', bench_read_scheme_cold),
+    ('read_scheme_cached', bench_read_scheme_cached),
+    ('compile', bench_compile),
+    ('checkout_scan', bench_checkout_scan),
+    ('checkout_scan_logged', bench_checkout_scan_logged),
+    *[('checkout_scan_threads_%d' % threads, bench_checkout_scan_threads(threads)) for threads in THREAD_COUNTS],
+    ('checkout_total', bench_checkout_total),
+    ('scheme_total', bench_scheme_total),
+    ('scheme_total_cached', bench_scheme_total_cached),
+    ('allocated_total', bench_allocated_total),
+    ('batch_totals', bench_batch_totals),
+    ('batch_totals_cents', bench_batch_totals_cents),
+    ('first_scan', bench_first_scan),
+    ('snapshot_first_scan', bench_snapshot_first_scan),
+    ('cold_import', bench_cold_import),
+    ('cold_start', bench_cold_start),
+    ('cold_start_snapshot', bench_cold_start_snapshot)
+]
+
+def run_workload(workload, database_path, repeat, names):
+    results = []
+    remove_database(database_path)
+    Item.create_products(workload.products)
+    workload.create_scheme(database_path)
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        timings, operations = benchmark(workload, database_path, repeat)
+        result = summarize(name, workload.get_params(), timings, operations)
+        results.append(result)
+        sys.stdout.write('%-20s %-55s median %10.3f ms  %10.2f us/op\n' % (
+            name, json.dumps(result['params']), result['median'] * 1e3, result['per_operation_us']))
+        sys.stdout.flush()
+        if name == 'create_products':
+            workload.create_scheme(database_path)  # the last run started from an empty database
+    remove_database(database_path)
+    return results
+
+def get_environment():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': numpy_version,
+        'commit': commit
+    }
+
+# returns a list of (name, params, baseline median, median) for every benchmark slower than
+#   the baseline by more than `threshold` (a fraction, e.g. 0.2 for 20%)
+def find_regressions(baseline, results, threshold):
+    baseline_medians = {}
+    for result in baseline['results']:
+        baseline_medians[(result['name'], json.dumps(result['params'], sort_keys=True))] = result['median']
+    regressions = []
+    for result in results['results']:
+        key = (result['name'], json.dumps(result['params'], sort_keys=True))
+        baseline_median = baseline_medians.get(key)
+        if baseline_median is not None and result['median'] > baseline_median * (1 + threshold):
+            regressions.append((result['name'], result['params'], baseline_median, result['median']))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark the scan, total and scheme load hot paths against synthetic catalogs.')
+    parser.add_argument('--skus', type=int, nargs='+', default=[1000, 100000], help='catalog sizes to run (e.g. 1000 1000000)')
+    parser.add_argument('--promotions', type=int, nargs='+', default=[10, 1000], help='numbers of pricing categories in the scheme')
+    parser.add_argument('--baskets', type=int, default=2000, help='baskets scanned and priced per benchmark run')
+    parser.add_argument('--basket-size', type=int, default=20, help='distinct SKUs per basket')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=1983, help='seed for the synthetic workload')
+    parser.add_argument('--benchmark', action='append', choices=[name for name, benchmark in BENCHMARKS],
+                        help='only run the named benchmark (may be repeated)')
+    parser.add_argument('--database', help='scratch database path (default: a temporary file)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of a baseline run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown over the baseline median that fails --compare')
+    args = parser.parse_args(argv)
+
+    scratch = None
+    database_path = args.database
+    if database_path is None:
+        scratch = tempfile.mkdtemp(prefix='supermarket_benchmarks_')
+        database_path = os.path.join(scratch, 'benchmark.db')
+    Database.database_path = database_path
+    results = {'format_version': RESULTS_FORMAT_VERSION, 'created': time.time(), 'environment': get_environment(), 'results': []}
+    try:
+        for sku_count, promotion_count in itertools.product(args.skus, args.promotions):
+            workload = Workload(sku_count, promotion_count, args.baskets, args.basket_size, args.seed)
+            results['results'].extend(run_workload(workload, database_path, args.repeat, args.benchmark))
+    finally:
+        if scratch is not None:
+            remove_database(database_path)
+            os.rmdir(scratch)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(baseline, results, args.threshold)
+        for name, params, baseline_median, median in regressions:
+            sys.stdout.write('REGRESSION %s %s: median %.3f ms -> %.3f ms\n' % (name, json.dumps(params), baseline_median * 1e3, median * 1e3))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,25 @@
 #! /usr/bin/env bash
 export PYTHONPATH=:`pwd`
 
+python3 tests/database_test.py
+python3 tests/metrics_test.py
+python3 tests/migrations_test.py
 python3 tests/item_test.py
+python3 tests/catalog_test.py
+python3 tests/basket_test.py
 python3 tests/pricing_category_test.py
 python3 tests/scheme_test.py
+python3 tests/snapshot_test.py
+python3 tests/pricing_plan_test.py
+python3 tests/allocation_test.py
+python3 tests/money_test.py
+python3 tests/batch_test.py
+python3 tests/repricing_test.py
+python3 tests/pipeline_test.py
+python3 tests/registry_test.py
+python3 tests/scan_log_test.py
+python3 tests/total_cache_test.py
+python3 tests/startup_test.py
+python3 tests/service_test.py
+python3 tests/threading_test.py
 python3 tests/checkout_test.py
\ No newline at end of file
@@ -12,5 +12,8 @@ setuptools.setup(
     url="https://github.com/eraustud/supermarket_exercise",
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
-    python_requires=">=3.7"
+    python_requires=">=3.7",
+    extras_require={
+        "batch": ["numpy"]  # vectorized batch re-pricing
+    }
 )
\ No newline at end of file
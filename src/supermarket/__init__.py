@@ -1 +1,9 @@
-__all__ = ['checkout', 'pricing_category', 'scheme', 'item', 'database']
\ No newline at end of file
+__all__ = ['checkout', 'pricing_category', 'scheme', 'item', 'catalog', 'pricing_plan', 'batch', 'repricing', 'pipeline', 'database', 'migrations', 'money', 'metrics', 'service', 'basket', 'snapshot', 'allocation', 'registry', 'scan_log', 'total_cache', 'log']
+
+# submodules are imported on first use, e.g. `supermarket.scheme`, so importing the package loads none of them
+#   and a lane terminal only pays for the modules it touches. `from supermarket import *` still imports them all.
+def __getattr__(name):
+    if name in __all__:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
@@ -0,0 +1,264 @@
+import threading
+import weakref
+import collections
+from . import pricing_category as pc
+
+DEFAULT_MAX_STATES = 20000  # search states per basket component before falling back to a greedy allocation
+DEFAULT_CACHE_SIZE = 4096  # solved basket components remembered per plan
+
+# result of allocating a basket's units to promotions.
+# `assignments` maps the plan index of every promotion used to the units allocated to it (for a
+#   BuyXGetYFree) or the number of bundles made (for a Bundled). `exact` is False if part of the basket
+#   was too large to search and was allocated greedily.
+class Allocation:
+    def __init__(self, total, discount, assignments, exact):
+        self.total = total
+        self.discount = discount
+        self.assignments = assignments
+        self.exact = exact
+
+    def __repr__(self):
+        return 'Allocation(total=%r, discount=%r, assignments=%r, exact=%r)' % (self.total, self.discount, self.assignments, self.exact)
+
+class SearchBudgetExceeded(Exception):
+    pass
+
+# assigns each unit of a basket to at most one promotion (BuyXGetYFree or Bundled) so as to maximize the
+#   customer's discount, instead of letting every promotion stack as PricingPlan.get_total does. every
+#   other category of the plan (the simple prices, taxes) applies to the whole basket as usual.
+# SKUs are split into components joined by the bundles that could be made from the basket. a SKU
+#   outside every bundle just gets its best split between its own BuyXGetYFree deals; within a
+#   component, every count of each bundle is searched with the remaining units memoized, and the
+#   solved components are cached by their SKU quantities so repeated baskets cost a dict lookup.
+#   a component needing more than `max_states` search states is allocated greedily instead, and so are
+#   the units of a SKU split between several of its own deals when that split would take more steps.
+# an allocator is bound to one immutable plan, see get_allocator.
+class PromotionAllocator:
+    def __init__(self, plan, max_states = DEFAULT_MAX_STATES, cache_size = DEFAULT_CACHE_SIZE):
+        self.plan = plan
+        self.max_states = max_states
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()  # component signature -> (discount, assignments, exact), least recently used first
+        # (sku, quantity) -> (discount, {rule index: units}, exact) of the SKU's own deals, least recently used first
+        self.unit_discounts = collections.OrderedDict()
+        self.deals_by_sku = {}  # SKU -> plan indices of its BuyXGetYFree deals
+        self.bundles_by_sku = {}  # SKU -> (plan index, {SKU: units per bundle}) of every Bundled including it
+        self.savings = {}  # plan index -> saving of each Bundled, once computed
+        self.other_rules = set()  # plan indices of the categories that are not promotions
+        for index, rule in enumerate(plan.rules):
+            if isinstance(rule, pc.BuyXGetYFree):
+                self.deals_by_sku.setdefault(rule.sku, []).append(index)
+            elif isinstance(rule, pc.Bundled):
+                bundle = (index, collections.Counter(rule.skus))
+                for sku in bundle[1]:
+                    self.bundles_by_sku.setdefault(sku, []).append(bundle)
+            else:
+                self.other_rules.add(index)
+
+    # discount of a bundle over buying its SKUs separately, zero or negative if the bundle saves nothing
+    def get_bundle_saving(self, bundle):
+        index, needs = bundle
+        saving = self.savings.get(index)
+        if saving is None:
+            get_price = self.plan.get_price
+            saving = self.savings[index] = sum([get_price(sku) * units for sku, units in needs.items()]) - self.plan.rules[index].price
+        return saving
+
+    # best discount of `quantity` units of a SKU split between its BuyXGetYFree deals, as
+    #   (discount, {rule index: units}, exact)
+    def get_unit_discount(self, sku, quantity):
+        deals = self.deals_by_sku.get(sku, ())
+        if not deals or quantity == 0:
+            return (0, {}, True)
+        if len(deals) == 1:
+            rule_index = deals[0]
+            return (self.plan.get_price(sku) * self.plan.rules[rule_index].get_free_count(quantity), {rule_index: quantity}, True)
+        key = (sku, quantity)
+        with self.lock:
+            result = self.unit_discounts.get(key)
+            if result is not None:
+                self.unit_discounts.move_to_end(key)
+                return result
+        price = self.plan.get_price(sku)
+        rules = self.plan.rules
+        if (len(deals) - 1) * (quantity + 1) * (quantity + 2) // 2 > self.max_states:
+            # too many splits to try, give every unit to the single deal that saves the most on its own
+            result = max([(price * rules[index].get_free_count(quantity), {index: quantity}, False) for index in deals],
+                         key=lambda choice: choice[0])
+        else:
+            # best[n] is the best (discount, assignments) of n units over the deals seen so far
+            best = [(price * rules[deals[0]].get_free_count(n), {deals[0]: n} if n else {}) for n in range(quantity + 1)]
+            for index in deals[1:]:
+                rule = rules[index]
+                updated = []
+                for n in range(quantity + 1):
+                    choice = best[n]
+                    for units in range(1, n + 1):
+                        discount = best[n - units][0] + price * rule.get_free_count(units)
+                        if discount > choice[0]:
+                            assignments = dict(best[n - units][1])
+                            assignments[index] = units
+                            choice = (discount, assignments)
+                    updated.append(choice)
+                best = updated
+            result = best[quantity] + (True,)
+        with self.lock:
+            self.unit_discounts[key] = result
+            if len(self.unit_discounts) > self.cache_size:
+                self.unit_discounts.popitem(last=False)
+        return result
+
+    # splits the basket's SKUs into components joined by the bundles that can be made from the basket
+    def get_components(self, checkout_items):
+        parents = {}
+        def find(sku):
+            while parents[sku] != sku:
+                parents[sku] = parents[parents[sku]]
+                sku = parents[sku]
+            return sku
+        for sku, quantity in checkout_items.items():
+            if quantity > 0:
+                parents[sku] = sku
+        bundles = {}
+        for sku in parents:
+            for bundle in self.bundles_by_sku.get(sku, ()):
+                if bundle[0] not in bundles:
+                    bundles[bundle[0]] = bundle
+        bundles = [bundle for index, bundle in sorted(bundles.items())
+                   if self.get_bundle_saving(bundle) > 0 and all(checkout_items.get(sku, 0) >= units for sku, units in bundle[1].items())]
+        for bundle in bundles:
+            skus = list(bundle[1])
+            for sku in skus[1:]:
+                parents[find(sku)] = find(skus[0])
+        components = {}
+        for sku in parents:
+            components.setdefault(find(sku), ([], []))[0].append(sku)
+        for bundle in bundles:
+            components[find(next(iter(bundle[1])))][1].append(bundle)
+        return list(components.values())
+
+    # returns (discount, assignments, exact) of one component
+    def solve_component(self, checkout_items, skus, bundles):
+        skus = sorted(skus)
+        quantities = tuple([checkout_items[sku] for sku in skus])
+        if not bundles:
+            # a SKU in no bundle, priced from its own deals
+            return self.get_unit_discount(skus[0], quantities[0])
+        signature = (tuple(skus), quantities)
+        with self.lock:
+            cached = self.cache.get(signature)
+            if cached is not None:
+                self.cache.move_to_end(signature)
+                return cached
+        try:
+            result = self.search(skus, quantities, bundles) + (True,)
+        except SearchBudgetExceeded:
+            result = self.allocate_greedily(skus, quantities, bundles) + (False,)
+        with self.lock:
+            self.cache[signature] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    # exact search over the number of each bundle made, memoized on the units left
+    def search(self, skus, quantities, bundles):
+        positions = {sku: position for position, sku in enumerate(skus)}
+        needs = [[(positions[sku], units) for sku, units in bundle[1].items()] for bundle in bundles]
+        savings = [self.get_bundle_saving(bundle) for bundle in bundles]
+        memo = {}
+
+        def best(position, remaining):
+            key = (position, remaining)
+            result = memo.get(key)
+            if result is not None:
+                return result
+            if len(memo) >= self.max_states:
+                raise SearchBudgetExceeded()
+            if position == len(bundles):
+                discount = 0
+                assignments = {}
+                for sku, quantity in zip(skus, remaining):
+                    unit_discount, unit_assignments, unit_exact = self.get_unit_discount(sku, quantity)
+                    if not unit_exact:
+                        raise SearchBudgetExceeded()
+                    discount += unit_discount
+                    assignments.update(unit_assignments)
+                result = (discount, assignments)
+            else:
+                most = min([remaining[sku_position] // units for sku_position, units in needs[position]])
+                result = None
+                left = list(remaining)
+                for count in range(most + 1):
+                    if count:
+                        for sku_position, units in needs[position]:
+                            left[sku_position] -= units
+                    rest_discount, rest_assignments = best(position + 1, tuple(left))
+                    discount = rest_discount + savings[position] * count
+                    if result is None or discount > result[0]:
+                        assignments = rest_assignments
+                        if count:
+                            assignments = dict(rest_assignments)
+                            assignments[bundles[position][0]] = count
+                        result = (discount, assignments)
+            memo[key] = result
+            return result
+
+        return best(0, quantities)
+
+    # makes as many of each bundle as possible in order of saving, then gives the units left to the
+    #   SKUs' own deals, and keeps the better of that and using no bundles at all
+    def allocate_greedily(self, skus, quantities, bundles):
+        candidates = []
+        for use_bundles in (True, False):
+            remaining = dict(zip(skus, quantities))
+            discount = 0
+            assignments = {}
+            if use_bundles:
+                for bundle in sorted(bundles, key=self.get_bundle_saving, reverse=True):
+                    count = min([remaining[sku] // units for sku, units in bundle[1].items()])
+                    if count:
+                        for sku, units in bundle[1].items():
+                            remaining[sku] -= units * count
+                        discount += self.get_bundle_saving(bundle) * count
+                        assignments[bundle[0]] = count
+            for sku in skus:
+                unit_discount, unit_assignments, unit_exact = self.get_unit_discount(sku, remaining[sku])
+                discount += unit_discount
+                assignments.update(unit_assignments)
+            candidates.append((discount, assignments))
+        return max(candidates, key=lambda candidate: candidate[0])
+
+    def allocate(self, checkout_items):
+        plan = self.plan
+        discount = 0
+        assignments = {}
+        exact = True
+        for skus, bundles in self.get_components(checkout_items):
+            component_discount, component_assignments, component_exact = self.solve_component(checkout_items, skus, bundles)
+            discount += component_discount
+            assignments.update(component_assignments)
+            exact = exact and component_exact
+        total = 0.0
+        other_rules = self.other_rules
+        for index in plan.get_rule_indices(checkout_items.keys()):
+            if index in other_rules:
+                total += plan.rules[index].evaluate(checkout_items, plan.get_price)
+        return Allocation(int(total - discount), discount, assignments, exact)
+
+    def get_total(self, checkout_items):
+        return self.allocate(checkout_items).total
+
+# plan -> PromotionAllocator, so that every scheme sharing a plan shares its solved components
+_allocators = weakref.WeakKeyDictionary()
+_allocators_lock = threading.Lock()
+
+# returns the allocator of a compiled plan
+def get_allocator(plan):
+    allocator = _allocators.get(plan)
+    if allocator is None:
+        with _allocators_lock:
+            allocator = _allocators.get(plan)
+            if allocator is None:
+                allocator = _allocators[plan] = PromotionAllocator(plan)
+    return allocator
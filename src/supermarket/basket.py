@@ -0,0 +1,143 @@
+import sys
+import array
+import bisect
+import threading
+import collections.abc
+
+# process-wide mapping between SKU strings and small integer ids.
+# ids are handed out in order of first use and never reused, so an id stays valid for the life of
+#   the process. SKU strings are interned, so every basket and plan shares one copy of each.
+class SkuInterner:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}  # SKU -> id
+        self.skus = []  # id -> SKU
+
+    def get_id(self, sku):
+        sku_id = self.ids.get(sku)
+        if sku_id is None:
+            with self.lock:
+                sku_id = self.ids.get(sku)
+                if sku_id is None:
+                    sku = sys.intern(sku)
+                    sku_id = len(self.skus)
+                    self.skus.append(sku)
+                    self.ids[sku] = sku_id
+        return sku_id
+
+    def get_sku(self, sku_id):
+        return self.skus[sku_id]
+
+    def __len__(self):
+        return len(self.skus)
+
+_interner = SkuInterner()
+
+def get_interner():
+    return _interner
+
+QUANTITY_BITS = 32
+QUANTITY_MASK = (1 << QUANTITY_BITS) - 1
+
+# compact basket of SKU -> quantity for a checkout lane.
+# each basket line is packed into one 64-bit integer, the SKU id (from the process-wide SkuInterner) in the
+#   high 32 bits and the quantity in the low 32, and the lines are kept in a single array sorted by SKU id
+#   and found by binary search. that is 8 bytes per line against about 24 for a dict entry plus the dict's
+#   hash table, and there is no per-instance __dict__.
+# a Basket is a read only Mapping of SKU string -> quantity, so pricing categories and plans evaluate it
+#   exactly like a dict; quantities are changed with `add`. lines are kept in SKU id order, not scan order.
+class Basket(collections.abc.Mapping):
+    __slots__ = ('lines',)
+
+    def __init__(self, items = None):
+        self.lines = array.array('q')
+        if items is not None:
+            if isinstance(items, collections.abc.Mapping):
+                items = items.items()
+            for sku, quantity in items:
+                self.add(sku, quantity)
+
+    # position of the SKU's line, or -1
+    def find(self, sku):
+        sku_id = _interner.ids.get(sku)
+        if sku_id is None:
+            return -1
+        lines = self.lines
+        position = bisect.bisect_left(lines, sku_id << QUANTITY_BITS)
+        if position < len(lines) and lines[position] >> QUANTITY_BITS == sku_id:
+            return position
+        return -1
+
+    # adds `quantity` (which may be negative) of a SKU, dropping the line once its quantity reaches zero.
+    # returns the new quantity.
+    def add(self, sku, quantity = 1):
+        sku_id = _interner.get_id(sku)
+        lines = self.lines
+        position = bisect.bisect_left(lines, sku_id << QUANTITY_BITS)
+        if position == len(lines) or lines[position] >> QUANTITY_BITS != sku_id:
+            if quantity < 0:
+                raise ValueError('Requested product SKU %s is not in the basket' % sku)
+            if quantity > QUANTITY_MASK:
+                raise ValueError('Quantity %d of product SKU %s is too large' % (quantity, sku))
+            if quantity > 0:
+                lines.insert(position, (sku_id << QUANTITY_BITS) | quantity)
+            return quantity
+        updated = (lines[position] & QUANTITY_MASK) + quantity
+        if updated < 0:
+            raise ValueError('Requested product SKU %s is not in the basket %d times' % (sku, -quantity))
+        if updated > QUANTITY_MASK:
+            raise ValueError('Quantity %d of product SKU %s is too large' % (updated, sku))
+        if updated == 0:
+            del lines[position]
+        else:
+            lines[position] += quantity
+        return updated
+
+    def __getitem__(self, sku):
+        position = self.find(sku)
+        if position < 0:
+            raise KeyError(sku)
+        return self.lines[position] & QUANTITY_MASK
+
+    def __contains__(self, sku):
+        return self.find(sku) >= 0
+
+    def get(self, sku, default = None):
+        position = self.find(sku)
+        if position < 0:
+            return default
+        return self.lines[position] & QUANTITY_MASK
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        skus = _interner.skus
+        return [skus[line >> QUANTITY_BITS] for line in self.lines]
+
+    def values(self):
+        return [line & QUANTITY_MASK for line in self.lines]
+
+    def items(self):
+        skus = _interner.skus
+        return [(skus[line >> QUANTITY_BITS], line & QUANTITY_MASK) for line in self.lines]
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Basket(%r)' % dict(self.items())
+
+    # baskets pickle by SKU, since ids are only meaningful within one process
+    def __reduce__(self):
+        return (Basket, (self.items(),))
+
+    def copy(self):
+        return Basket(self.items())
@@ -0,0 +1,118 @@
+import itertools
+import weakref
+from . import pricing_category as pc
+from . import money
+
+DEFAULT_CHUNK_SIZE = 1000  # baskets priced per columnar pass
+
+# columnar pricing of many baskets at once against a compiled PricingPlan, built on numpy.
+# each chunk of baskets is turned into a basket x SKU quantity matrix over the SKUs present in the
+#   chunk, simple prices are a weighted sum against the price vector, and each pricing category is
+#   applied to its SKU columns for every basket at once. categories whose SKUs don't appear in the
+#   chunk are masked out entirely. categories are added in scheme order with the same floating
+#   point operations as PricingCategory.evaluate, so totals match Scheme.get_total exactly.
+# when a money rounding mode is given, the same evaluation runs on int64 arrays instead and matches
+#   Scheme.get_total_cents exactly.
+class BatchPricer:
+    def __init__(self, plan):
+        import numpy
+        self.numpy = numpy
+        self.plan = plan
+        self.skus = list(plan.prices.keys())
+        self.sku_index = {sku: column for column, sku in enumerate(self.skus)}
+        self.prices = numpy.array([plan.prices[sku] for sku in self.skus], dtype=numpy.float64)
+        self.prices_cents = self.prices.astype(numpy.int64)
+
+    # returns the list of totals for a sequence (or iterator) of checkout item dicts.
+    # totals are integer cents computed exactly with `rounding` if a money rounding mode is given.
+    def get_totals(self, baskets, chunk_size = DEFAULT_CHUNK_SIZE, rounding = None):
+        return list(self.iter_totals(baskets, chunk_size, rounding))
+
+    # yields the total of each basket, in order, pricing `chunk_size` baskets at a time
+    def iter_totals(self, baskets, chunk_size = DEFAULT_CHUNK_SIZE, rounding = None):
+        baskets = iter(baskets)
+        while True:
+            chunk = list(itertools.islice(baskets, chunk_size))
+            if not chunk:
+                return
+            for total in self.price_chunk(chunk, rounding):
+                yield total
+
+    def price_chunk(self, baskets, rounding = None):
+        numpy = self.numpy
+        cents = rounding is not None
+        dtype = numpy.int64 if cents else numpy.float64
+        plan = self.plan
+        sku_index = self.sku_index
+        rows = []
+        columns = []
+        quantities = []
+        for row, basket in enumerate(baskets):
+            for sku, quantity in basket.items():
+                column = sku_index.get(sku)
+                if column is None:
+                    raise ValueError('Requested product SKU %s does not match any products in the pricing plan' % sku)
+                rows.append(row)
+                columns.append(column)
+                quantities.append(quantity)
+        rows = numpy.array(rows, dtype=numpy.intp)
+        columns = numpy.array(columns, dtype=numpy.intp)
+        quantities = numpy.array(quantities, dtype=dtype)
+        basket_count = len(baskets)
+
+        # basket x SKU quantity matrix, restricted to the SKUs present in this chunk
+        present, local_columns = numpy.unique(columns, return_inverse=True)
+        matrix = numpy.zeros((basket_count, len(present)), dtype=dtype)
+        matrix[rows, local_columns] = quantities
+        local_index = dict(zip(present.tolist(), range(len(present))))
+        zeros = numpy.zeros(basket_count, dtype=dtype)
+
+        def column_of(sku):
+            local_column = local_index.get(sku_index.get(sku))
+            return zeros if local_column is None else matrix[:, local_column]
+
+        totals = numpy.zeros(basket_count, dtype=dtype)
+        for index in plan.get_rule_indices([self.skus[column] for column in present.tolist()]):
+            rule = plan.rules[index]
+            if type(rule) is pc.Simple:
+                if cents:
+                    totals += numpy.bincount(rows, weights=quantities * self.prices_cents[columns], minlength=basket_count).astype(numpy.int64)
+                else:
+                    totals += numpy.bincount(rows, weights=quantities * self.prices[columns], minlength=basket_count)
+            elif type(rule) is pc.BuyXGetYFree:
+                totals += rule.get_subtotals(column_of(rule.sku), plan.get_price(rule.sku))
+            elif type(rule) is pc.AdditionalTaxes:
+                if cents:
+                    rate = money.percent_fraction(rule.tax_rate_percent)
+                    amounts = int(plan.get_price(rule.sku)) * column_of(rule.sku)
+                    totals += money.divide_array(amounts * rate.numerator, rate.denominator, rounding)
+                else:
+                    totals += plan.get_price(rule.sku) * column_of(rule.sku) * (rule.tax_rate_percent / 100.0)
+            elif type(rule) is pc.Bundled:
+                base_price = sum([plan.get_price(sku) for sku in rule.skus])
+                complete = numpy.min(numpy.stack([column_of(sku) for sku in rule.skus]), axis=0)
+                totals += (rule.price - base_price) * complete
+            elif cents:
+                # no columnar form for this category, evaluate it basket by basket
+                totals += numpy.array([rule.evaluate_cents(basket, plan.get_price, rounding) for basket in baskets], dtype=numpy.int64)
+            else:
+                totals += numpy.array([rule.evaluate(basket, plan.get_price) for basket in baskets], dtype=numpy.float64)
+        return totals.astype(numpy.int64).tolist()
+
+# one pricer per plan, dropped along with the plan
+_pricers = weakref.WeakKeyDictionary()
+
+# returns the totals of a sequence (or iterator) of checkout item dicts under a compiled plan.
+# falls back to pricing basket by basket through the plan when numpy is not installed.
+# totals are integer cents computed exactly with `rounding` if a money rounding mode is given.
+def get_totals(plan, baskets, chunk_size = DEFAULT_CHUNK_SIZE, rounding = None):
+    try:
+        import numpy
+    except ImportError:
+        if rounding is not None:
+            return [plan.get_total_cents(basket, rounding) for basket in baskets]
+        return [plan.get_total(basket) for basket in baskets]
+    pricer = _pricers.get(plan)
+    if pricer is None:
+        pricer = _pricers[plan] = BatchPricer(plan)
+    return pricer.get_totals(baskets, chunk_size, rounding)
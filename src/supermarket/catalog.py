@@ -0,0 +1,175 @@
+import sqlite3
+import threading
+import weakref
+from .database import Database
+from .log import get_logger
+from .item import Item
+from . import metrics
+
+# in-memory product catalog of one database, keyed by SKU. there is one catalog per database path
+#   in a process, see get_catalog.
+# the whole products table is loaded with a single bulk query on first use, after which lookups
+#   are served from memory. product writes made through Item notify the catalog, which re-reads
+#   the affected SKUs so that the cached table stays complete, and then passes the changed prices on
+#   to its own listeners (e.g. schemes holding a compiled PricingPlan) so they can patch just those.
+class Catalog:
+    refresh_chunk_size = 500  # SKUs per `IN (...)` query when refreshing changed products
+    def __init__(self, database_path):
+        self.log = get_logger('Catalog')
+        self.lock = threading.Lock()
+        self.products = None  # dict of SKU -> Item, None until loaded
+        self.database_path = database_path
+        self.version = 0  # bumped on every change so that dependent caches can tell they are stale
+        self.hits = 0
+        self.misses = 0
+        # objects with a `catalog_changed(prices, version)` method, told about every change. `prices`
+        #   maps each changed SKU to its new price (None if it was deleted), or is None if everything changed.
+        self.listeners = weakref.WeakSet()
+        Item.add_change_listener(self)
+
+    def add_listener(self, listener):
+        self.listeners.add(listener)
+
+    def notify_listeners(self, prices, version):
+        for listener in list(self.listeners):
+            listener.catalog_changed(prices, version)
+
+    # bulk load every product record in a single query
+    def load(self):
+        products = {}
+        with Database(self.database_path, read_only=True) as db:
+            try:
+                db.execute('SELECT SKU, name, price FROM products')
+                for record in db.fetchall():
+                    products[record[0]] = Item(record[0], record[1], record[2])
+            except sqlite3.Error as err:
+                self.log.error('Error occurred attempting to load the product catalog: %s' % str(err))
+        with self.lock:
+            self.products = products
+            self.version += 1
+
+    # returns the loaded dict of SKU -> Item, loading it first if needed
+    def get_products(self):
+        products = self.products
+        if products is None:
+            self.load()
+            products = self.products
+        return products
+
+    # returns the catalog version along with a dict of SKU -> price for every product, taken atomically
+    def snapshot_prices(self):
+        self.get_products()
+        with self.lock:
+            return self.version, {sku: item.price for sku, item in self.products.items()}
+
+    # returns the Item for this SKU, or None if the SKU does not match any product
+    def get_product(self, sku):
+        products = self.get_products()
+        item = products.get(sku)
+        if item is not None:
+            self.hits += 1
+            return item
+        self.misses += 1
+        # the record may have been written (or invalidated) since the bulk load, fetch it on its own
+        item = Item.read_product(sku, self.database_path)
+        if item is not None:
+            with self.lock:
+                products[sku] = item
+                self.version += 1
+                version = self.version
+            self.notify_listeners({sku: item.price}, version)
+        return item
+
+    def get_price(self, sku):
+        item = self.get_product(sku)
+        if item is None:
+            raise ValueError('Requested product SKU %s does not match any products in the database' % sku)
+        return item.price
+
+    # drop every cached product; the next lookup reloads the whole table
+    def invalidate(self):
+        with self.lock:
+            self.products = None
+            self.version += 1
+            version = self.version
+        self.notify_listeners(None, version)
+
+    # change listener hook called by Item whenever product records are written
+    def products_changed(self, skus, database_path):
+        if database_path != self.database_path:
+            return  # written to another database
+        skus = list(skus)
+        products = self.products
+        if products is None or len(skus) > len(products) // 2:
+            # nothing cached yet, or so much changed that a bulk reload is cheaper
+            self.invalidate()
+            return
+        records = []
+        with Database(self.database_path, read_only=True) as db:
+            try:
+                for start in range(0, len(skus), Catalog.refresh_chunk_size):
+                    chunk = skus[start:start + Catalog.refresh_chunk_size]
+                    db.execute('SELECT SKU, name, price FROM products WHERE SKU IN (%s)' % ','.join('?' * len(chunk)), chunk)
+                    records.extend(db.fetchall())
+            except sqlite3.Error as err:
+                self.log.error('Error occurred attempting to refresh changed products: %s' % str(err))
+        prices = dict.fromkeys(skus)
+        with self.lock:
+            for sku in skus:
+                products.pop(sku, None)
+            for record in records:
+                products[record[0]] = Item(record[0], record[1], record[2])
+                prices[record[0]] = record[2]
+            self.version += 1
+            version = self.version
+        self.notify_listeners(prices, version)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.products) if self.products is not None else 0
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+# database path -> Catalog
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+# returns the product catalog of a database, by default the database of the current context
+def get_catalog(database_path = None):
+    if database_path is None:
+        database_path = Database.get_database_path()
+        if database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+    catalog = _catalogs.get(database_path)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.get(database_path)
+            if catalog is None:
+                catalog = _catalogs[database_path] = Catalog(database_path)
+    return catalog
+
+def get_catalog_samples(stat):
+    return {(catalog.database_path,): catalog.get_stats()[stat] for catalog in list(_catalogs.values())}
+
+def get_lookup_samples():
+    samples = {}
+    for catalog in list(_catalogs.values()):
+        samples[(catalog.database_path, 'hit')] = catalog.hits
+        samples[(catalog.database_path, 'miss')] = catalog.misses
+    return samples
+
+metrics.registry.gauge('supermarket_catalog_lookups', 'Catalog product lookups, by cache result.',
+                       get_lookup_samples, ['database', 'result'])
+metrics.registry.gauge('supermarket_catalog_hit_ratio', 'Share of catalog product lookups served from memory.',
+                       lambda: get_catalog_samples('hit_rate'), ['database'])
+metrics.registry.gauge('supermarket_catalog_products', 'Products held by the in-memory catalog.',
+                       lambda: get_catalog_samples('size'), ['database'])
+metrics.registry.gauge('supermarket_catalog_version', 'Catalog version, bumped on every product change.',
+                       lambda: {(catalog.database_path,): catalog.version for catalog in list(_catalogs.values())}, ['database'])
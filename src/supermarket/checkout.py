@@ -1,27 +1,160 @@
-import sqlite3
-import logging
-from .scheme import Scheme
-from .database import Database
+from .basket import Basket
+from . import pricing_category as pc
+from . import metrics
+import time
+import array
 
+# a Checkout keeps a running total while items are scanned: each scan (or unscan) adds the item's
+#   simple price and re-evaluates only the pricing categories attached to that SKU in the scheme's
+#   compiled PricingPlan. getTotal then sums the cached subtotals in scheme order, which gives
+#   exactly the same result as a full Scheme.get_total recompute.
+# `scheme` is a Scheme, or a SchemeSnapshot to price with prices frozen when the snapshot was taken.
+#   a Checkout belongs to one lane and is not shared between threads, but any number of checkouts
+#   may share a scheme.
+# the scanned items are kept in a compact Basket of SKU -> quantity, and the rule subtotals in a pair
+#   of parallel arrays rather than a dict, to keep the memory of an in-flight basket small.
+# with a `scan_log` (see scan_log.ScanLog), every scan, unscan and close of the basket is durably logged
+#   as the basket `basket_id` of `lane` before the call returns.
 class Checkout:
-    def __init__(self, scheme):
+    __slots__ = ('scheme', 'items', 'debug', 'plan', 'simple_subtotal', 'simple_exact', 'rule_indices', 'rule_subtotals',
+                 'scan_log', 'lane', 'basket_id')
+
+    def __init__(self, scheme, debug = False, scan_log = None, lane = None, basket_id = None):
         self.scheme = scheme
-        self.items = {}
+        self.items = Basket()
+        self.debug = debug  # check every running total against a full recompute
+        self.scan_log = scan_log
+        self.lane = lane
+        if scan_log is not None and basket_id is None:
+            basket_id = scan_log.open_basket(lane)
+        self.basket_id = basket_id
+        self.plan = None  # plan the running subtotals were computed with
+        self.simple_subtotal = 0  # sum of price * quantity over the basket
+        self.simple_exact = True  # False once a non-integer price makes the running sum inexact
+        # plan rule index and subtotal of every rule touched by the basket
+        self.rule_indices = array.array('i')
+        self.rule_subtotals = array.array('d')
 
     def scan(self, sku):
-        with Database() as db:
-            try: 
-                db.execute('SELECT Id FROM products WHERE SKU=(?)', (sku,))
-                record = db.fetchall()
-                if len(record) == 0:
-                    raise ValueError('Requested product SKU %s does not match any products in the database' % sku)
-            except sqlite3.Error as err:
-                logging.getLogger('Checkout').error('Error occurred attempting to fetch product Id: %s' % str(err))
+        if metrics.enabled:
+            started = time.perf_counter()
+            queries = metrics.get_thread_query_count()
+            try:
+                self.scan_item(sku)
+            finally:
+                metrics.CHECKOUT_SCAN_SECONDS.observe(time.perf_counter() - started)
+                metrics.CHECKOUT_SCAN_QUERIES.observe(metrics.get_thread_query_count() - queries)
+        else:
+            self.scan_item(sku)
+        if self.scan_log is not None:
+            self.scan_log.append(self.lane, self.basket_id, 'scan', sku)
+
+    def scan_item(self, sku):
+        # the SKU is validated against the compiled plan, or failing that the in-memory catalog,
+        #   rather than a database round trip
+        plan = self.get_plan()
+        if sku in plan.prices:
+            self.items.add(sku, 1)
+            self.add_running_total(plan, sku, 1)
+        elif self.scheme.has_product(sku):
+            self.items.add(sku, 1)
+            self.update_running_total(sku, 1)  # finding the product may have changed the plan
+        else:
+            raise ValueError('Requested product SKU %s does not match any products in the database' % sku)
+
+    # removes one previously scanned item from the basket, e.g. to void a scan
+    def unscan(self, sku):
+        self.unscan_item(sku)
+        if self.scan_log is not None:
+            self.scan_log.append(self.lane, self.basket_id, 'unscan', sku)
+
+    def unscan_item(self, sku):
+        if sku not in self.items:
+            raise ValueError('Requested product SKU %s has not been scanned' % sku)
+        self.items.add(sku, -1)
+        self.update_running_total(sku, -1)
+
+    # re-applies logged (op, sku) basket events without logging them again, e.g. to restore a basket
+    #   from ScanLog.read_open_baskets
+    def replay(self, events):
+        for op, sku in events:
+            if op == 'scan':
+                self.scan_item(sku)
+            elif op == 'unscan':
+                self.unscan_item(sku)
+
+    # the basket's final total, logged as the close of the basket
+    def close(self):
+        total = self.getTotal()
+        if self.scan_log is not None:
+            self.scan_log.append(self.lane, self.basket_id, 'close', None, total)
+        return total
+
+    # returns the scheme's current plan, recomputing every running subtotal if the plan changed
+    def get_plan(self):
+        plan = self.scheme.compile()
+        if plan is not self.plan:
+            self.plan = plan
+            self.simple_subtotal = 0
+            self.simple_exact = True
+            for sku, quantity in self.items.items():
+                self.add_simple(plan.get_price(sku) * quantity)
+            self.rule_indices = array.array('i')
+            self.rule_subtotals = array.array('d')
+            for index in plan.get_rule_indices(self.items.keys()):
+                if index not in plan.always_rules:
+                    self.set_rule_subtotal(index, plan.rules[index].evaluate(self.items, plan.get_price))
+        return plan
+
+    def set_rule_subtotal(self, index, subtotal):
         try:
-            self.items[sku] += 1
-        except KeyError:
-            self.items[sku] = 1
+            self.rule_subtotals[self.rule_indices.index(index)] = subtotal
+        except ValueError:
+            self.rule_indices.append(index)
+            self.rule_subtotals.append(subtotal)
+
+    def add_simple(self, amount):
+        if type(amount) is not int:
+            self.simple_exact = False
+        self.simple_subtotal += amount
+
+    def update_running_total(self, sku, quantity):
+        plan = self.plan
+        if self.get_plan() is not plan:
+            return  # the whole basket was just re-evaluated against the new plan
+        self.add_running_total(plan, sku, quantity)
+
+    # adds a scan (or unscan) of `quantity` items to the running subtotals of the current plan
+    def add_running_total(self, plan, sku, quantity):
+        self.add_simple(plan.get_price(sku) * quantity)
+        for index in plan.rules_by_sku.get(sku, ()):
+            self.set_rule_subtotal(index, plan.rules[index].evaluate(self.items, plan.get_price))
 
     # Apply scheme to all items and sum up total cost
     def getTotal(self):
-        return self.scheme.get_total(self.items)
\ No newline at end of file
+        if not metrics.enabled:
+            return self.get_total()
+        started = time.perf_counter()
+        try:
+            return self.get_total()
+        finally:
+            metrics.CHECKOUT_TOTAL_SECONDS.observe(time.perf_counter() - started)
+
+    def get_total(self):
+        plan = self.get_plan()
+        rule_subtotals = dict(zip(self.rule_indices, self.rule_subtotals))
+        total = 0.0
+        for index in sorted(set(plan.always_rules).union(rule_subtotals)):
+            rule = plan.rules[index]
+            if index in rule_subtotals:
+                total += rule_subtotals[index]
+            elif isinstance(rule, pc.Simple) and self.simple_exact:
+                total += self.simple_subtotal
+            else:
+                total += rule.evaluate(self.items, plan.get_price)
+        total = int(total)
+        if self.debug:
+            expected = self.scheme.get_total(self.items)
+            if total != expected:
+                raise RuntimeError('Running total %d does not match recomputed total %d' % (total, expected))
+        return total
@@ -1,32 +1,169 @@
+import os
 import sqlite3
-import logging
+import time
+import threading
+import contextlib
+import contextvars
+from . import migrations
+from . import metrics
 
 # sqlite3 database wrapper that allows using `with` blocks to safely encapsulate database calls.
 # inside a `with` statment, e.g. `with Database('example.db') as db:`, only `execute` calls
-#   must be performed. upon exiting the `with` block, the connection will commit the transactions.
-# NOTE: this implementation is not thread safe.
+#   must be performed. upon exiting the `with` block, the connection will commit the transactions,
+#   unless the block was opened with `read_only=True`.
+# the database path is given per instance, e.g. `Database('example.db')`, or else taken from the current
+#   context: a path set with `with Database.use('example.db'):` in the calling thread or asyncio task, or
+#   failing that the process-wide default `Database.database_path`.
+# connections are pooled: every thread keeps one persistent connection per database path, opened
+#   on first use and configured with `Database.pragmas`. a thread never shares its connection with
+#   another, so `Database` may be used freely from a thread pool. connections are also keyed by
+#   process id, so a forked worker process never reuses a connection inherited from its parent.
+# blocks may be nested within a thread, e.g. a product lookup inside a write block. only the outermost
+#   block on a connection commits or rolls back the transaction; a nested block runs inside a savepoint,
+#   which it releases on success and rolls back to (leaving the outer block's writes alone) if it is read
+#   only or exits with an exception.
+# database path set with Database.use for the current thread or asyncio task
+_context_database_path = contextvars.ContextVar('supermarket_database_path', default=None)
+
 class Database:
-    database_path = None
-    def __init__(self, database_path = None):
-        if database_path is not None:
-            Database.database_path = database_path
-        self.log = logging.getLogger('Database_' + str(Database.database_path))
-        if Database.database_path is None:
+    database_path = None  # process-wide default database path
+    # applied, in order, to every newly opened connection
+    pragmas = {
+        'journal_mode': 'WAL',  # readers don't block the writer and vice versa
+        'synchronous': 'NORMAL',  # safe with WAL, fsyncs at checkpoints rather than every commit
+        'cache_size': -8000,  # negative values are in KiB, i.e. an 8MB page cache
+        'mmap_size': 67108864  # 64MB of memory mapped I/O
+    }
+    auto_migrate = True  # bring the schema up to date whenever a new connection is opened
+    # (process id, thread id, database path) -> sqlite3 connection
+    _connections = {}
+    _connections_lock = threading.Lock()
+    # pool keys of the connections whose statements are counted by metrics
+    _traced = set()
+    # pool key -> the `with` blocks open on the connection, outermost first. a pool key belongs to a single thread.
+    _blocks = {}
+
+    def __init__(self, database_path = None, read_only = False):
+        if database_path is None:
+            database_path = Database.get_database_path()
+        if database_path is None:
             raise ValueError('Please set a path to the database before attempting to use it')
+        self.database_path = database_path
+        self.read_only = read_only
         self.connection = None
         self.cursor = None
+        self.started = None
+        self.key = None  # pool key of the connection, while the block is open
+        self.savepoint = None  # savepoint name of a nested block
+
+    # returns the database path of the current context, see the class comment
+    @staticmethod
+    def get_database_path():
+        database_path = _context_database_path.get()
+        return database_path if database_path is not None else Database.database_path
+
+    # sets the database path for the rest of a `with` block in the current thread or asyncio task only
+    @staticmethod
+    @contextlib.contextmanager
+    def use(database_path):
+        token = _context_database_path.set(database_path)
+        try:
+            yield database_path
+        finally:
+            _context_database_path.reset(token)
+
+    # returns the calling thread's persistent connection to the database, opening it if needed
+    @staticmethod
+    def get_connection(database_path):
+        key = Database.get_pool_key(database_path)
+        connection = Database._connections.get(key)
+        if connection is None:
+            connection = sqlite3.connect(database_path, check_same_thread=False)
+            for pragma, value in Database.pragmas.items():
+                connection.execute('PRAGMA %s=%s' % (pragma, value))
+            if Database.auto_migrate:
+                migrations.migrate(connection)
+            with Database._connections_lock:
+                Database._connections[key] = connection
+            if metrics.enabled:
+                metrics.DB_CONNECTIONS_OPENED.inc()
+        if metrics.enabled and key not in Database._traced:
+            connection.set_trace_callback(metrics.count_query)
+            Database._traced.add(key)
+        return connection
+
+    @staticmethod
+    def get_pool_key(database_path):
+        return (os.getpid(), threading.get_ident(), database_path)
+
+    # closes the pooled connections of every thread, for one database path or for all of them.
+    # must be called before the database file is moved or deleted.
+    @staticmethod
+    def close_connections(database_path = None):
+        with Database._connections_lock:
+            keys = [key for key in Database._connections if database_path is None or key[2] == database_path]
+            # connections inherited from a parent process are only forgotten, never closed from the child
+            connections = [Database._connections.pop(key) for key in keys if key[0] == os.getpid()]
+            for key in keys:
+                Database._connections.pop(key, None)
+                Database._traced.discard(key)
+                Database._blocks.pop(key, None)
+        for connection in connections:
+            connection.close()
 
     def __enter__(self):
-        self.log.debug('Opening SQLite3 database connection...')
-        self.connection = sqlite3.connect(Database.database_path)
+        if metrics.enabled:
+            self.started = time.perf_counter()
+        self.connection = Database.get_connection(self.database_path)
+        self.key = Database.get_pool_key(self.database_path)
+        blocks = Database._blocks.setdefault(self.key, [])
+        blocks.append(self)
         self.cursor = self.connection.cursor()
+        if len(blocks) > 1:
+            self.savepoint = 'supermarket_%d' % (len(blocks) - 1)
+            try:
+                if not blocks[0].read_only and not self.connection.in_transaction:
+                    # the outermost write block owns the transaction, a savepoint opened outside one would
+                    #   commit on release
+                    self.cursor.execute('BEGIN')
+                self.cursor.execute('SAVEPOINT %s' % self.savepoint)
+            except BaseException:
+                self.release()
+                raise
         return self.cursor
+
+    # forgets the block on its connection
+    def release(self):
+        blocks = Database._blocks.get(self.key)
+        if blocks:
+            blocks.pop()
+            if not blocks:
+                del Database._blocks[self.key]
+        self.key = None
+        self.savepoint = None
     
+    # an exception leaving the block rolls back its writes and propagates to the caller. sqlite3.Error is
+    #   expected to be handled inside the block, so anything else reaching here is a bug in the caller.
     def __exit__(self, exc_type, exc_value, tb):
-        if exc_type is not None:
-            import traceback
-            traceback.print_exception(exc_type, exc_value, tb)
-        self.connection.commit()
-        self.connection.close()
-        self.log.debug('Closed database connection.')
-        return True
\ No newline at end of file
+        try:
+            if self.savepoint is not None:
+                if exc_type is not None or self.read_only:
+                    self.cursor.execute('ROLLBACK TO %s' % self.savepoint)
+                self.cursor.execute('RELEASE %s' % self.savepoint)
+            elif exc_type is not None or self.read_only:
+                # a read only block must not leave a write pending on the shared connection either
+                if self.connection.in_transaction:
+                    self.connection.rollback()
+            else:
+                self.connection.commit()
+        finally:
+            self.cursor.close()
+            self.release()
+        if self.started is not None:
+            mode = ('read',) if self.read_only else ('write',)
+            metrics.DB_BLOCKS.inc(1, mode)
+            metrics.DB_BLOCK_SECONDS.observe(time.perf_counter() - self.started, mode)
+            if exc_type is not None:
+                metrics.DB_ERRORS.inc()
+            self.started = None
+        return False
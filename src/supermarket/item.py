@@ -1,11 +1,19 @@
 # TODO: imports
+import sys
 import sqlite3
+import weakref
+import itertools
 from .database import Database
-import logging
+from .log import get_logger
 
+# Items are kept for every product in the in-memory catalog, so they hold nothing but their fields
 class Item:
+    __slots__ = ('sku', 'name', 'price')
+
+    # objects with a `products_changed(skus, database_path)` method, notified whenever product records are written
+    change_listeners = weakref.WeakSet()
+
     def __init__(self, sku, name, price):
-        self.log = logging.getLogger('Item_' + name)
         self.sku = sku
         self.name = name
         self.price = price
@@ -17,37 +25,186 @@ class Item:
                 item_args = (self.sku, self.name, self.price)
                 db.execute('INSERT INTO products(SKU, name, price) VALUES (?, ?, ?)', item_args)  # safe insertion of variables
             except sqlite3.Error as err:
-                self.log.error('Error occurred attempting to write a new product to the database: %s' % str(err))
+                get_logger('Item').error('Error occurred attempting to write a new product to the database: %s' % str(err))
+        Item.notify_changed([self.sku], Database.get_database_path())
+
+    # bulk loads products from an iterable of Items or (sku, name, price) rows, updating the name and
+    #   price of any SKU that already exists. rows are written with executemany, `chunk_size` rows per
+    #   transaction. rows without a SKU or name, or whose price is not an integer, are rejected.
+    # returns a dict with the number of rows inserted, updated and rejected.
+    @staticmethod
+    def create_products(products, chunk_size = 5000):
+        counts = {'inserted': 0, 'updated': 0, 'rejected': 0}
+        changed = []
+        products = iter(products)
+        while True:
+            chunk = list(itertools.islice(products, chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for product in chunk:
+                row = Item.validate_row(product)
+                if row is None:
+                    counts['rejected'] += 1
+                else:
+                    rows.append(row)
+            # a failing chunk leaves its `with` block with the error, so that the block rolls back its own
+            #   writes (a savepoint when nested in an outer block) and the whole chunk is rejected
+            try:
+                with Database() as db:
+                    existing = set()
+                    skus = list(set(row[0] for row in rows))
+                    for start in range(0, len(skus), 500):
+                        batch = skus[start:start + 500]
+                        db.execute('SELECT SKU FROM products WHERE SKU IN (%s)' % ','.join('?' * len(batch)), batch)
+                        existing.update(record[0] for record in db.fetchall())
+                    db.executemany('INSERT INTO products(SKU, name, price) VALUES (?, ?, ?) '
+                                   'ON CONFLICT(SKU) DO UPDATE SET name=excluded.name, price=excluded.price', rows)
+                inserted = 0
+                for row in rows:
+                    if row[0] not in existing:
+                        inserted += 1
+                        existing.add(row[0])  # repeats later in the chunk are updates
+                counts['inserted'] += inserted
+                counts['updated'] += len(rows) - inserted
+                changed.extend(skus)
+            except sqlite3.Error as err:
+                counts['rejected'] += len(rows)
+                get_logger('Item').error('Error occurred attempting to bulk write products to the database: %s' % str(err))
+        if changed:
+            Item.notify_changed(changed, Database.get_database_path())
+        return counts
 
-    # returns an Item instance with the data from the SKU record in the database
+    # returns a (sku, name, price) tuple for an Item or row, or None if the row is not a valid product
     @staticmethod
-    def read_product(sku):
+    def validate_row(product):
+        if isinstance(product, Item):
+            product = (product.sku, product.name, product.price)
+        try:
+            sku, name, price = product
+            if sku is None or name is None:
+                return None
+            sku = str(sku).strip()
+            name = str(name).strip()
+            if isinstance(price, float) or isinstance(price, bool):
+                raise ValueError('price must be an integer number of cents')
+            price = int(price)
+        except (TypeError, ValueError):
+            return None
+        if not sku or not name:
+            return None
+        return (sku, name, price)
+
+    # bulk loads products from a CSV file with sku, name and price columns, see create_products
+    @staticmethod
+    def import_csv(path, chunk_size = 5000):
+        import csv
+        with open(path, 'r', encoding='utf-8', newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            rows = ((row.get('sku'), row.get('name'), row.get('price')) for row in reader)
+            return Item.create_products(rows, chunk_size)
+
+    # registers a caching layer to be told which SKUs changed after each product write
+    @staticmethod
+    def add_change_listener(listener):
+        Item.change_listeners.add(listener)
+
+    @staticmethod
+    def notify_changed(skus, database_path):
+        for listener in list(Item.change_listeners):
+            listener.products_changed(skus, database_path)
+
+    # returns an Item instance with the data from the SKU record in the database, or None if there is no such record
+    @staticmethod
+    def read_product(sku, database_path = None):
         item = None
-        with Database() as db:
+        with Database(database_path, read_only=True) as db:
             try:
                 db.execute('SELECT * FROM products WHERE SKU=(?)', (sku,))
                 result = db.fetchone()
-                item = Item(result[1], result[2], result[3])
+                if result is not None:
+                    item = Item(result[1], result[2], result[3])
             except sqlite3.Error as err:
-                logging.getLogger('Item').error('Error occurred attempting to read product %s from the database: %s' % (sku, str(err)))
+                get_logger('Item').error('Error occurred attempting to read product %s from the database: %s' % (sku, str(err)))
         return item
 
-    # updates the product record in the database for this SKU
+    # updates the name and price of the product record in the database for this SKU
     def update_product(self):
-        raise NotImplementedError
+        if Item.update_products([self]) == 0:
+            raise ValueError('Requested product SKU %s does not match any products in the database' % self.sku)
+
+    # updates the product records for an iterable of Items or (sku, name, price) rows, `chunk_size`
+    #   rows per transaction. returns the number of products updated; SKUs that don't exist are ignored.
+    @staticmethod
+    def update_products(products, chunk_size = 5000):
+        updated = 0
+        changed = []
+        products = iter(products)
+        while True:
+            chunk = list(itertools.islice(products, chunk_size))
+            if not chunk:
+                break
+            rows = [row for row in map(Item.validate_row, chunk) if row is not None]
+            with Database() as db:
+                try:
+                    db.executemany('UPDATE products SET name=(?), price=(?) WHERE SKU=(?)', [(row[1], row[2], row[0]) for row in rows])
+                    updated += max(db.rowcount, 0)
+                    changed.extend(row[0] for row in rows)
+                except sqlite3.Error as err:
+                    get_logger('Item').error('Error occurred attempting to update products in the database: %s' % str(err))
+        if changed:
+            Item.notify_changed(changed, Database.get_database_path())
+        return updated
 
+    # deletes the product record in the database for this SKU
     @staticmethod
     def delete_product(sku):
-        raise NotImplementedError
+        if Item.delete_products([sku]) == 0:
+            raise ValueError('Requested product SKU %s does not match any products in the database' % sku)
+
+    # deletes the product records for an iterable of SKUs, `chunk_size` SKUs per transaction.
+    # returns the number of products deleted; SKUs that don't exist are ignored.
+    @staticmethod
+    def delete_products(skus, chunk_size = 5000):
+        deleted = 0
+        changed = []
+        skus = iter(skus)
+        while True:
+            chunk = list(itertools.islice(skus, chunk_size))
+            if not chunk:
+                break
+            with Database() as db:
+                try:
+                    db.executemany('DELETE FROM products WHERE SKU=(?)', [(sku,) for sku in chunk])
+                    deleted += max(db.rowcount, 0)
+                    changed.extend(chunk)
+                except sqlite3.Error as err:
+                    get_logger('Item').error('Error occurred attempting to delete products from the database: %s' % str(err))
+        if changed:
+            Item.notify_changed(changed, Database.get_database_path())
+        return deleted
 
     @staticmethod
     def get_skus():
         skus = []
-        with Database() as db:
+        with Database(read_only=True) as db:
             try:
                 db.execute('SELECT DISTINCT SKU FROM products')
                 skus = db.fetchall()
             except sqlite3.Error as err:
-                logging.getLogger('Item').error('Error occurred attempting to fetch product SKUs: %s' % str(err))
+                get_logger('Item').error('Error occurred attempting to fetch product SKUs: %s' % str(err))
         return [sku[0] for sku in skus]
 
+def main(argv = None):
+    import argparse  # imported here so that importing Item does not load it
+    parser = argparse.ArgumentParser(description='Bulk import products from a CSV file with sku, name and price columns.')
+    parser.add_argument('database', help='path to the supermarket database')
+    parser.add_argument('csv', help='CSV file to import')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows written per transaction')
+    args = parser.parse_args(argv)
+    Database.database_path = args.database
+    counts = Item.import_csv(args.csv, args.chunk_size)
+    sys.stdout.write('inserted %(inserted)d, updated %(updated)d, rejected %(rejected)d\n' % counts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# named loggers of the package that only import the logging module once something is logged.
+# the package logs nothing but errors, so a lane terminal that never hits one starts without paying for
+#   logging (and the traceback, string and linecache modules it pulls in). a Logger forwards every
+#   attribute to the logging.Logger of the same name, so `get_logger(name).error(...)` behaves exactly
+#   like `logging.getLogger(name).error(...)`.
+class Logger:
+    __slots__ = ('name', 'logger')
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = None
+
+    def __getattr__(self, attribute):
+        logger = self.logger
+        if logger is None:
+            import logging
+            logger = self.logger = logging.getLogger(self.name)
+        return getattr(logger, attribute)
+
+# name -> Logger
+_loggers = {}
+
+def get_logger(name):
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers.setdefault(name, Logger(name))
+    return logger
@@ -0,0 +1,211 @@
+import os
+import bisect
+import threading
+
+# optional, in-process instrumentation of the hot paths: counters, latency histograms and collectors
+#   for state that is already tracked elsewhere (e.g. catalog hit/miss counts).
+# instrumentation is off by default, and every instrumented call site checks the module level `enabled`
+#   flag before doing any work, so the cost when disabled is one global lookup. turn it on with
+#   `metrics.enable()` or by setting SUPERMARKET_METRICS=1 in the environment, read the values with
+#   `registry.get_samples()` and expose them with `registry.dump_prometheus()` (Prometheus text format).
+
+enabled = os.environ.get('SUPERMARKET_METRICS', '') not in ('', '0')
+
+# upper bounds in seconds of the default latency histogram buckets, from 5us to 1s
+DEFAULT_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def format_labels(labelnames, labelvalues, extra = ()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                              for name, value in pairs])
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+# monotonically increasing count, optionally split by label values
+class Counter:
+    metric_type = 'counter'
+
+    def __init__(self, name, help, labelnames = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}  # label values tuple -> count
+
+    def inc(self, amount = 1, labels = ()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels = ()):
+        return self.values.get(labels, 0)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    # returns a list of (sample name, labels string, value)
+    def get_samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [(self.name + '_total', format_labels(self.labelnames, labels), value) for labels, value in values]
+
+# distribution of observed values (latencies in seconds by default) over cumulative buckets
+class Histogram:
+    metric_type = 'histogram'
+
+    def __init__(self, name, help, labelnames = (), buckets = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}  # label values tuple -> [per bucket counts (+ overflow), sum, count]
+
+    def observe(self, value, labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get_count(self, labels = ()):
+        state = self.values.get(labels)
+        return state[2] if state is not None else 0
+
+    def get_sum(self, labels = ()):
+        state = self.values.get(labels)
+        return state[1] if state is not None else 0
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def get_samples(self):
+        samples = []
+        with self.lock:
+            values = sorted((labels, (list(state[0]), state[1], state[2])) for labels, state in self.values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((self.name + '_bucket', format_labels(self.labelnames, labels, [('le', format_value(bound))]), cumulative))
+            samples.append((self.name + '_sum', format_labels(self.labelnames, labels), total))
+            samples.append((self.name + '_count', format_labels(self.labelnames, labels), count))
+        return samples
+
+# point in time values read from a callback when the registry is collected, for state that is kept
+#   by another object. the callback returns a dict of label values tuple -> value.
+class Gauge:
+    metric_type = 'gauge'
+
+    def __init__(self, name, help, callback, labelnames = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def reset(self):
+        pass
+
+    def get_samples(self):
+        return [(self.name, format_labels(self.labelnames, labels), value) for labels, value in sorted(self.callback().items())]
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> metric, in registration order
+
+    # registers a metric, or returns the metric already registered under its name
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError("Metric '%s' is already registered as a %s" % (metric.name, existing.metric_type))
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames = ()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames = (), buckets = DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, callback, labelnames = ()):
+        return self.register(Gauge(name, help, callback, labelnames))
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    # zeroes every counter and histogram, e.g. between benchmark runs
+    def reset(self):
+        for metric in list(self.metrics.values()):
+            metric.reset()
+
+    # returns a dict of sample name + labels -> value for every metric
+    def get_samples(self):
+        samples = {}
+        for metric in list(self.metrics.values()):
+            for name, labels, value in metric.get_samples():
+                samples[name + labels] = value
+        return samples
+
+    # Prometheus text exposition format (version 0.0.4)
+    def dump_prometheus(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.metric_type))
+            for name, labels, value in metric.get_samples():
+                lines.append('%s%s %s' % (name, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# number of SQL statements run on the calling thread's connections while metrics are enabled,
+#   to attribute queries to the operation that ran them (e.g. queries per scan)
+_thread_queries = threading.local()
+
+def get_thread_query_count():
+    return getattr(_thread_queries, 'count', 0)
+
+def count_query(statement):
+    if not enabled:
+        return
+    _thread_queries.count = getattr(_thread_queries, 'count', 0) + 1
+    DB_QUERIES.inc()
+
+DB_CONNECTIONS_OPENED = registry.counter('supermarket_db_connections_opened', 'Pooled sqlite3 connections opened.')
+DB_QUERIES = registry.counter('supermarket_db_queries', 'SQL statements run on traced connections.')
+DB_BLOCKS = registry.counter('supermarket_db_blocks', 'Database `with` blocks, by mode.', ['mode'])
+DB_ERRORS = registry.counter('supermarket_db_errors', 'Database `with` blocks that exited with an exception.')
+DB_BLOCK_SECONDS = registry.histogram('supermarket_db_block_seconds', 'Time spent inside Database `with` blocks.', ['mode'])
+CHECKOUT_SCAN_SECONDS = registry.histogram('supermarket_checkout_scan_seconds', 'Latency of Checkout.scan.')
+CHECKOUT_SCAN_QUERIES = registry.histogram('supermarket_checkout_scan_queries', 'SQL statements run per Checkout.scan.',
+                                           buckets=(0, 1, 2, 5, 10, 25, 100))
+CHECKOUT_TOTAL_SECONDS = registry.histogram('supermarket_checkout_total_seconds', 'Latency of Checkout.getTotal.')
+SCHEME_READS = registry.counter('supermarket_scheme_reads', 'Scheme.read_scheme calls, by cache result.', ['result'])
+SCHEME_COMPILES = registry.counter('supermarket_scheme_compiles', 'Scheme.compile calls, by cache result.', ['result'])
+SCHEME_TOTAL_CACHE = registry.counter('supermarket_scheme_total_cache', 'Scheme.get_total total cache lookups, by result.', ['result'])
+SCHEME_TOTAL_SECONDS = registry.histogram('supermarket_scheme_total_seconds', 'Latency of Scheme.get_total.')
+RULE_SECONDS = registry.histogram('supermarket_rule_seconds', 'Time per PricingCategory.get_subtotal, by category type.', ['type'])
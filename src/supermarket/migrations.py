@@ -0,0 +1,99 @@
+from .log import get_logger
+
+# versioned schema migrations for the supermarket database.
+# the schema version is kept in sqlite's `PRAGMA user_version`. `migrate` applies every migration
+#   newer than the database's version, each in its own transaction, so existing databases such as
+#   supermarket_exercise.db are upgraded in place the first time they are opened.
+
+# SELECT of (row id, position, value) for every comma separated value of a legacy TEXT column, splitting
+#   it with a recursive query so that the values may hold any character but the comma
+def split_text_column(table, id_column, column):
+    return ("WITH RECURSIVE split(id, position, value, rest) AS ("
+            "SELECT %s, -1, NULL, %s || ',' FROM %s WHERE %s IS NOT NULL AND %s != '' "
+            "UNION ALL SELECT id, position + 1, substr(rest, 1, instr(rest, ',') - 1), substr(rest, instr(rest, ',') + 1) "
+            "FROM split WHERE rest != '') "
+            "SELECT id, position, value FROM split WHERE position >= 0" % (id_column, column, table, column, column))
+
+# tables holding scheme and pricing category definitions
+DEFINITION_TABLES = ['schemes', 'scheme_pcrefs', 'pcrefs', 'pc_buyxgety', 'pc_taxes', 'pc_bundled', 'bundle_skus']
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, 'base tables', [
+        'CREATE TABLE IF NOT EXISTS products (Id INTEGER PRIMARY KEY, SKU TEXT UNIQUE, name TEXT, price INTEGER)',
+        'CREATE TABLE IF NOT EXISTS schemes (Id INTEGER PRIMARY KEY, name TEXT UNIQUE, pcrefids TEXT)',
+        'CREATE TABLE IF NOT EXISTS pcrefs (pcrefid INTEGER PRIMARY KEY, pctype TEXT, name TEXT)',
+        'CREATE TABLE IF NOT EXISTS pc_buyxgety (Id INTEGER PRIMARY KEY, sku  TEXT, x INTEGER, y INTEGER, name TEXT, pcrefid INTEGER UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS pc_taxes (Id INTEGER PRIMARY KEY, sku TEXT, tax_rate REAL, name TEXT, pcrefid INTEGER UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS pc_bundled (Id INTEGER PRIMARY KEY, price INTEGER, skus TEXT, name TEXT, pcrefid INTEGER UNIQUE)'
+    ]),
+    # schemes.pcrefids and pc_bundled.skus are comma joined TEXT. every read goes through the normalized
+    #   junction tables, which Scheme.create_scheme and Bundled.create_pricing_category write in the same
+    #   transaction as the parent row; the legacy columns are only kept as a mirror for older readers.
+    (2, 'scheme and bundle junction tables, SKU and pcref indexes', [
+        'CREATE TABLE scheme_pcrefs (scheme_id INTEGER NOT NULL, position INTEGER NOT NULL, pcrefid INTEGER NOT NULL, '
+        'PRIMARY KEY (scheme_id, position)) WITHOUT ROWID',
+        'CREATE INDEX scheme_pcrefs_pcrefid ON scheme_pcrefs(pcrefid, scheme_id)',
+        'CREATE TABLE bundle_skus (pcrefid INTEGER NOT NULL, position INTEGER NOT NULL, sku TEXT NOT NULL, '
+        'PRIMARY KEY (pcrefid, position)) WITHOUT ROWID',
+        'CREATE INDEX bundle_skus_sku ON bundle_skus(sku, pcrefid)',
+        'CREATE INDEX pc_buyxgety_sku ON pc_buyxgety(sku, pcrefid)',
+        'CREATE INDEX pc_taxes_sku ON pc_taxes(sku, pcrefid)',
+        'CREATE INDEX pcrefs_name_pctype ON pcrefs(name, pctype, pcrefid)',
+
+        'INSERT INTO scheme_pcrefs(scheme_id, position, pcrefid) SELECT id, position, CAST(value AS INTEGER) '
+        'FROM (%s)' % split_text_column('schemes', 'Id', 'pcrefids'),
+        'INSERT INTO bundle_skus(pcrefid, position, sku) SELECT id, position, value '
+        'FROM (%s) WHERE id IS NOT NULL' % split_text_column('pc_bundled', 'pcrefid', 'skus'),
+
+        'CREATE TRIGGER schemes_delete AFTER DELETE ON schemes BEGIN '
+        'DELETE FROM scheme_pcrefs WHERE scheme_id = OLD.Id; END',
+        'CREATE TRIGGER pc_bundled_delete AFTER DELETE ON pc_bundled BEGIN '
+        'DELETE FROM bundle_skus WHERE pcrefid = OLD.pcrefid; END'
+    ]),
+    # a single row counter bumped by triggers on every write to a scheme or pricing category table, from
+    #   any process, so that a SchemeRegistry can tell with one cheap query when its schemes are stale
+    (3, 'definitions version counter', [
+        'CREATE TABLE definitions_version (Id INTEGER PRIMARY KEY CHECK (Id = 1), version INTEGER NOT NULL)',
+        'INSERT INTO definitions_version(Id, version) VALUES (1, 0)'
+    ] + ['CREATE TRIGGER %s_%s_version AFTER %s ON %s BEGIN '
+         'UPDATE definitions_version SET version = version + 1 WHERE Id = 1; END' % (table, event.lower(), event, table)
+         for table in DEFINITION_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')]),
+    # basket events written behind the checkouts by ScanLog. every log numbers its own records, so rows are
+    #   keyed by the writing log's id and its sequence number.
+    (4, 'scan log', [
+        'CREATE TABLE scan_log (writer TEXT NOT NULL, seq INTEGER NOT NULL, lane TEXT NOT NULL, basket TEXT NOT NULL, '
+        'op TEXT NOT NULL, sku TEXT, total INTEGER, logged_at REAL NOT NULL, PRIMARY KEY (writer, seq)) WITHOUT ROWID',
+        'CREATE INDEX scan_log_basket ON scan_log(basket, writer, seq)'
+    ])
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+# applies every pending migration to an open sqlite3 connection. returns the list of versions applied.
+def migrate(connection):
+    applied = []
+    if get_version(connection) >= LATEST_VERSION:
+        return applied
+    log = get_logger('Migrations')
+    for version, description, statements in MIGRATIONS:
+        if connection.in_transaction:
+            connection.commit()
+        connection.execute('BEGIN IMMEDIATE')  # take the write lock before re-checking the version
+        try:
+            if get_version(connection) >= version:
+                connection.rollback()
+                continue
+            log.info('Migrating database to schema version %d: %s' % (version, description))
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute('PRAGMA user_version = %d' % version)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,83 @@
+# exact integer-cents arithmetic for pricing.
+# prices are whole cents, so every pricing category except AdditionalTaxes is exact in integers.
+#   a tax amount is rounded to whole cents once, per tax line, with one of the rounding modes below
+#   (named after the equivalent `decimal` module modes). the float engine instead adds fractional
+#   tax cents to the running total and truncates the grand total with int().
+# no mode reproduces the float totals in general. ROUND_DOWN truncates each tax line, while the float
+#   engine truncates their sum, so with several tax lines the float total can be higher by up to one cent
+#   less than the number of tax lines. float error on rates such as 9.25% can also put the float total
+#   one cent below the exact truncated total when that lands on a whole cent.
+
+ROUND_HALF_UP = 'ROUND_HALF_UP'  # nearest cent, ties away from zero
+ROUND_HALF_DOWN = 'ROUND_HALF_DOWN'  # nearest cent, ties towards zero
+ROUND_HALF_EVEN = 'ROUND_HALF_EVEN'  # nearest cent, ties to the even cent (banker's rounding)
+ROUND_DOWN = 'ROUND_DOWN'  # towards zero, per tax line (the float engine truncates the whole total instead)
+ROUND_UP = 'ROUND_UP'  # away from zero
+ROUND_FLOOR = 'ROUND_FLOOR'  # towards negative infinity
+ROUND_CEILING = 'ROUND_CEILING'  # towards positive infinity
+
+ROUNDING_MODES = (ROUND_HALF_UP, ROUND_HALF_DOWN, ROUND_HALF_EVEN, ROUND_DOWN, ROUND_UP, ROUND_FLOOR, ROUND_CEILING)
+
+DEFAULT_ROUNDING = ROUND_HALF_UP
+
+# integer division of numerator by a positive denominator, rounded with the given mode
+def divide(numerator, denominator, rounding = DEFAULT_ROUNDING):
+    quotient, remainder = divmod(numerator, denominator)  # quotient is floored
+    if remainder == 0 or rounding == ROUND_FLOOR:
+        return quotient
+    if rounding == ROUND_CEILING:
+        return quotient + 1
+    if rounding == ROUND_DOWN:
+        return quotient if numerator >= 0 else quotient + 1
+    if rounding == ROUND_UP:
+        return quotient + 1 if numerator >= 0 else quotient
+    twice = 2 * remainder
+    if twice < denominator:
+        return quotient
+    if twice > denominator:
+        return quotient + 1
+    # exactly half way between quotient and quotient + 1
+    if rounding == ROUND_HALF_UP:
+        return quotient + 1 if numerator >= 0 else quotient
+    if rounding == ROUND_HALF_DOWN:
+        return quotient if numerator >= 0 else quotient + 1
+    if rounding == ROUND_HALF_EVEN:
+        return quotient if quotient % 2 == 0 else quotient + 1
+    raise ValueError("Unknown rounding mode '%s'" % rounding)
+
+# vectorized divide for a numpy integer array of numerators
+def divide_array(numerators, denominator, rounding = DEFAULT_ROUNDING):
+    import numpy
+    quotients, remainders = numpy.divmod(numerators, denominator)
+    exact = remainders == 0
+    non_negative = numerators >= 0
+    if rounding == ROUND_FLOOR:
+        up = numpy.zeros_like(exact)
+    elif rounding == ROUND_CEILING:
+        up = ~exact
+    elif rounding == ROUND_DOWN:
+        up = ~exact & ~non_negative
+    elif rounding == ROUND_UP:
+        up = ~exact & non_negative
+    else:
+        twice = 2 * remainders
+        if rounding == ROUND_HALF_UP:
+            tie_up = non_negative
+        elif rounding == ROUND_HALF_DOWN:
+            tie_up = ~non_negative
+        elif rounding == ROUND_HALF_EVEN:
+            tie_up = quotients % 2 != 0
+        else:
+            raise ValueError("Unknown rounding mode '%s'" % rounding)
+        up = ~exact & ((twice > denominator) | ((twice == denominator) & tie_up))
+    return quotients + up
+
+# exact fraction for a percentage written as a decimal, e.g. 9.25 -> 37/400
+def percent_fraction(percent):
+    import fractions  # only the exact cents engine needs it, and it pulls in decimal and numbers
+    return fractions.Fraction(str(percent)) / 100
+
+# tax on an amount of cents at a percentage rate, rounded to whole cents
+def tax_cents(amount, percent, rounding = DEFAULT_ROUNDING):
+    rate = percent_fraction(percent)
+    return divide(amount * rate.numerator, rate.denominator, rounding)
@@ -0,0 +1,92 @@
+import sys
+import collections
+from .database import Database
+from .scheme import Scheme
+
+# generator based pipeline turning a stream of scan events into a stream of priced baskets:
+#   read_scan_events -> group_baskets -> price_baskets
+# each stage holds at most one open basket per lane, so memory stays bounded however long the input is.
+
+CSV_FIELDS = ('lane', 'basket', 'sku')
+
+# yields (lane id, basket id, SKU) tuples from CSV rows or JSON lines objects with lane, basket and
+#   sku fields. a CSV header row naming those fields is skipped.
+def read_scan_events(lines, format = 'csv'):
+    if format == 'csv':
+        import csv
+        for row in csv.reader(lines):
+            if not row or tuple(field.strip().lower() for field in row) == CSV_FIELDS:
+                continue
+            if len(row) != 3:
+                raise ValueError('Expected a lane, basket and sku per scan event, got: %s' % ','.join(row))
+            yield (row[0].strip(), row[1].strip(), row[2].strip())
+    elif format == 'jsonl':
+        import json
+        for line in lines:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                yield (str(event['lane']), str(event['basket']), str(event['sku']))
+    else:
+        raise ValueError("Unknown scan event format '%s', expected 'csv' or 'jsonl'" % format)
+
+# groups scan events into baskets on the fly, yielding (lane id, basket id, dict of SKU -> quantity)
+#   for each completed basket. a lane's basket is complete once the lane starts scanning another
+#   basket, or when the input ends. if `max_open_baskets` is set, the least recently scanned lane's
+#   basket is considered complete when too many are open at once.
+def group_baskets(events, max_open_baskets = None):
+    open_baskets = collections.OrderedDict()  # lane id -> (basket id, items), least recently scanned first
+    for lane, basket, sku in events:
+        current = open_baskets.get(lane)
+        if current is not None and current[0] != basket:
+            del open_baskets[lane]
+            yield (lane, current[0], current[1])
+            current = None
+        if current is None:
+            current = open_baskets[lane] = (basket, {})
+            if max_open_baskets is not None and len(open_baskets) > max_open_baskets:
+                oldest_lane, oldest = open_baskets.popitem(last=False)
+                yield (oldest_lane, oldest[0], oldest[1])
+        else:
+            open_baskets.move_to_end(lane)
+        items = current[1]
+        items[sku] = items.get(sku, 0) + 1
+    while open_baskets:
+        lane, current = open_baskets.popitem(last=False)
+        yield (lane, current[0], current[1])
+
+# yields (lane id, basket id, total) for each basket, priced with the scheme's compiled plan
+def price_baskets(baskets, scheme):
+    for lane, basket, items in baskets:
+        yield (lane, basket, scheme.compile().get_total(items))
+
+# runs the whole pipeline, writing one `lane,basket,total` CSV row per basket. returns the basket count.
+def run(lines, scheme, output, format = 'csv', max_open_baskets = None):
+    import csv
+    writer = csv.writer(output, lineterminator='\n')
+    count = 0
+    events = read_scan_events(lines, format)
+    for row in price_baskets(group_baskets(events, max_open_baskets), scheme):
+        writer.writerow(row)
+        count += 1
+    return count
+
+def main(argv = None):
+    import argparse  # imported here so that importing the pipeline stages does not load it
+    parser = argparse.ArgumentParser(description='Price a stream of scan events basket by basket.')
+    parser.add_argument('database', help='path to the supermarket database')
+    parser.add_argument('scheme', help='name of the pricing scheme')
+    parser.add_argument('events', nargs='?', default='-', help='scan event file, or - for stdin (default)')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='scan event format')
+    parser.add_argument('--max-open-baskets', type=int, default=None, help='bound on baskets held open at once')
+    args = parser.parse_args(argv)
+    Database.database_path = args.database
+    scheme = Scheme.read_scheme(args.scheme)
+    if args.events == '-':
+        run(sys.stdin, scheme, sys.stdout, args.format, args.max_open_baskets)
+    else:
+        with open(args.events, 'r', encoding='utf-8', newline='') as lines:
+            run(lines, scheme, sys.stdout, args.format, args.max_open_baskets)
+
+if __name__ == '__main__':
+    main()
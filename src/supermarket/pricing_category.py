@@ -1,31 +1,102 @@
 import sqlite3
-import logging
+import time
 from .database import Database
-from .item import Item
+from .log import get_logger
+from .catalog import get_catalog
+from . import money
+from . import metrics
 
+# pricing categories are shared by every plan and checkout of a scheme, and declare __slots__ to stay small
 class PricingCategory:
+    __slots__ = ()
+    # bumped whenever a pricing category or scheme definition is written, to tell cached schemes are stale
+    definitions_version = 0
+
     def __init__(self):
         pass
+
+    # abstract method
+    # hashable identity of this category's definition, used to de-duplicate price adjustments
+    def get_key(self):
+        raise NotImplementedError
+
+    # reads many pricing categories of this type at once, joining pcrefs against the category's own table.
+    # returns a dict of pcrefid -> pricing category
+    @classmethod
+    def read_pricing_categories(cls, pcrefids):
+        result = {}
+        pcrefids = list(pcrefids)
+        with Database(read_only=True) as db:
+            try:
+                for start in range(0, len(pcrefids), 500):
+                    chunk = pcrefids[start:start + 500]
+                    query = ('SELECT pcrefs.pcrefid, %s FROM pcrefs JOIN %s AS pc ON pc.pcrefid = pcrefs.pcrefid '
+                             'WHERE pcrefs.pctype=(?) AND pcrefs.pcrefid IN (%s)') % (cls.pc_columns, cls.pc_table, ','.join('?' * len(chunk)))
+                    db.execute(query, [cls.pc_type_string] + chunk)
+                    for record in db.fetchall():
+                        result[record[0]] = cls.from_record(record[1:])
+            except sqlite3.Error as err:
+                get_logger(cls.__name__).error('Error occurred attempting to fetch %s entries: %s' % (cls.__name__, str(err)))
+        return result
     
+    # subtotal of this category against the provided dict of checkout item quantities, using
+    #   `get_price(sku)` or else current prices from the product catalog of the current database
+    def get_subtotal(self, checkout_items, get_price = None):
+        if get_price is None:
+            get_price = get_catalog().get_price
+        if not metrics.enabled:
+            return self.evaluate(checkout_items, get_price)
+        started = time.perf_counter()
+        subtotal = self.evaluate(checkout_items, get_price)
+        metrics.RULE_SECONDS.observe(time.perf_counter() - started, (type(self).__name__,))
+        return subtotal
+
+    # abstract method
+    # subtotal of this category using `get_price(sku)` to resolve product prices
+    def evaluate(self, checkout_items, get_price):
+        raise NotImplementedError
+
+    # abstract method
+    # exact subtotal in integer cents; `rounding` is the money rounding mode for any fractional cents
+    def evaluate_cents(self, checkout_items, get_price, rounding = money.DEFAULT_ROUNDING):
+        raise NotImplementedError
+
     # abstract method
-    def get_subtotal(self, checkout_items):
-        raise NotImplementedError 
+    # returns the SKUs this category applies to, or None if it applies to every SKU
+    def get_skus(self):
+        raise NotImplementedError
 
 # Simple is a special case in that there is no need to permanently store a Simple object.
 #  simple prices are stored in the products table.
 class Simple(PricingCategory):
+    __slots__ = ()
+
     def __init__(self):
         PricingCategory.__init__(self)
 
-    def get_subtotal(self, checkout_items):
+    def evaluate(self, checkout_items, get_price):
         subtotal = 0.0 # price in cents (but Real)
-        for sku in checkout_items.keys():
-            checkout_item = Item.read_product(sku)
-            subtotal += checkout_item.price * checkout_items[sku] # multiply price by quantity
+        for sku, quantity in checkout_items.items():
+            subtotal += get_price(sku) * quantity # multiply price by quantity
+        return subtotal
+
+    def evaluate_cents(self, checkout_items, get_price, rounding = money.DEFAULT_ROUNDING):
+        subtotal = 0
+        for sku, quantity in checkout_items.items():
+            subtotal += int(get_price(sku)) * quantity
         return subtotal
 
+    def get_skus(self):
+        return None
+
+    def get_key(self):
+        return ('simple',)
+
 class BuyXGetYFree(PricingCategory):
+    __slots__ = ('sku', 'x', 'y', 'name')
     pc_type_string = 'buyxgetyfree'
+    pc_table = 'pc_buyxgety'
+    pc_columns = 'pc.sku, pc.x, pc.y, pc.name'
     def __init__(self, sku, x, y, name):
         self.x = int(x)
         self.y = int(y)
@@ -33,29 +104,48 @@ class BuyXGetYFree(PricingCategory):
         self.name = name
         PricingCategory.__init__(self)
 
-    def get_subtotal(self, checkout_items):
+    def evaluate(self, checkout_items, get_price):
         subtotal = 0.0
         quantity = checkout_items.get(self.sku)
         if quantity is None:
             return subtotal
         else:
-            progress = 0
-            free = 0
-            discount = 0
-            for i in range(quantity):
-                if progress < self.x and free < self.y:
-                    progress += 1
-                elif progress == self.x and free < self.y:
-                    free += 1
-                    discount += 1
-                elif progress == self.x and free == self.y:
-                    progress = 0
-                    free = 0
-
-            item = Item.read_product(self.sku)
-            subtotal -= item.price * discount
+            subtotal -= get_price(self.sku) * self.get_free_count(quantity)
             return subtotal
 
+    def evaluate_cents(self, checkout_items, get_price, rounding = money.DEFAULT_ROUNDING):
+        quantity = checkout_items.get(self.sku)
+        if quantity is None:
+            return 0
+        return -int(get_price(self.sku)) * self.get_free_count(quantity)
+
+    # number of free items in a quantity of this SKU, computed in constant time.
+    # the deal runs in cycles of x + y + 1 items: x paid items, then y free items, then one more
+    #   paid item on which the cycle resets. e.g. buy 2 get 1 free charges for 4 of every 5 items
+    #   (paid, paid, free, paid | paid, ...), so 5 items get 1 free and 7 items get 2 free.
+    def get_free_count(self, quantity):
+        cycles, remainder = divmod(quantity, self.x + self.y + 1)
+        return cycles * self.y + min(max(remainder - self.x, 0), self.y)
+
+    # vectorized get_free_count for batch re-pricing, returns a numpy array when numpy is installed
+    def get_free_counts(self, quantities):
+        try:
+            import numpy
+        except ImportError:
+            return [self.get_free_count(quantity) for quantity in quantities]
+        cycles, remainder = numpy.divmod(numpy.asarray(quantities, dtype=numpy.int64), self.x + self.y + 1)
+        return cycles * self.y + numpy.clip(remainder - self.x, 0, self.y)
+
+    # vectorized subtotal (a discount, so zero or negative) for an array of quantities of this SKU
+    def get_subtotals(self, quantities, price):
+        free_counts = self.get_free_counts(quantities)
+        if isinstance(free_counts, list):
+            return [-price * free for free in free_counts]
+        return free_counts * -price
+
+    def get_skus(self):
+        return [self.sku]
+
     def create_pricing_category(self):
         # insert a pricing category reference to the master table
         with Database() as db:
@@ -63,49 +153,73 @@ class BuyXGetYFree(PricingCategory):
                 prcrefid_args = (BuyXGetYFree.pc_type_string, self.name)
                 db.execute('INSERT INTO pcrefs(pctype, name) VALUES (?, ?)', prcrefid_args)  # safe insertion of variables
             except sqlite3.Error as err:
-                logging.getLogger('BuyXGetYFree').error('Error occurred attempting to get a new BuyXGetYFree pcrefid: %s' % str(err))
+                get_logger('BuyXGetYFree').error('Error occurred attempting to get a new BuyXGetYFree pcrefid: %s' % str(err))
         
         # insert a BuyXGetYFree entry to the pc_buyxgety table
         with Database() as db:
             try:
                 pcrefid_args = (self.name, BuyXGetYFree.pc_type_string)
                 db.execute('SELECT pcrefid FROM pcrefs WHERE name=(?) AND pctype=(?)', pcrefid_args)  # safe insertion of variables
-                pcrefid = db.fetchone()[0]  # fetch the pcrefid from the pcref entry we just created
-                buyxgetyfree_args = (self.x, self.y, self.sku, pcrefid, self.name)
-                db.execute('INSERT INTO pc_buyxgety(x, y, sku, pcrefid, name) VALUES (?, ?, ?, ?, ?)', buyxgetyfree_args)  # safe insertion of variables
+                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created
+                if record is None:  # the pcrefs insert failed and was logged above
+                    get_logger('BuyXGetYFree').error('Error occurred attempting to insert new BuyXGetYFree entry into the database: no pcrefid for %s' % self.name)
+                else:
+                    buyxgetyfree_args = (self.x, self.y, self.sku, record[0], self.name)
+                    db.execute('INSERT INTO pc_buyxgety(x, y, sku, pcrefid, name) VALUES (?, ?, ?, ?, ?)', buyxgetyfree_args)  # safe insertion of variables
             except sqlite3.Error as err:
-                logging.getLogger('BuyXGetYFree').error('Error occurred attempting to insert new BuyXGetYFree entry into the database: %s' % str(err))
+                get_logger('BuyXGetYFree').error('Error occurred attempting to insert new BuyXGetYFree entry into the database: %s' % str(err))
+        PricingCategory.definitions_version += 1
+
+    def get_key(self):
+        return (BuyXGetYFree.pc_type_string, self.sku, self.x, self.y, self.name)
+
+    # builds a BuyXGetYFree from a (sku, x, y, name) record
+    @staticmethod
+    def from_record(record):
+        return BuyXGetYFree(record[0], record[1], record[2], record[3])
 
     def read_pricing_category(pcrefid):
         result = None
-        with Database() as db:
+        with Database(read_only=True) as db:
             try:
                 args = (pcrefid,)
                 db.execute('SELECT * FROM pc_buyxgety WHERE pcrefid=(?)', args)  # safe insertion of variables
-                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created # x y sku name 1 2 3 4
-                result = BuyXGetYFree(record[1], record[2], record[3], record[4])
+                record = db.fetchone()  # Id, sku, x, y, name
+                if record is not None:  # None if there is no such pcrefid
+                    result = BuyXGetYFree(record[1], record[2], record[3], record[4])
             except sqlite3.Error as err:
-                logging.getLogger('BuyXGetYFree').error('Error occurred attempting to fetch BuyXGetYFree entry: %s' % str(err))
+                get_logger('BuyXGetYFree').error('Error occurred attempting to fetch BuyXGetYFree entry: %s' % str(err))
         return result
 
 class AdditionalTaxes(PricingCategory):
+    __slots__ = ('sku', 'tax_rate_percent', 'name')
     pc_type_string = 'additionaltaxes'
+    pc_table = 'pc_taxes'
+    pc_columns = 'pc.sku, pc.tax_rate, pc.name'
     def __init__(self, sku, tax_rate_percent, name):
         self.sku = sku
         self.tax_rate_percent = tax_rate_percent
         self.name = name
         PricingCategory.__init__(self)
     
-    def get_subtotal(self, checkout_items):
+    def evaluate(self, checkout_items, get_price):
         subtotal = 0.0
         quantity = checkout_items.get(self.sku)
         if quantity is None:
             return subtotal
         else:
-            item = Item.read_product(self.sku)
-            subtotal +=  item.price * quantity * (self.tax_rate_percent / 100.0)
+            subtotal +=  get_price(self.sku) * quantity * (self.tax_rate_percent / 100.0)
             return subtotal
 
+    def evaluate_cents(self, checkout_items, get_price, rounding = money.DEFAULT_ROUNDING):
+        quantity = checkout_items.get(self.sku)
+        if quantity is None:
+            return 0
+        return money.tax_cents(int(get_price(self.sku)) * quantity, self.tax_rate_percent, rounding)
+
+    def get_skus(self):
+        return [self.sku]
+
     def create_pricing_category(self):
         # insert a pricing category reference to the master table
         with Database() as db:
@@ -113,49 +227,69 @@ class AdditionalTaxes(PricingCategory):
                 prcrefid_args = (AdditionalTaxes.pc_type_string, self.name)
                 db.execute('INSERT INTO pcrefs(pctype, name) VALUES (?, ?)', prcrefid_args)  # safe insertion of variables
             except sqlite3.Error as err:
-                logging.getLogger('AdditionalTaxes').error('Error occurred attempting to get a new AdditionalTaxes pcrefid: %s' % str(err))
+                get_logger('AdditionalTaxes').error('Error occurred attempting to get a new AdditionalTaxes pcrefid: %s' % str(err))
         
         # insert an AdditionalTaxes entry to the pc_taxes table
         with Database() as db:
             try:
                 pcrefid_args = (self.name, AdditionalTaxes.pc_type_string)
                 db.execute('SELECT pcrefid FROM pcrefs WHERE name=(?) AND pctype=(?)', pcrefid_args)  # safe insertion of variables
-                pcrefid = db.fetchone()[0]  # fetch the pcrefid from the pcref entry we just created
-                additionaltaxesargs = (self.sku, self.tax_rate_percent, self.name, pcrefid)
-                db.execute('INSERT INTO pc_taxes(sku, tax_rate, name, pcrefid) VALUES (?, ?, ?, ?)', additionaltaxesargs)  # safe insertion of variables
+                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created
+                if record is None:  # the pcrefs insert failed and was logged above
+                    get_logger('AdditionalTaxes').error('Error occurred attempting to insert new AdditionalTaxes entry into the database: no pcrefid for %s' % self.name)
+                else:
+                    additionaltaxesargs = (self.sku, self.tax_rate_percent, self.name, record[0])
+                    db.execute('INSERT INTO pc_taxes(sku, tax_rate, name, pcrefid) VALUES (?, ?, ?, ?)', additionaltaxesargs)  # safe insertion of variables
             except sqlite3.Error as err:
-                logging.getLogger('AdditionalTaxes').error('Error occurred attempting to insert new AdditionalTaxes entry into the database: %s' % str(err))
+                get_logger('AdditionalTaxes').error('Error occurred attempting to insert new AdditionalTaxes entry into the database: %s' % str(err))
+        PricingCategory.definitions_version += 1
+
+    def get_key(self):
+        return (AdditionalTaxes.pc_type_string, self.sku, self.tax_rate_percent, self.name)
+
+    # builds an AdditionalTaxes from a (sku, tax_rate, name) record
+    @staticmethod
+    def from_record(record):
+        return AdditionalTaxes(record[0], record[1], record[2])
 
     def read_pricing_category(pcrefid):
         result = None
-        with Database() as db:
+        with Database(read_only=True) as db:
             try:
                 args = (pcrefid,)
                 db.execute('SELECT * FROM pc_taxes WHERE pcrefid=(?)', args)  # safe insertion of variables
-                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created # x y sku name 1 2 3 4
-                result = AdditionalTaxes(record[1], record[2], record[3])
+                record = db.fetchone()  # Id, sku, tax_rate, name
+                if record is not None:  # None if there is no such pcrefid
+                    result = AdditionalTaxes(record[1], record[2], record[3])
             except sqlite3.Error as err:
-                logging.getLogger('AdditionalTaxes').error('Error occurred attempting to fetch AdditionalTaxes entry: %s' % str(err))
+                get_logger('AdditionalTaxes').error('Error occurred attempting to fetch AdditionalTaxes entry: %s' % str(err))
         return result
 
 class Bundled(PricingCategory):
+    __slots__ = ('price', 'skus', 'name')
     pc_type_string = 'bundled'
+    pc_table = 'pc_bundled'
+    pc_columns = 'pc.price, pc.name'
     def __init__(self, price, skus, name):
         self.price = price
         self.skus = skus
         self.name = name
         
-    def get_subtotal(self, checkout_items):
-        bundle_items = {}
-        for sku in self.skus:
-            bundle_items[sku] = 0
-        for sku in checkout_items.keys():
-            if sku in self.skus:
-                bundle_items[sku] += checkout_items[sku]
-        base_price = sum([Item.read_product(sku).price for sku in self.skus])
+    def evaluate(self, checkout_items, get_price):
+        # look up each bundle SKU in the basket rather than scanning the whole basket
+        bundle_quantities = [checkout_items.get(sku, 0) for sku in self.skus]
+        base_price = sum([get_price(sku) for sku in self.skus])
         discount = self.price - base_price
         # min will grab the number of complete bundles that exist in the checkout items
-        return discount * min(bundle_items.values() if len(bundle_items.values()) else [0]) 
+        return discount * min(bundle_quantities if len(bundle_quantities) else [0])
+
+    def evaluate_cents(self, checkout_items, get_price, rounding = money.DEFAULT_ROUNDING):
+        bundle_quantities = [checkout_items.get(sku, 0) for sku in self.skus]
+        discount = int(self.price) - sum([int(get_price(sku)) for sku in self.skus])
+        return discount * min(bundle_quantities if len(bundle_quantities) else [0])
+
+    def get_skus(self):
+        return self.skus
 
     def create_pricing_category(self):
         # insert a pricing category reference to the master table
@@ -164,34 +298,87 @@ class Bundled(PricingCategory):
                 prcrefid_args = (Bundled.pc_type_string, self.name)
                 db.execute('INSERT INTO pcrefs(pctype, name) VALUES (?, ?)', prcrefid_args)  # safe insertion of variables
             except sqlite3.Error as err:
-                logging.getLogger('Bundled').error('Error occurred attempting to get a new Bundled pcrefid: %s' % str(err))
+                get_logger('Bundled').error('Error occurred attempting to get a new Bundled pcrefid: %s' % str(err))
 
-        # insert a Bundled entry to the pc_taxes table
+        # insert a Bundled entry to the pc_bundled table, and its SKUs to bundle_skus
         with Database() as db:
             try:
                 pcrefid_args = (self.name, Bundled.pc_type_string)
                 db.execute('SELECT pcrefid FROM pcrefs WHERE name=(?) AND pctype=(?)', pcrefid_args)  # safe insertion of variables
-                pcrefid = db.fetchone()[0]  # fetch the pcrefid from the pcref entry we just created
-                bundledargs = (self.price, ','.join(self.skus), self.name, pcrefid)
-                db.execute('INSERT INTO pc_bundled(price, skus, name, pcrefid) VALUES (?, ?, ?, ?)', bundledargs)  # safe insertion of variables
+                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created
+                if record is None:  # the pcrefs insert failed and was logged above
+                    get_logger('Bundled').error('Error occurred attempting to insert new Bundled entry into the database: no pcrefid for %s' % self.name)
+                else:
+                    bundledargs = (self.price, ','.join(self.skus), self.name, record[0])
+                    db.execute('INSERT INTO pc_bundled(price, skus, name, pcrefid) VALUES (?, ?, ?, ?)', bundledargs)  # safe insertion of variables
+                    Bundled.write_skus(db, record[0], self.skus)
             except sqlite3.Error as err:
-                logging.getLogger('Bundled').error('Error occurred attempting to insert new Bundled entry into the database: %s' % str(err))
+                get_logger('Bundled').error('Error occurred attempting to insert new Bundled entry into the database: %s' % str(err))
+        PricingCategory.definitions_version += 1
 
-    def read_pricing_category(pcrefid):
-        result = None
-        with Database() as db:
+    def get_key(self):
+        return (Bundled.pc_type_string, self.price, tuple(self.skus), self.name)
+
+    # replaces the bundle_skus rows of a bundle, which every read goes through, with the list of SKUs.
+    #   `cursor` may be any sqlite3 cursor; the rows are written in its transaction. the comma joined
+    #   pc_bundled.skus column is only a mirror and is left to the caller.
+    @staticmethod
+    def write_skus(cursor, pcrefid, skus):
+        cursor.execute('DELETE FROM bundle_skus WHERE pcrefid=(?)', (pcrefid,))
+        cursor.executemany('INSERT INTO bundle_skus(pcrefid, position, sku) VALUES (?, ?, ?)',
+                           [(pcrefid, position, sku) for position, sku in enumerate(skus)])
+
+    # bundle SKUs are read from the bundle_skus junction table, in bundle order
+    @staticmethod
+    def read_pricing_categories(pcrefids):
+        result = {}
+        pcrefids = list(pcrefids)
+        with Database(read_only=True) as db:
             try:
-                args = (pcrefid,)
-                db.execute('SELECT * FROM pc_bundled WHERE pcrefid  =(?)', args)  # safe insertion of variables
-                record = db.fetchone()  # fetch the pcrefid from the pcref entry we just created # x y sku name 1 2 3 4
-                result = Bundled(record[1],  record[2].split(','), record[3])
+                for start in range(0, len(pcrefids), 500):
+                    chunk = pcrefids[start:start + 500]
+                    db.execute('SELECT pcrefs.pcrefid, pc.price, pc.name, bundle_skus.sku FROM pcrefs '
+                               'JOIN pc_bundled AS pc ON pc.pcrefid = pcrefs.pcrefid '
+                               'LEFT JOIN bundle_skus ON bundle_skus.pcrefid = pc.pcrefid '
+                               'WHERE pcrefs.pctype=(?) AND pcrefs.pcrefid IN (%s) '
+                               'ORDER BY pcrefs.pcrefid, bundle_skus.position' % ','.join('?' * len(chunk)),
+                               [Bundled.pc_type_string] + chunk)
+                    for record in db.fetchall():
+                        bundle = result.get(record[0])
+                        if bundle is None:
+                            bundle = result[record[0]] = Bundled(record[1], [], record[2])
+                        if record[3] is not None:
+                            bundle.skus.append(record[3])
             except sqlite3.Error as err:
-                logging.getLogger('Bundled').error('Error occurred attempting to fetch Bundled entry: %s' % str(err))
+                get_logger('Bundled').error('Error occurred attempting to fetch Bundled entries: %s' % str(err))
         return result
 
+    def read_pricing_category(pcrefid):
+        return Bundled.read_pricing_categories([pcrefid]).get(pcrefid)
+
 
 PRICING_CATEGORY_TYPE_MAP = {
     'buyxgetyfree' : BuyXGetYFree,
     'additionaltaxes' : AdditionalTaxes,
     'bundled' : Bundled
-}
\ No newline at end of file
+}
+
+# reads the pricing categories for many pcrefids with one JOIN query per pricing category type.
+# returns a dict of pcrefid -> pricing category; pcrefids that don't exist are left out.
+def read_pricing_categories(pcrefids):
+    result = {}
+    for pc_class in PRICING_CATEGORY_TYPE_MAP.values():
+        result.update(pc_class.read_pricing_categories(pcrefids))
+    return result
+
+# returns the pcrefids of every pricing category that involves this SKU, using the SKU indexes
+def get_pcrefids_for_sku(sku):
+    pcrefids = []
+    with Database(read_only=True) as db:
+        try:
+            db.execute('SELECT pcrefid FROM pc_buyxgety WHERE sku=(?) UNION SELECT pcrefid FROM pc_taxes WHERE sku=(?) '
+                       'UNION SELECT pcrefid FROM bundle_skus WHERE sku=(?) ORDER BY 1', (sku, sku, sku))
+            pcrefids = [record[0] for record in db.fetchall()]
+        except sqlite3.Error as err:
+            get_logger('PricingCategory').error('Error occurred attempting to fetch pricing categories for SKU %s: %s' % (sku, str(err)))
+    return pcrefids
@@ -0,0 +1,91 @@
+import copy
+import types
+from . import money
+
+# inverted index of the rules (pricing categories) involving each SKU, so that a total only evaluates
+#   the rules touched by the basket. rules are added with their position in the scheme and can be added
+#   one at a time as a scheme loads them.
+class RuleIndex:
+    def __init__(self, rules = ()):
+        self.always_rules = []  # indices of the rules applied to every basket, e.g. Simple
+        self.rules_by_sku = {}  # SKU -> indices of the rules involving it, in scheme order
+        for index, rule in enumerate(rules):
+            self.add(index, rule)
+
+    def add(self, index, rule):
+        skus = rule.get_skus()
+        if skus is None:
+            self.always_rules.append(index)
+            return
+        for sku in set(skus):  # a bundle may list the same SKU more than once
+            self.rules_by_sku.setdefault(sku, []).append(index)
+
+    # returns the indices of every rule touched by the given SKUs, in scheme order
+    def get_rule_indices(self, skus):
+        indices = set(self.always_rules)
+        rules_by_sku = self.rules_by_sku
+        for sku in skus:
+            indices.update(rules_by_sku.get(sku, ()))
+        return sorted(indices)
+
+# immutable, precompiled form of a Scheme's price adjustments.
+# prices are resolved once from the catalog when the plan is compiled, and every pricing category
+#   is indexed by the SKUs it applies to, so that a total only evaluates the categories attached
+#   to SKUs that are actually in the basket. a plan never changes after it has been built and may
+#   be shared between any number of checkouts.
+class PricingPlan:
+    def __init__(self, price_adjustments, prices, catalog_version = None, adjustments_version = None):
+        self.rules = tuple(price_adjustments)
+        # SKU -> price, read only. a mapping that is already read only (e.g. the mapped prices of a
+        #   catalog snapshot) is used as is rather than copied
+        if not isinstance(prices, types.MappingProxyType):
+            prices = types.MappingProxyType(dict(prices))
+        self.prices = prices
+        self.catalog_version = catalog_version
+        self.adjustments_version = adjustments_version
+        rule_index = RuleIndex(self.rules)
+        self.always_rules = tuple(rule_index.always_rules)
+        self.rules_by_sku = types.MappingProxyType({sku: tuple(indices) for sku, indices in rule_index.rules_by_sku.items()})
+
+    # returns a copy of this plan with some prices changed, sharing the rule index with this plan.
+    # `prices` maps each changed SKU to its new price, or to None if the product no longer exists.
+    def with_prices(self, prices, catalog_version):
+        updated = dict(self.prices)
+        for sku, price in prices.items():
+            if price is None:
+                updated.pop(sku, None)
+            else:
+                updated[sku] = price
+        plan = copy.copy(self)
+        plan.prices = types.MappingProxyType(updated)
+        plan.catalog_version = catalog_version
+        return plan
+
+    def get_price(self, sku):
+        try:
+            return self.prices[sku]
+        except KeyError:
+            raise ValueError('Requested product SKU %s does not match any products in the pricing plan' % sku)
+
+    # returns the indices into `rules` of every category touched by the given SKUs, in scheme order
+    def get_rule_indices(self, skus):
+        indices = set(self.always_rules)
+        rules_by_sku = self.rules_by_sku
+        for sku in skus:
+            indices.update(rules_by_sku.get(sku, ()))
+        return sorted(indices)
+
+    # apply the plan to the provided dict of checkout item quantities.
+    # categories are evaluated in scheme order so the result is identical to Scheme.get_total.
+    def get_total(self, checkout_items):
+        total = 0.0
+        for index in self.get_rule_indices(checkout_items.keys()):
+            total += self.rules[index].evaluate(checkout_items, self.get_price)
+        return int(total)
+
+    # exact integer-cents total, see Scheme.get_total_cents
+    def get_total_cents(self, checkout_items, rounding = money.DEFAULT_ROUNDING):
+        total = 0
+        for index in self.get_rule_indices(checkout_items.keys()):
+            total += self.rules[index].evaluate_cents(checkout_items, self.get_price, rounding)
+        return total
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+from .database import Database
+from .log import get_logger
+from .catalog import get_catalog
+from .scheme import Scheme, read_definitions_version
+
+DEFAULT_POLL_INTERVAL = 1.0  # seconds between checks for changed definitions or prices
+
+# the current SchemeSnapshot of each scheme of one database, reloaded in the background as schemes,
+#   pricing categories or prices change.
+# get_scheme only reads the published dict of name -> snapshot, which is never modified in place: a
+#   reload builds every new snapshot off to the side and then swaps the whole dict in with a single
+#   assignment, so pricing never waits on a reload. a Checkout keeps the snapshot it was created with
+#   for the rest of its basket; checkouts created after the swap pick up the new one.
+# changes are detected by polling the definitions_version counter, which triggers bump on writes from
+#   any process, and the catalog version, which follows product writes made through Item. call
+#   `start()` to poll on a background thread, or `refresh()` to check once.
+class SchemeRegistry:
+    def __init__(self, database_path = None, poll_interval = DEFAULT_POLL_INTERVAL):
+        self.database_path = database_path if database_path is not None else Database.get_database_path()
+        if self.database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+        self.poll_interval = poll_interval
+        self.log = get_logger('SchemeRegistry')
+        self.snapshots = {}  # name -> SchemeSnapshot, replaced as a whole on every reload
+        self.definitions_version = None  # definitions version the published snapshots were built from
+        self.reloads = 0  # number of reloads published
+        self.lock = threading.Lock()  # serializes loads and reloads, never taken by get_scheme
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # returns the current snapshot of the named scheme. only the first request for a scheme reads it
+    #   from the database, every later one is a dict lookup.
+    def get_scheme(self, name):
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshots.get(name)
+                if snapshot is None:
+                    if self.definitions_version is None:
+                        self.definitions_version = read_definitions_version(self.database_path)
+                    snapshot = self.load(name)
+                    snapshots = dict(self.snapshots)
+                    snapshots[name] = snapshot
+                    self.snapshots = snapshots
+        return snapshot
+
+    def get_scheme_names(self):
+        return sorted(self.snapshots.keys())
+
+    # reads and compiles a fresh snapshot of the named scheme
+    def load(self, name):
+        with Database.use(self.database_path):
+            return Scheme.load_scheme(name).snapshot()
+
+    # True if the definitions or prices changed since the published snapshots were built
+    def is_stale(self):
+        snapshots = self.snapshots
+        if not snapshots:
+            return False
+        if read_definitions_version(self.database_path) != self.definitions_version:
+            return True
+        catalog = get_catalog(self.database_path)
+        return any(snapshot.plan.catalog_version != catalog.version for snapshot in snapshots.values())
+
+    # rebuilds every published snapshot if anything changed and swaps the new ones in.
+    # returns True if new snapshots were published. a scheme that fails to load keeps its old snapshot.
+    def refresh(self):
+        with self.lock:
+            if not self.is_stale():
+                return False
+            # read the version before loading, so a change made during the reload is caught by the next one
+            definitions_version = read_definitions_version(self.database_path)
+            snapshots = {}
+            for name, snapshot in self.snapshots.items():
+                try:
+                    snapshots[name] = self.load(name)
+                except (ValueError, sqlite3.Error) as err:
+                    self.log.error('Error occurred attempting to reload Scheme %s, keeping the previous version: %s' % (name, str(err)))
+                    snapshots[name] = snapshot
+            self.snapshots = snapshots
+            self.definitions_version = definitions_version
+            self.reloads += 1
+            return True
+
+    # polls for changes every `poll_interval` seconds on a background thread until stop() is called
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.poll, name='scheme-registry', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        thread = self.thread
+        if thread is None:
+            return
+        self.stop_event.set()
+        thread.join()
+        self.thread = None
+
+    def poll(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as err:
+                self.log.error('Error occurred attempting to reload schemes: %s' % str(err))
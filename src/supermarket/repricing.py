@@ -0,0 +1,89 @@
+import os
+import sys
+import itertools
+import collections
+from .database import Database
+from .scheme import Scheme
+
+DEFAULT_CHUNK_SIZE = 10000  # baskets sent to a worker at a time
+
+# scheme loaded once per worker process by `init_worker`
+_worker_scheme = None
+
+def init_worker(database_path, scheme_name):
+    global _worker_scheme
+    Database.database_path = database_path
+    _worker_scheme = Scheme.read_scheme(scheme_name)
+    _worker_scheme.compile()  # load the catalog and compile the plan up front, not on the first basket
+
+def price_chunk(baskets):
+    return _worker_scheme.get_totals(baskets)
+
+# yields one dict of SKU -> quantity per line of a JSON lines basket file, skipping blank lines
+def read_baskets(lines):
+    import json
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+# re-prices large numbers of baskets against a scheme by sharding them across a process pool.
+# every worker process loads the scheme and product catalog once, when it starts, and then prices
+#   whole chunks of baskets with the batch API. totals are yielded back in input order, and only a
+#   bounded number of chunks is in flight at once so the input can be arbitrarily large.
+class RepricingEngine:
+    def __init__(self, scheme_name, database_path = None, max_workers = None, chunk_size = DEFAULT_CHUNK_SIZE):
+        self.scheme_name = scheme_name
+        self.database_path = database_path if database_path is not None else Database.get_database_path()
+        if self.database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+
+    # yields the total of every basket (dicts of SKU -> quantity), in input order
+    def reprice(self, baskets):
+        from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing, so only loaded to reprice
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                 initargs=(self.database_path, self.scheme_name)) as executor:
+            max_in_flight = 2 * self.max_workers
+            pending = collections.deque()
+            for chunk in chunked(baskets, self.chunk_size):
+                pending.append(executor.submit(price_chunk, chunk))
+                if len(pending) >= max_in_flight:
+                    for total in pending.popleft().result():
+                        yield total
+            while pending:
+                for total in pending.popleft().result():
+                    yield total
+
+    # re-prices a JSON lines basket file, writing one total per line to `output`. returns the basket count.
+    def reprice_file(self, path, output):
+        count = 0
+        with open(path, 'r', encoding='utf-8') as lines:
+            for total in self.reprice(read_baskets(lines)):
+                output.write('%d\n' % total)
+                count += 1
+        return count
+
+def main(argv = None):
+    import argparse  # imported here so that importing the engine does not load it
+    parser = argparse.ArgumentParser(description='Re-price a JSON lines file of baskets against a pricing scheme.')
+    parser.add_argument('database', help='path to the supermarket database')
+    parser.add_argument('scheme', help='name of the pricing scheme')
+    parser.add_argument('baskets', help='JSON lines file, one {"SKU": quantity} object per basket')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='baskets per worker task')
+    args = parser.parse_args(argv)
+    engine = RepricingEngine(args.scheme, args.database, args.workers, args.chunk_size)
+    engine.reprice_file(args.baskets, sys.stdout)
+
+if __name__ == '__main__':
+    main()
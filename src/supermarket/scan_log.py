@@ -0,0 +1,209 @@
+import os
+import ast
+import time
+import sqlite3
+import threading
+import uuid
+import socket
+from .database import Database
+from .log import get_logger
+
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds between group commits of logged scans to the database
+DEFAULT_FLUSH_SIZE = 1000  # logged scans that trigger a group commit before the interval is up
+DEFAULT_COMPACT_SIZE = 1 << 20  # bytes of already committed records after which the log file is rewritten
+
+# write-behind log of checkout scans.
+# every scan, unscan and close of a basket is appended to a local append-only log file before it is
+#   acknowledged (and fsynced first when `fsync` is set), then a background thread writes the logged
+#   records to the scan_log table in batches of up to `flush_size`, one transaction per batch, at least
+#   every `flush_interval` seconds. records the database already holds are dropped from the log file.
+# records are written as Python literals, one per line. concurrent appends with `fsync` share fsyncs:
+#   an fsync covers every record written before it, so lanes scanning at the same time wait on one flush
+#   to disk between them rather than one each.
+# opening a ScanLog replays whatever the file still holds into the database first, so a crash loses
+#   nothing that was acknowledged. every record has a sequence number and is inserted with
+#   `INSERT OR IGNORE` on (writer, seq), so replaying a record that was committed before the crash does nothing.
+# any number of logs (lanes, processes or hosts) may write to one database: each numbers its records under
+#   its own `writer` id. the id must stay the same across restarts of a log for recovery to skip what it
+#   already committed; by default it is the host name and the absolute path of the log file.
+class ScanLog:
+    def __init__(self, log_path, database_path = None, flush_interval = DEFAULT_FLUSH_INTERVAL,
+                 flush_size = DEFAULT_FLUSH_SIZE, fsync = True, writer = None):
+        self.database_path = database_path if database_path is not None else Database.get_database_path()
+        if self.database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+        self.log_path = log_path
+        self.writer = writer if writer is not None else '%s:%s' % (socket.gethostname(), os.path.abspath(log_path))
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.compact_size = DEFAULT_COMPACT_SIZE
+        self.log = get_logger('ScanLog')
+        self.lock = threading.Lock()  # guards the log file, `pending` and `next_seq`
+        self.sync_lock = threading.Lock()  # held while fsyncing or replacing the log file
+        self.flush_lock = threading.Lock()  # one batch is written to the database at a time
+        self.flush_needed = threading.Condition(self.lock)
+        self.closed = False
+        self.pending = self.read_log_file()  # logged records not yet committed to the database, in sequence order
+        self.next_seq = max(self.read_last_seq(), self.pending[-1][0] if self.pending else 0) + 1
+        self.synced_seq = 0  # every record up to this sequence number is on disk
+        self.file = None
+        self.rewrite()  # starts the file afresh after any torn record
+        self.flush()  # recover what the previous run left in the log
+        self.thread = threading.Thread(target=self.run, name='scan-log-flush', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # records left in the log file by a previous run. a torn last line from a crash mid write was never
+    #   acknowledged and is skipped.
+    def read_log_file(self):
+        records = []
+        if not os.path.isfile(self.log_path):
+            return records
+        with open(self.log_path, 'rb') as log_file:
+            lines = log_file.read().split(b'\n')
+        for number, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                records.append(ast.literal_eval(line.decode('utf-8')))
+            except (ValueError, SyntaxError, UnicodeDecodeError):
+                if number < len(lines) - 1:
+                    self.log.error('Skipping unreadable record %d of scan log %s' % (number + 1, self.log_path))
+        records.sort()
+        return records
+
+    def read_last_seq(self):
+        with Database(self.database_path, read_only=True) as db:
+            try:
+                db.execute('SELECT MAX(seq) FROM scan_log WHERE writer = ?', (self.writer,))
+                return db.fetchone()[0] or 0
+            except sqlite3.Error as err:
+                self.log.error('Error occurred attempting to read the last logged scan: %s' % str(err))
+        return 0
+
+    # returns a new basket id for a lane
+    def open_basket(self, lane):
+        return uuid.uuid4().hex
+
+    # durably logs one basket event; `op` is 'scan', 'unscan' or 'close' (with the basket's final total)
+    def append(self, lane, basket, op, sku = None, total = None):
+        with self.lock:
+            if self.closed:
+                raise ValueError('Scan log %s is closed' % self.log_path)
+            seq = self.next_seq
+            record = (seq, lane, basket, op, sku, total, time.time())
+            os.write(self.file, ('%r\n' % (record,)).encode('utf-8'))
+            self.next_seq += 1
+            self.pending.append(record)
+            if len(self.pending) >= self.flush_size:
+                self.flush_needed.notify()
+        if self.fsync:
+            self.sync(seq)
+        return seq
+
+    # waits until the record `seq` is on disk, fsyncing the log unless another append already did
+    def sync(self, seq):
+        with self.sync_lock:
+            if self.synced_seq >= seq:
+                return
+            written = self.next_seq - 1
+            os.fsync(self.file)
+            self.synced_seq = written
+
+    # writes the oldest pending records, up to `flush_size` of them, to the database in one transaction.
+    # returns the number written.
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch = self.pending[:self.flush_size] if self.flush_size else list(self.pending)
+            if not batch:
+                return 0
+            committed = False
+            writer = (self.writer,)
+            with Database(self.database_path) as db:
+                try:
+                    db.executemany('INSERT OR IGNORE INTO scan_log(writer, seq, lane, basket, op, sku, total, logged_at) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [writer + record for record in batch])
+                    committed = True
+                except sqlite3.Error as err:
+                    self.log.error('Error occurred attempting to write %d logged scans to the database: %s' % (len(batch), str(err)))
+            if not committed:
+                return 0
+            with self.lock:
+                del self.pending[:len(batch)]
+                self.compact()
+            return len(batch)
+
+    # drops records the database holds from the log file; called with `lock` held
+    def compact(self):
+        if not self.pending:
+            os.ftruncate(self.file, 0)
+            return
+        if os.fstat(self.file).st_size >= self.compact_size:
+            self.rewrite()
+
+    # replaces the log file with just the pending records and reopens it for appending
+    def rewrite(self):
+        temporary_path = self.log_path + '.tmp'
+        with self.sync_lock:
+            with open(temporary_path, 'wb') as log_file:
+                log_file.write(''.join(['%r\n' % (record,) for record in self.pending]).encode('utf-8'))
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            os.replace(temporary_path, self.log_path)
+            if self.file is not None:
+                os.close(self.file)
+            self.file = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.synced_seq = self.next_seq - 1
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.closed and len(self.pending) < self.flush_size:
+                    self.flush_needed.wait(self.flush_interval)
+                if self.closed:
+                    return
+            try:
+                while self.flush() >= self.flush_size > 0:
+                    pass
+            except Exception as err:
+                self.log.error('Error occurred attempting to flush the scan log: %s' % str(err))
+
+    # stops the flush thread and commits everything logged so far
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.flush_needed.notify()
+        self.thread.join()
+        while self.pending and self.flush():
+            pass
+        with self.sync_lock:
+            os.close(self.file)
+
+    # returns {lane: (basket id, [(op, sku), ...])} of the last basket of every lane of this writer that was
+    #   never closed, from the committed records, e.g. to restore the lanes of a server after a restart
+    def read_open_baskets(self):
+        while self.pending and self.flush():
+            pass
+        baskets = {}
+        with Database(self.database_path, read_only=True) as db:
+            try:
+                db.execute("SELECT lane, basket, op, sku FROM scan_log WHERE writer = ?1 AND basket IN "
+                           "(SELECT basket FROM scan_log WHERE writer = ?1 GROUP BY basket HAVING SUM(op = 'close') = 0) "
+                           "ORDER BY seq", (self.writer,))
+                for lane, basket, op, sku in db.fetchall():
+                    current = baskets.get(lane)
+                    if current is None or current[0] != basket:
+                        current = baskets[lane] = (basket, [])
+                    current[1].append((op, sku))
+            except sqlite3.Error as err:
+                self.log.error('Error occurred attempting to read the open baskets: %s' % str(err))
+        return baskets
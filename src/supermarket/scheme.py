@@ -1,62 +1,296 @@
 from . import pricing_category as pc
 from .database import Database
+from .log import get_logger
+from .catalog import get_catalog
+from .pricing_plan import PricingPlan, RuleIndex
+from . import batch
+from . import allocation
+from . import total_cache
+from . import money
+from . import metrics
 import sqlite3
-import logging
+import time
 
+# returns the definitions version of a database, bumped by triggers on every write to a scheme or pricing
+#   category table from any process, or None if the database has no definitions_version table
+def read_definitions_version(database_path):
+    version = None
+    with Database(database_path, read_only=True) as db:
+        try:
+            db.execute('SELECT version FROM definitions_version WHERE Id = 1')
+            version = db.fetchone()[0]
+        except sqlite3.Error as err:
+            get_logger('Scheme').error('Error occurred attempting to read the definitions version: %s' % str(err))
+    return version
+
+# a Scheme is bound to the database of the context it was created in, and prices baskets with that
+#   database's catalog. a Scheme may be shared between threads, but it recompiles itself as products
+#   and price adjustments change; use `snapshot()` for a copy that never changes.
 class Scheme:
-    def __init__(self, name, pricing_category_refids = []):
+    # (database path, scheme name) -> ((database definitions version, process definitions version), Scheme)
+    #   for schemes loaded by read_scheme
+    cache = {}
+
+    def __init__(self, name, pricing_category_refids = None):
         self.name = name
-        self.pricing_category_refids = pricing_category_refids
+        self.pricing_category_refids = list(pricing_category_refids) if pricing_category_refids is not None else []
+        self.database_path = Database.get_database_path()  # None to follow the current context
+        self.catalog = None  # catalog of database_path, once looked up
         self.price_adjustments = []
         self.price_adjustments.append(pc.Simple())
-        
+        self.rule_index = RuleIndex(self.price_adjustments)  # SKU -> price adjustments involving it
+        self.adjustments_version = 0  # bumped whenever price_adjustments changes
+        self.plan = None
+        self.total_cache = None  # optional TotalCache of basket totals, see use_total_cache
+
     def create_scheme(self):
         with Database() as db:
             try:
                 scheme_args = (self.name, ','.join([str(id) for id in self.pricing_category_refids]))
                 db.execute('INSERT INTO schemes(name, pcrefids) VALUES (?, ?)', scheme_args)  # safe insertion of variables
+                Scheme.write_pcrefids(db, db.lastrowid, self.pricing_category_refids)
             except sqlite3.Error as err:
-                self.log.error('Error occurred attempting to write a new Scheme to the database: %s' % str(err))
+                get_logger('Scheme').error('Error occurred attempting to write a new Scheme to the database: %s' % str(err))
+        pc.PricingCategory.definitions_version += 1
         self.load_pricing_categories()
 
+    # replaces the scheme_pcrefs rows of a scheme, which every read goes through, with the list of pcrefids.
+    #   `cursor` may be any sqlite3 cursor; the rows are written in its transaction. the comma joined
+    #   schemes.pcrefids column is only a mirror and is left to the caller.
+    @staticmethod
+    def write_pcrefids(cursor, scheme_id, pcrefids):
+        cursor.execute('DELETE FROM scheme_pcrefs WHERE scheme_id=(?)', (scheme_id,))
+        cursor.executemany('INSERT INTO scheme_pcrefs(scheme_id, position, pcrefid) VALUES (?, ?, ?)',
+                           [(scheme_id, position, int(pcrefid)) for position, pcrefid in enumerate(pcrefids)])
+
+    # returns the named Scheme with its pricing categories loaded. schemes are cached by name and
+    #   shared between callers until a scheme or pricing category definition is written, by this process
+    #   or any other: the cache is checked against the database's definitions version on every call.
+    # the returned Scheme is shared by every caller, so treat it as read only. configure a private
+    #   instance from load_scheme instead, e.g. for use_total_cache.
     @staticmethod
     def read_scheme(name):
+        database_path = Database.get_database_path()
+        key = (database_path, name)
+        version = (read_definitions_version(database_path), pc.PricingCategory.definitions_version)
+        cached = Scheme.cache.get(key)
+        if cached is not None and cached[0] == version:
+            if metrics.enabled:
+                metrics.SCHEME_READS.inc(1, ('hit',))
+            return cached[1]
+        if metrics.enabled:
+            metrics.SCHEME_READS.inc(1, ('miss',))
+        scheme = Scheme.load_scheme(name)
+        Scheme.cache[key] = (version, scheme)
+        return scheme
+
+    # reads the named Scheme and its pricing categories from the database, bypassing the cache
+    @staticmethod
+    def load_scheme(name):
         scheme = None
-        with Database() as db:
+        with Database(read_only=True) as db:
             try:
-                db.execute('SELECT * FROM schemes WHERE name=(?)', (name,))
-                result = db.fetchone()
-                scheme = Scheme(result[1], [int(id) for id in result[2].split(',')])
+                db.execute('SELECT schemes.name, scheme_pcrefs.pcrefid FROM schemes '
+                           'LEFT JOIN scheme_pcrefs ON scheme_pcrefs.scheme_id = schemes.Id '
+                           'WHERE schemes.name=(?) ORDER BY scheme_pcrefs.position', (name,))
+                records = db.fetchall()
+                if len(records):
+                    scheme = Scheme(records[0][0], [record[1] for record in records if record[1] is not None])
             except sqlite3.Error as err:
-                logging.getLogger('Scheme').error('Error occurred attempting to read Scheme %s from the database: %s' % (name, str(err)))
+                get_logger('Scheme').error('Error occurred attempting to read Scheme %s from the database: %s' % (name, str(err)))
         if scheme is None:
             raise ValueError("Failed to fetch Scheme of name '%s' from the database" % name)
         scheme.load_pricing_categories()
         return scheme
 
+    # forgets every scheme loaded by read_scheme
+    @staticmethod
+    def clear_cache():
+        Scheme.cache.clear()
 
     def load_pricing_categories(self):
-        # load the pricing category objects into the scheme
+        # load the pricing category objects into the scheme with one query per pricing category type
+        pricing_categories = pc.read_pricing_categories(self.pricing_category_refids)
+        keys = set(pa.get_key() for pa in self.price_adjustments)
         for pricing_category_id in self.pricing_category_refids:
-            with Database() as db:
-                try:
-                    db.execute('SELECT pctype FROM pcrefs WHERE pcrefid=(?)', (pricing_category_id,))
-                    pc_type = db.fetchone()
-                    try:
-                        pc_class = pc.PRICING_CATEGORY_TYPE_MAP.get(pc_type[0])
-                        pricing_category = pc_class.read_pricing_category(pricing_category_id)
-                    except:
-                        import pdb
-                        pdb.set_trace()
-                except sqlite3.Error as err:
-                    logging.getLogger('Scheme').error('Error occurred attempting to read pricing category refid: %s from the database: %s'
-                     % (pricing_category_id, str(err)))
-                if pricing_category.__dict__ not in [pa.__dict__ for pa in self.price_adjustments]:
-                    self.price_adjustments.append(pricing_category)
+            pricing_category = pricing_categories.get(pricing_category_id)
+            if pricing_category is None:
+                raise ValueError('Pricing category refid %s of Scheme %s does not match any pricing category in the database'
+                                 % (pricing_category_id, self.name))
+            key = pricing_category.get_key()
+            if key not in keys:
+                keys.add(key)
+                self.price_adjustments.append(pricing_category)
+                self.rule_index.add(len(self.price_adjustments) - 1, pricing_category)
+                self.adjustments_version += 1
+
+    # remember the totals of up to `max_size` baskets priced by get_total, evicting by `policy` ('lru' or
+    #   'lfu'), so that baskets priced over and over cost a lookup. returns the scheme's TotalCache, whose
+    #   get_stats() reports its hit rate. totals are dropped as soon as product prices or the scheme's price
+    #   adjustments change. pass max_size=None to stop caching.
+    # the cache belongs to this instance, so on a Scheme shared by read_scheme it applies to every caller.
+    def use_total_cache(self, max_size = total_cache.DEFAULT_MAX_SIZE, policy = 'lru'):
+        self.total_cache = total_cache.TotalCache(max_size, policy) if max_size is not None else None
+        return self.total_cache
 
     # apply all pricing schemes to the provided dict of checkout item quantities
     def get_total(self, checkout_items):
+        if not metrics.enabled:
+            return self.evaluate_total(checkout_items)
+        # timed around the total cache lookup too, so cached totals are counted in the latency histogram
+        started = time.perf_counter()
+        try:
+            return self.evaluate_total(checkout_items)
+        finally:
+            metrics.SCHEME_TOTAL_SECONDS.observe(time.perf_counter() - started)
+
+    # get_total without the latency metric
+    def evaluate_total(self, checkout_items):
+        catalog = self.get_catalog()
+        cache = self.total_cache
+        if cache is not None:
+            catalog.get_products()  # the catalog version only settles once the catalog is loaded
+            # read before pricing, so a change made meanwhile leaves this total under a stale version
+            version = (catalog.version, self.adjustments_version)
+            signature = total_cache.get_signature(checkout_items)
+            cached = cache.get(signature, version)
+            if metrics.enabled:
+                metrics.SCHEME_TOTAL_CACHE.inc(1, ('hit' if cached is not None else 'miss',))
+            if cached is not None:
+                return cached
+        get_price = catalog.get_price
         total = 0.0
-        for pricing_category in self.price_adjustments:
-            total += pricing_category.get_subtotal(checkout_items)
-        return int(total)
\ No newline at end of file
+        # only the adjustments involving a SKU in the basket can change the total
+        for index in self.rule_index.get_rule_indices(checkout_items.keys()):
+            total += self.price_adjustments[index].get_subtotal(checkout_items, get_price)
+        total = int(total)
+        if cache is not None:
+            cache.put(signature, version, total)
+        return total
+
+    # exact integer-cents total of the provided dict of checkout item quantities. fractional tax cents
+    #   are rounded per tax line with the given money rounding mode rather than truncated from the total.
+    def get_total_cents(self, checkout_items, rounding = money.DEFAULT_ROUNDING):
+        get_price = self.get_catalog().get_price
+        total = 0
+        for index in self.rule_index.get_rule_indices(checkout_items.keys()):
+            total += self.price_adjustments[index].evaluate_cents(checkout_items, get_price, rounding)
+        return total
+
+    # best allocation of the basket's units to the scheme's promotions when promotions may not stack,
+    #   see allocation.PromotionAllocator. returns an Allocation with the total and the promotions used.
+    def allocate(self, checkout_items):
+        return allocation.get_allocator(self.compile()).allocate(checkout_items)
+
+    # total of the provided dict of checkout item quantities with each unit in at most one promotion
+    def get_allocated_total(self, checkout_items):
+        return self.allocate(checkout_items).total
+
+    # apply all pricing schemes to each of a sequence (or iterator) of checkout item dicts, e.g. to
+    #   re-price historical baskets, returning the list of totals in order. baskets are evaluated
+    #   in columnar chunks when numpy is installed.
+    def get_totals(self, baskets, chunk_size = batch.DEFAULT_CHUNK_SIZE):
+        return batch.get_totals(self.compile(), baskets, chunk_size)
+
+    # get_totals with the exact integer-cents engine, see get_total_cents
+    def get_totals_cents(self, baskets, rounding = money.DEFAULT_ROUNDING, chunk_size = batch.DEFAULT_CHUNK_SIZE):
+        return batch.get_totals(self.compile(), baskets, chunk_size, rounding)
+
+    # catalog listener hook: re-price only the changed SKUs of the compiled plan instead of recompiling it
+    def catalog_changed(self, prices, catalog_version):
+        plan = self.plan
+        if plan is None:
+            return
+        if prices is None or plan.catalog_version != catalog_version - 1:
+            self.plan = None  # everything changed, or the plan missed an earlier change
+        else:
+            self.plan = plan.with_prices(prices, catalog_version)
+
+    # the product catalog of the scheme's database
+    def get_catalog(self):
+        catalog = self.catalog
+        if catalog is None:
+            catalog = get_catalog(self.database_path)
+            if self.database_path is not None:
+                self.catalog = catalog
+        return catalog
+
+    # returns True if the SKU matches a product in the scheme's database
+    def has_product(self, sku):
+        return self.get_catalog().get_product(sku) is not None
+
+    # returns True if compile() would return the cached plan without touching the database
+    def is_compiled(self):
+        catalog = self.get_catalog()
+        plan = self.plan
+        return (catalog.products is not None and plan is not None and plan.catalog_version == catalog.version
+                and plan.adjustments_version == self.adjustments_version)
+
+    # compile the scheme into an immutable PricingPlan with prices resolved from the catalog.
+    # the plan is cached on the scheme and shared by every caller until the catalog or the
+    #   scheme's price adjustments change.
+    def compile(self):
+        catalog = self.get_catalog()
+        catalog.get_products()  # make sure the catalog is loaded before checking its version
+        plan = self.plan
+        if plan is None or plan.catalog_version != catalog.version or plan.adjustments_version != self.adjustments_version:
+            catalog.add_listener(self)
+            catalog_version, prices = catalog.snapshot_prices()
+            plan = PricingPlan(self.price_adjustments, prices, catalog_version, self.adjustments_version)
+            self.plan = plan
+            if metrics.enabled:
+                metrics.SCHEME_COMPILES.inc(1, ('compiled',))
+        elif metrics.enabled:
+            metrics.SCHEME_COMPILES.inc(1, ('hit',))
+        return plan
+
+    # returns an immutable SchemeSnapshot of the scheme as currently compiled
+    def snapshot(self):
+        plan = self.compile()
+        return SchemeSnapshot(self.name, self.pricing_category_refids, plan, self.get_catalog().database_path)
+
+# immutable, point in time copy of a compiled Scheme. prices are frozen when the snapshot is taken and
+#   the snapshot never touches the database or the catalog again, so one snapshot can be shared by
+#   checkouts on any number of threads with no locking. it has the pricing interface of a Scheme and
+#   can be passed to a Checkout in its place; take a new snapshot to pick up product or scheme changes.
+class SchemeSnapshot:
+    def __init__(self, name, pricing_category_refids, plan, database_path = None):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'pricing_category_refids', tuple(pricing_category_refids))
+        object.__setattr__(self, 'plan', plan)
+        object.__setattr__(self, 'price_adjustments', plan.rules)
+        object.__setattr__(self, 'adjustments_version', plan.adjustments_version)
+        object.__setattr__(self, 'database_path', database_path)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SchemeSnapshot %s is read only' % self.name)
+
+    def __delattr__(self, name):
+        raise AttributeError('SchemeSnapshot %s is read only' % self.name)
+
+    def compile(self):
+        return self.plan
+
+    def is_compiled(self):
+        return True
+
+    def has_product(self, sku):
+        return sku in self.plan.prices
+
+    def get_total(self, checkout_items):
+        return self.plan.get_total(checkout_items)
+
+    def get_total_cents(self, checkout_items, rounding = money.DEFAULT_ROUNDING):
+        return self.plan.get_total_cents(checkout_items, rounding)
+
+    def allocate(self, checkout_items):
+        return allocation.get_allocator(self.plan).allocate(checkout_items)
+
+    def get_allocated_total(self, checkout_items):
+        return self.allocate(checkout_items).total
+
+    def get_totals(self, baskets, chunk_size = batch.DEFAULT_CHUNK_SIZE):
+        return batch.get_totals(self.plan, baskets, chunk_size)
+
+    def get_totals_cents(self, baskets, rounding = money.DEFAULT_ROUNDING, chunk_size = batch.DEFAULT_CHUNK_SIZE):
+        return batch.get_totals(self.plan, baskets, chunk_size, rounding)
@@ -0,0 +1,246 @@
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .database import Database
+from .log import get_logger
+from .registry import SchemeRegistry, DEFAULT_POLL_INTERVAL
+from .checkout import Checkout
+from .scan_log import ScanLog
+
+DEFAULT_WORKERS = 4  # threads doing blocking database work for the whole store
+DEFAULT_MAX_LANES = 1024
+
+# asyncio front end to a Checkout. a scan whose SKU and price plan are already in memory never touches
+#   the database and runs directly on the event loop; anything that may do blocking sqlite I/O (loading
+#   the catalog, compiling the plan, reading a product missing from the catalog) is run on `executor`.
+# operations on one AsyncCheckout are serialized, so scans and totals are applied in the order awaited.
+class AsyncCheckout:
+    def __init__(self, scheme, executor = None, limiter = None, scan_log = None, lane = None, basket_id = None):
+        self.checkout = Checkout(scheme, scan_log=scan_log, lane=lane, basket_id=basket_id)
+        self.scheme = scheme
+        self.executor = executor  # None for the event loop's default executor
+        self.limiter = limiter  # optional asyncio.Semaphore bounding the work queued on the executor
+        self.lock = asyncio.Lock()
+
+    # True if scanning this SKU needs no blocking I/O: the plan is current and prices the SKU, and scans
+    #   are not fsynced to a scan log
+    def is_in_memory(self, sku):
+        scan_log = self.checkout.scan_log
+        if scan_log is not None and scan_log.fsync:
+            return False
+        plan = self.scheme.plan
+        return plan is not None and sku in plan.prices and self.scheme.is_compiled()
+
+    async def run(self, function, *args):
+        if self.limiter is None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        async with self.limiter:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def scan(self, sku):
+        async with self.lock:
+            if self.is_in_memory(sku):
+                self.checkout.scan(sku)
+            else:
+                await self.run(self.checkout.scan, sku)
+
+    async def unscan(self, sku):
+        async with self.lock:
+            if self.is_in_memory(sku):
+                self.checkout.unscan(sku)
+            else:
+                await self.run(self.checkout.unscan, sku)
+
+    async def getTotal(self):
+        async with self.lock:
+            if self.scheme.is_compiled():
+                return self.checkout.getTotal()
+            return await self.run(self.checkout.getTotal)
+
+    # the basket's final total, see Checkout.close
+    async def close(self):
+        async with self.lock:
+            scan_log = self.checkout.scan_log
+            if self.scheme.is_compiled() and (scan_log is None or not scan_log.fsync):
+                return self.checkout.close()
+            return await self.run(self.checkout.close)
+
+    def get_items(self):
+        return dict(self.checkout.items)
+
+# store checkout server: a single process serving every lane over a local TCP socket.
+# requests and responses are JSON lines, e.g.
+#   {"id": 1, "op": "scan", "lane": "3", "sku": "1983"}  ->  {"id": 1, "ok": true}
+#   {"id": 2, "op": "total", "lane": "3"}                 ->  {"id": 2, "ok": true, "total": 199}
+#   {"id": 3, "op": "close", "lane": "3"}                 ->  {"id": 3, "ok": true, "total": 199}
+# ops are scan, unscan, total (the running total of the lane's basket), close (the final total; the
+#   lane's next scan starts a new basket) and ping. failed requests get {"ok": false, "error": ...}.
+# each lane has one session holding an AsyncCheckout, which may be driven from any connection.
+# lanes price from SchemeSnapshots published by a SchemeRegistry, which reloads the scheme in the
+#   background every `reload_interval` seconds if promotions or prices changed. a lane's basket keeps
+#   the snapshot it was opened with, and the next basket opened picks up the new one.
+# with a `scan_log_path`, every lane's scans are written behind to the database through a ScanLog, and
+#   the lanes whose baskets were still open when the server last stopped are restored on start.
+# blocking database work from every lane shares one bounded thread pool, and at most `max_pending`
+#   requests wait on it at once; a connection's next request is only read once its previous response
+#   has been written, so a client sending faster than the store can price is slowed down by TCP.
+class CheckoutServer:
+    def __init__(self, scheme_name, database_path = None, max_workers = DEFAULT_WORKERS,
+                 max_pending = None, max_lanes = DEFAULT_MAX_LANES, reload_interval = DEFAULT_POLL_INTERVAL,
+                 scan_log_path = None):
+        self.database_path = database_path if database_path is not None else Database.get_database_path()
+        if self.database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+        self.scheme_name = scheme_name
+        self.max_workers = max_workers
+        self.max_pending = max_pending if max_pending is not None else 2 * max_workers
+        self.max_lanes = max_lanes
+        self.reload_interval = reload_interval
+        self.scan_log_path = scan_log_path
+        self.log = get_logger('CheckoutServer')
+        self.sessions = {}  # lane id -> AsyncCheckout
+        self.executor = None
+        self.limiter = None
+        self.registry = None
+        self.scan_log = None
+        self.server = None
+
+    async def start(self, host = '127.0.0.1', port = 0):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='checkout-db')
+        self.limiter = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_running_loop()
+        self.registry = SchemeRegistry(self.database_path, self.reload_interval)
+        # load the catalog and compile the first snapshot before accepting any lane
+        await loop.run_in_executor(self.executor, self.registry.get_scheme, self.scheme_name)
+        self.registry.start()
+        if self.scan_log_path is not None:
+            self.scan_log = await loop.run_in_executor(self.executor, ScanLog, self.scan_log_path, self.database_path)
+            open_baskets = await loop.run_in_executor(self.executor, self.scan_log.read_open_baskets)
+            for lane, (basket_id, events) in open_baskets.items():
+                self.restore_session(lane, basket_id, events)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    # reopens a lane's basket from its logged events
+    def restore_session(self, lane, basket_id, events):
+        session = self.sessions[lane] = AsyncCheckout(self.registry.get_scheme(self.scheme_name), self.executor, self.limiter,
+                                                      self.scan_log, lane, basket_id)
+        for event in events:
+            try:
+                session.checkout.replay([event])
+            except ValueError as err:
+                self.log.error('Error occurred restoring lane %s, skipping a logged %s: %s' % (lane, event[0], str(err)))
+
+    # (host, port) the server is listening on
+    def get_address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.registry is not None:
+            self.registry.stop()
+        if self.scan_log is not None:
+            self.scan_log.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.sessions = {}
+
+    def get_session(self, lane):
+        session = self.sessions.get(lane)
+        if session is None:
+            if len(self.sessions) >= self.max_lanes:
+                raise ValueError('Too many open lanes, close a basket before opening lane %s' % lane)
+            session = self.sessions[lane] = AsyncCheckout(self.registry.get_scheme(self.scheme_name), self.executor, self.limiter,
+                                                          self.scan_log, lane)
+        return session
+
+    async def handle_request(self, request):
+        op = request.get('op')
+        if op == 'ping':
+            return {}
+        if 'lane' not in request:
+            raise ValueError('Request is missing a lane')
+        lane = str(request['lane'])
+        if op == 'scan':
+            await self.get_session(lane).scan(str(request['sku']))
+            return {}
+        if op == 'unscan':
+            await self.get_session(lane).unscan(str(request['sku']))
+            return {}
+        if op == 'total':
+            return {'total': await self.get_session(lane).getTotal()}
+        if op == 'close':
+            session = self.sessions.get(lane)
+            total = await session.close() if session is not None else 0
+            if self.sessions.get(lane) is session:
+                self.sessions.pop(lane, None)
+            return {'total': total}
+        raise ValueError("Unknown op '%s'" % op)
+
+    async def handle_connection(self, reader, writer):
+        import json  # imported here so that importing the service does not load it
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('Request must be a JSON object')
+                    request_id = request.get('id')
+                    response = await self.handle_request(request)
+                    response['ok'] = True
+                except (ValueError, KeyError, TypeError) as err:
+                    response = {'ok': False, 'error': str(err)}
+                except Exception as err:
+                    self.log.error('Error occurred handling a checkout request: %s' % str(err))
+                    response = {'ok': False, 'error': 'internal error'}
+                response['id'] = request_id
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            pass  # the server is shutting down with the connection still open
+        finally:
+            writer.close()
+
+def main(argv = None):
+    import argparse  # imported here so that importing the service does not load it
+    parser = argparse.ArgumentParser(description='Serve checkout scan and total requests for every lane of a store.')
+    parser.add_argument('database', help='path to the supermarket database')
+    parser.add_argument('scheme', help='name of the pricing scheme')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8573, help='port to listen on (default 8573)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='threads for blocking database work')
+    parser.add_argument('--max-lanes', type=int, default=DEFAULT_MAX_LANES, help='bound on lanes with an open basket')
+    parser.add_argument('--scan-log', default=None, help='path of a local log to write scans behind to the database')
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = CheckoutServer(args.scheme, args.database, args.workers, max_lanes=args.max_lanes, scan_log_path=args.scan_log)
+        await server.start(args.host, args.port)
+        sys.stdout.write('serving on %s:%d\n' % server.get_address())
+        sys.stdout.flush()
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import mmap
+import types
+import struct
+import sqlite3
+import collections.abc
+from .database import Database
+from .log import get_logger
+from .catalog import get_catalog
+from .scheme import Scheme, SchemeSnapshot
+from .pricing_plan import PricingPlan
+from . import pricing_category as pc
+
+# read only, memory mapped snapshot of a database's product prices and compiled pricing schemes, for
+#   lane terminals that start often. a terminal opens the file with CatalogSnapshot and prices baskets
+#   from it without opening sqlite at all; the prices are read straight from the mapped file, so every
+#   process mapping the same snapshot shares one copy in the page cache.
+#
+# file layout (all integers little endian):
+#   header     HEADER struct: magic, format version, SKU width, product count, index, prices and
+#              schemes offsets
+#   SKU index  `product count` SKUs in ascending byte order, each UTF-8 encoded and NUL padded to
+#              `SKU width` bytes
+#   prices     `product count` int64 prices in cents, in the order of the SKU index (8 byte aligned)
+#   schemes    UTF-8 JSON of every exported scheme's pcrefids and price adjustments, up to the end of the file
+
+MAGIC = b'SMKTSNAP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIIIQQQ')
+PRICE = struct.Struct('<q')
+
+# pricing category classes by name. a pricing category is stored as its class name followed by the
+#   values of its __slots__, which every pricing category declares in constructor argument order.
+PRICING_CATEGORY_CLASSES = {pc_class.__name__: pc_class for pc_class in [pc.Simple] + list(pc.PRICING_CATEGORY_TYPE_MAP.values())}
+
+def encode_pricing_category(pricing_category):
+    pc_class = type(pricing_category)
+    if PRICING_CATEGORY_CLASSES.get(pc_class.__name__) is not pc_class:
+        raise ValueError('Pricing category type %s can not be stored in a snapshot' % pc_class.__name__)
+    return [pc_class.__name__] + [getattr(pricing_category, slot) for slot in pc_class.__slots__]
+
+def decode_pricing_category(record):
+    pc_class = PRICING_CATEGORY_CLASSES.get(record[0])
+    if pc_class is None:
+        raise ValueError("Unknown pricing category type '%s' in snapshot" % record[0])
+    return pc_class(*record[1:])
+
+# writes a snapshot of the products and the named schemes (by default every scheme) of a database,
+#   by default the database of the current context. the file is written next to `path` and renamed
+#   over it, so processes that have the previous snapshot mapped keep reading it undisturbed.
+def export_snapshot(path, scheme_names = None, database_path = None):
+    if database_path is None:
+        database_path = Database.get_database_path()
+        if database_path is None:
+            raise ValueError('Please set a path to the database before attempting to use it')
+    with Database.use(database_path):
+        if scheme_names is None:
+            scheme_names = read_scheme_names()
+        schemes = {}
+        for name in scheme_names:
+            scheme = Scheme.read_scheme(name)
+            schemes[name] = {
+                'pcrefids': list(scheme.pricing_category_refids),
+                'rules': [encode_pricing_category(rule) for rule in scheme.price_adjustments]
+            }
+    catalog_version, prices = get_catalog(database_path).snapshot_prices()
+
+    records = []
+    sku_width = 1
+    for sku, price in prices.items():
+        if type(price) is not int:
+            raise ValueError('Price of product SKU %s is not a whole number of cents' % sku)
+        key = sku.encode('utf-8')
+        if b'\0' in key:
+            raise ValueError('Product SKU %r can not be stored in a snapshot' % sku)
+        sku_width = max(sku_width, len(key))
+        records.append((key, price))
+    records.sort()
+
+    index_offset = HEADER.size
+    prices_offset = index_offset + sku_width * len(records)
+    prices_offset += -prices_offset % PRICE.size
+    schemes_offset = prices_offset + PRICE.size * len(records)
+    data = bytearray(schemes_offset)
+    HEADER.pack_into(data, 0, MAGIC, FORMAT_VERSION, sku_width, len(records), 0, index_offset, prices_offset, schemes_offset)
+    for position, (key, price) in enumerate(records):
+        start = index_offset + position * sku_width
+        data[start:start + len(key)] = key
+        PRICE.pack_into(data, prices_offset + position * PRICE.size, price)
+    data += json.dumps({'schemes': schemes}).encode('utf-8')
+
+    temporary_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.isfile(temporary_path):
+            os.remove(temporary_path)
+    return len(records)
+
+def read_scheme_names():
+    names = []
+    with Database(read_only=True) as db:
+        try:
+            db.execute('SELECT name FROM schemes ORDER BY name')
+            names = [record[0] for record in db.fetchall()]
+        except sqlite3.Error as err:
+            get_logger('Snapshot').error('Error occurred attempting to read the scheme names: %s' % str(err))
+    return names
+
+# read only Mapping of SKU -> price backed by the mapped SKU index and price records.
+# a lookup is a binary search over the fixed width SKU index; the prices of SKUs that have been looked
+#   up are remembered, so a lane only pays for the search once per product it actually sells.
+class MappedPrices(collections.abc.Mapping):
+    def __init__(self, mapped, sku_width, count, index_offset, prices_offset):
+        self.mapped = mapped
+        self.sku_width = sku_width
+        self.count = count
+        self.index_offset = index_offset
+        self.prices_offset = prices_offset
+        self.found = {}  # SKU -> price of every SKU looked up so far
+
+    # position of the SKU in the index, or -1
+    def find(self, sku):
+        key = sku.encode('utf-8')
+        width = self.sku_width
+        if len(key) > width:
+            return -1
+        key = key.ljust(width, b'\0')
+        mapped = self.mapped
+        base = self.index_offset
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = base + middle * width
+            if mapped[start:start + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        start = base + low * width
+        if low < self.count and mapped[start:start + width] == key:
+            return low
+        return -1
+
+    def get_sku(self, position):
+        start = self.index_offset + position * self.sku_width
+        return self.mapped[start:start + self.sku_width].rstrip(b'\0').decode('utf-8')
+
+    def get_price_at(self, position):
+        return PRICE.unpack_from(self.mapped, self.prices_offset + position * PRICE.size)[0]
+
+    def __getitem__(self, sku):
+        price = self.found.get(sku)
+        if price is None:
+            position = self.find(sku)
+            if position < 0:
+                raise KeyError(sku)
+            price = self.found[sku] = self.get_price_at(position)
+        return price
+
+    def __contains__(self, sku):
+        return sku in self.found or self.find(sku) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.get_sku(position)
+
+    def items(self):
+        return [(self.get_sku(position), self.get_price_at(position)) for position in range(self.count)]
+
+# an opened snapshot file. `prices` is the mapped SKU -> price Mapping and get_scheme returns a
+#   SchemeSnapshot priced from it, which a Checkout takes in place of a Scheme. the file stays mapped
+#   until close(); schemes returned by get_scheme must not be used after that.
+class CatalogSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            self.mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.mapped) < HEADER.size:
+                raise ValueError('%s is not a catalog snapshot' % path)
+            magic, version, sku_width, count, reserved, index_offset, prices_offset, schemes_offset = HEADER.unpack_from(self.mapped, 0)
+            if magic != MAGIC:
+                raise ValueError('%s is not a catalog snapshot' % path)
+            if version != FORMAT_VERSION:
+                raise ValueError('Catalog snapshot %s has unsupported format version %d' % (path, version))
+            if schemes_offset > len(self.mapped) or prices_offset + PRICE.size * count > schemes_offset:
+                raise ValueError('Catalog snapshot %s is truncated' % path)
+            self.schemes = json.loads(self.mapped[schemes_offset:].decode('utf-8'))['schemes']
+        except Exception:
+            self.mapped.close()
+            raise
+        self.prices = MappedPrices(self.mapped, sku_width, count, index_offset, prices_offset)
+        self.scheme_snapshots = {}  # name -> SchemeSnapshot, built on first use
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.scheme_snapshots = {}
+        self.mapped.close()
+
+    def get_price(self, sku):
+        try:
+            return self.prices[sku]
+        except KeyError:
+            raise ValueError('Requested product SKU %s does not match any products in the snapshot' % sku)
+
+    def has_product(self, sku):
+        return sku in self.prices
+
+    def get_scheme_names(self):
+        return sorted(self.schemes.keys())
+
+    def get_scheme(self, name):
+        snapshot = self.scheme_snapshots.get(name)
+        if snapshot is None:
+            definition = self.schemes.get(name)
+            if definition is None:
+                raise ValueError("Failed to fetch Scheme of name '%s' from the snapshot" % name)
+            rules = [decode_pricing_category(record) for record in definition['rules']]
+            plan = PricingPlan(rules, types.MappingProxyType(self.prices))
+            snapshot = self.scheme_snapshots[name] = SchemeSnapshot(name, definition['pcrefids'], plan)
+        return snapshot
+
+def main(argv = None):
+    import argparse  # imported here so that lane terminals opening a snapshot do not load it
+    parser = argparse.ArgumentParser(description='Export the products and pricing schemes of a database to a catalog snapshot file.')
+    parser.add_argument('database', help='path to the supermarket database')
+    parser.add_argument('snapshot', help='path of the snapshot file to write')
+    parser.add_argument('scheme', nargs='*', help='schemes to export (default every scheme)')
+    args = parser.parse_args(argv)
+    count = export_snapshot(args.snapshot, args.scheme or None, args.database)
+    sys.stdout.write('wrote %d products to %s\n' % (count, args.snapshot))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import threading
+import collections
+from .basket import Basket
+
+DEFAULT_MAX_SIZE = 10000  # basket totals remembered per cache
+POLICIES = ('lru', 'lfu')
+
+# canonical, hashable signature of a basket: the set of its (SKU, quantity) lines, without the SKUs whose
+#   quantity is zero, so dicts holding the same quantities share one signature whatever order they were
+#   scanned in. a Basket's signature is its packed lines, which are already in canonical (SKU id) order and
+#   avoid building the SKU strings; it only matches other Baskets, which is enough for the cache.
+def get_signature(checkout_items):
+    if type(checkout_items) is Basket:
+        return checkout_items.lines.tobytes()
+    if 0 in checkout_items.values():
+        return frozenset([line for line in checkout_items.items() if line[1]])
+    return frozenset(checkout_items.items())
+
+# bounded cache of basket signature -> total for one scheme, see Scheme.use_total_cache.
+# every entry belongs to the version of the scheme (its price adjustments and catalog) it was priced
+#   with. a lookup or store under any other version empties the cache first, so a total is never
+#   served after the prices or the scheme changed.
+# `policy` chooses what is evicted once `max_size` totals are held: 'lru' drops the least recently used
+#   total, 'lfu' the least frequently used one (the least recently used of those on a tie), which keeps
+#   the combos and express lane baskets that come back all day over one-off baskets.
+class TotalCache:
+    def __init__(self, max_size = DEFAULT_MAX_SIZE, policy = 'lru'):
+        if policy not in POLICIES:
+            raise ValueError("Unknown total cache policy '%s', expected one of %s" % (policy, ', '.join(POLICIES)))
+        if max_size < 1:
+            raise ValueError('Total cache size must be at least 1, got %d' % max_size)
+        self.max_size = max_size
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.version = None  # scheme version of every cached total
+        self.totals = {}  # signature -> total
+        self.recent = collections.OrderedDict()  # lru: signatures, least recently used first
+        self.counts = {}  # lfu: signature -> use count
+        self.by_count = {}  # lfu: use count -> OrderedDict of the signatures used that often, least recently used first
+        self.min_count = 0  # lfu: lowest use count of a cached signature
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.totals)
+
+    # empties the cache if it holds totals of another version; called with `lock` held
+    def check_version(self, version):
+        if version != self.version:
+            if self.totals:
+                self.invalidations += 1
+            self.clear_entries()
+            self.version = version
+
+    def clear_entries(self):
+        self.totals = {}
+        self.recent.clear()
+        self.counts = {}
+        self.by_count = {}
+        self.min_count = 0
+
+    # returns the cached total of the signature under the given version, or None
+    def get(self, signature, version):
+        with self.lock:
+            self.check_version(version)
+            total = self.totals.get(signature)
+            if total is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touch(signature)
+            return total
+
+    def put(self, signature, version, total):
+        with self.lock:
+            self.check_version(version)
+            if signature in self.totals:
+                self.totals[signature] = total
+                self.touch(signature)
+                return
+            if len(self.totals) >= self.max_size:
+                self.evict()
+            self.totals[signature] = total
+            if self.policy == 'lru':
+                self.recent[signature] = None
+            else:
+                self.counts[signature] = 1
+                self.by_count.setdefault(1, collections.OrderedDict())[signature] = None
+                self.min_count = 1
+
+    # records a use of a cached signature; called with `lock` held
+    def touch(self, signature):
+        if self.policy == 'lru':
+            self.recent.move_to_end(signature)
+            return
+        count = self.counts[signature]
+        signatures = self.by_count[count]
+        del signatures[signature]
+        if not signatures:
+            del self.by_count[count]
+            if self.min_count == count:
+                self.min_count = count + 1
+        self.counts[signature] = count + 1
+        self.by_count.setdefault(count + 1, collections.OrderedDict())[signature] = None
+
+    # drops one total according to the policy; called with `lock` held
+    def evict(self):
+        if self.policy == 'lru':
+            signature, _ = self.recent.popitem(last=False)
+        else:
+            signatures = self.by_count[self.min_count]
+            signature, _ = signatures.popitem(last=False)
+            if not signatures:
+                del self.by_count[self.min_count]
+            del self.counts[signature]
+        del self.totals[signature]
+        self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.clear_entries()
+            self.version = None
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self.totals),
+            'max_size': self.max_size,
+            'policy': self.policy
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
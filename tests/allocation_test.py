@@ -0,0 +1,153 @@
+import unittest
+import random
+import itertools
+import time
+from src.supermarket import *
+from test_helpers import *
+
+PRICES = {'1983': 199, '4900': 349, '8873': 249, '6732': 249, '0923': 1549}
+
+class TestAllocation(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def make_plan(self, rules):
+        return pricing_plan.PricingPlan([Simple()] + rules, PRICES)
+
+    # best discount by trying every count of every bundle and every split of the units left between deals
+    def brute_force_discount(self, plan, checkout_items):
+        deals = {}
+        bundles = []
+        for rule in plan.rules:
+            if isinstance(rule, BuyXGetYFree):
+                deals.setdefault(rule.sku, []).append(rule)
+            elif isinstance(rule, Bundled):
+                bundles.append(rule)
+        best = 0
+        for counts in itertools.product(*[range(min([checkout_items.get(sku, 0) for sku in b.skus]) + 1) for b in bundles]):
+            remaining = dict(checkout_items)
+            discount = 0
+            for bundle, count in zip(bundles, counts):
+                for sku in bundle.skus:
+                    remaining[sku] = remaining.get(sku, 0) - count
+                discount += (sum([plan.prices[sku] for sku in bundle.skus]) - bundle.price) * count
+            if min(remaining.values()) < 0:
+                continue
+            for sku, quantity in remaining.items():
+                sku_deals = deals.get(sku, [])
+                sku_best = 0
+                for split in itertools.product(range(quantity + 1), repeat=len(sku_deals)):
+                    if sum(split) <= quantity:
+                        sku_best = max(sku_best, sum([plan.prices[sku] * deal.get_free_count(units) for deal, units in zip(sku_deals, split)]))
+                discount += sku_best
+            best = max(best, discount)
+        return best
+
+    def test_no_overlap(self):
+        plan = self.make_plan([BuyXGetYFree('1983', 2, 1, 'toothbrush'), Bundled(499, ['6732', '4900'], 'chips_and_salsa')])
+        items = {'1983': 7, '6732': 2, '4900': 3, '8873': 1}
+        result = allocation.PromotionAllocator(plan).allocate(items)
+        self.assertEqual(result.total, plan.get_total(items))
+        self.assertEqual(result.assignments, {1: 7, 2: 2})
+        self.assertTrue(result.exact)
+
+    def test_overlap(self):
+        # chips are both in the bundle and buy one get one free, a unit only counts for one of them
+        plan = self.make_plan([BuyXGetYFree('6732', 1, 1, 'chips'), Bundled(499, ['6732', '4900'], 'chips_and_salsa')])
+        items = {'6732': 2, '4900': 1}
+        result = allocation.PromotionAllocator(plan).allocate(items)
+        self.assertEqual(result.discount, 249)
+        self.assertEqual(result.assignments, {1: 2})
+        self.assertEqual(result.total, 249 * 2 + 349 - 249)
+        self.assertEqual(plan.get_total(items), 249 * 2 + 349 - 249 - 99)  # stacked
+        items = {'6732': 3, '4900': 2}
+        result = allocation.PromotionAllocator(plan).allocate(items)
+        self.assertEqual(result.discount, 249 + 99)
+        self.assertEqual(result.assignments, {1: 2, 2: 1})
+
+    def test_bundle_without_saving(self):
+        plan = self.make_plan([Bundled(700, ['6732', '4900'], 'chips_and_salsa')])
+        result = allocation.PromotionAllocator(plan).allocate({'6732': 1, '4900': 1})
+        self.assertEqual(result.discount, 0)
+        self.assertEqual(result.assignments, {})
+        self.assertEqual(result.total, 249 + 349)
+
+    def test_split_between_deals(self):
+        plan = self.make_plan([BuyXGetYFree('1983', 2, 1, 'buy2get1'), BuyXGetYFree('1983', 1, 1, 'buy1get1')])
+        for quantity in range(12):
+            result = allocation.PromotionAllocator(plan).allocate({'1983': quantity})
+            self.assertEqual(result.discount, self.brute_force_discount(plan, {'1983': quantity}))
+            self.assertLessEqual(sum(result.assignments.values()), quantity)
+
+    def test_random_baskets(self):
+        rng = random.Random(7)
+        plan = self.make_plan([BuyXGetYFree('6732', 1, 1, 'chips'), BuyXGetYFree('4900', 2, 1, 'salsa'),
+                               Bundled(499, ['6732', '4900'], 'chips_and_salsa'), Bundled(400, ['6732', '8873'], 'chips_and_milk'),
+                               Bundled(800, ['4900', '4900', '1983'], 'party'), AdditionalTaxes('0923', 9.25, 'wine')])
+        allocator = allocation.PromotionAllocator(plan)
+        for i in range(200):
+            items = {sku: rng.randint(0, 5) for sku in PRICES}
+            items = {sku: quantity for sku, quantity in items.items() if quantity}
+            result = allocator.allocate(items)
+            self.assertEqual(result.discount, self.brute_force_discount(plan, items))
+            self.assertTrue(result.exact)
+            self.assertGreaterEqual(result.total, plan.get_total(items))
+
+    def test_search_budget(self):
+        plan = self.make_plan([BuyXGetYFree('6732', 1, 1, 'chips'), Bundled(499, ['6732', '4900'], 'chips_and_salsa'),
+                               Bundled(400, ['6732', '8873'], 'chips_and_milk')])
+        items = {'6732': 40, '4900': 30, '8873': 30}
+        exact = allocation.PromotionAllocator(plan).allocate(items)
+        greedy = allocation.PromotionAllocator(plan, max_states=5).allocate(items)
+        self.assertTrue(exact.exact)
+        self.assertFalse(greedy.exact)
+        self.assertLessEqual(greedy.discount, exact.discount)
+        self.assertGreater(greedy.discount, 0)
+
+    def test_large_quantities(self):
+        plan = self.make_plan([BuyXGetYFree('1983', 2, 1, 'buy2get1'), BuyXGetYFree('1983', 1, 1, 'buy1get1'),
+                               BuyXGetYFree('6732', 1, 1, 'chips'), Bundled(499, ['6732', '4900'], 'chips_and_salsa')])
+        allocator = allocation.PromotionAllocator(plan, cache_size=4)
+        started = time.perf_counter()
+        # too many splits between the two toothbrush deals: every unit goes to the better one
+        result = allocator.allocate({'1983': 3000})
+        self.assertFalse(result.exact)
+        self.assertEqual(result.discount, 199 * 1000)  # buy 1 get 1 frees one unit in three
+        # a single deal is priced in closed form, so the bundle search stays exact
+        result = allocator.allocate({'6732': 5000, '4900': 5000})
+        self.assertTrue(result.exact)
+        self.assertGreaterEqual(result.discount, (249 + 349 - 499) * 5000)  # at least every unit in a bundle
+        self.assertLess(time.perf_counter() - started, 2)
+        for quantity in range(10):
+            allocator.allocate({'1983': quantity})
+        self.assertLessEqual(len(allocator.unit_discounts), 4)
+
+    def test_cache(self):
+        plan = self.make_plan([Bundled(499, ['6732', '4900'], 'chips_and_salsa')])
+        allocator = allocation.PromotionAllocator(plan, cache_size=2)
+        for i in range(3):
+            allocator.allocate({'6732': 1, '4900': 1, '1983': 2})
+        self.assertEqual(len(allocator.cache), 1)
+        for quantity in range(1, 5):
+            allocator.allocate({'6732': quantity, '4900': 1})
+        self.assertEqual(len(allocator.cache), 2)
+
+    def test_scheme(self):
+        self.setup()
+        s = scheme.Scheme.read_scheme('default')
+        items = {'1983': 4, '4900': 3, '8873': 2, '6732': 1, '0923': 2}
+        self.assertEqual(s.get_allocated_total(items), s.get_total(items))
+        self.assertIs(allocation.get_allocator(s.compile()), allocation.get_allocator(s.compile()))
+        self.assertEqual(s.snapshot().get_allocated_total(items), s.get_total(items))
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import copy
+import pickle
+import logging
+import tracemalloc
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestBasket(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_add(self):
+        b = basket.Basket()
+        self.assertEqual(len(b), 0)
+        self.assertEqual(b.add('1983'), 1)
+        self.assertEqual(b.add('1983', 2), 3)
+        self.assertEqual(b.add('4900'), 1)
+        self.assertEqual(b['1983'], 3)
+        self.assertEqual(b.get('8873', 0), 0)
+        self.assertTrue('4900' in b)
+        self.assertFalse('8873' in b)
+        self.assertEqual(b, {'1983': 3, '4900': 1})
+        self.assertEqual(len(b), 2)
+
+    def test_remove(self):
+        b = basket.Basket({'1983': 2, '4900': 1})
+        self.assertEqual(b.add('1983', -1), 1)
+        self.assertEqual(b.add('4900', -1), 0)
+        self.assertFalse('4900' in b)
+        self.assertEqual(dict(b), {'1983': 1})
+        with self.assertRaises(ValueError):
+            b.add('4900', -1)
+        with self.assertRaises(ValueError):
+            b.add('1983', -2)
+        self.assertEqual(b['1983'], 1)
+        with self.assertRaises(KeyError):
+            b['4900']
+
+    def test_mapping(self):
+        items = {'0923': 2, '1983': 4, '6732': 1}
+        b = basket.Basket(items)
+        self.assertEqual(sorted(b.keys()), sorted(items.keys()))
+        self.assertEqual(sorted(b.items()), sorted(items.items()))
+        self.assertEqual(dict(b), items)
+        self.assertEqual(copy.copy(b), items)
+        self.assertEqual(copy.deepcopy(b), items)
+        self.assertEqual(pickle.loads(pickle.dumps(b)), items)
+        c = b.copy()
+        c.add('0923')
+        self.assertEqual(b['0923'], 2)
+        self.assertEqual(c['0923'], 3)
+        self.assertNotEqual(b, c)
+
+    def test_scheme_total(self):
+        self.setup()
+        items = {'1983': 4, '4900': 3, '8873': 2, '6732': 1, '0923': 2}
+        s = scheme.Scheme.read_scheme('default')
+        self.assertEqual(s.get_total(basket.Basket(items)), s.get_total(items))
+        self.teardown()
+
+    def measure(self, build, count):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            kept = [build(i) for i in range(count)]
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return (after - before) / len(kept)
+
+    def test_memory(self):
+        skus = ['%07d' % i for i in range(30)]
+        basket.get_interner().get_id(skus[0])
+        for sku in skus:
+            basket.get_interner().get_id(sku)
+
+        def build_dict(i):
+            items = {}
+            for sku in skus:
+                items[sku] = items.get(sku, 0) + 2
+            return items
+
+        def build_basket(i):
+            b = basket.Basket()
+            for sku in skus:
+                b.add(sku, 2)
+            return b
+
+        self.assertLessEqual(self.measure(build_basket, 1000), 0.5 * self.measure(build_dict, 1000))
+
+    def test_item_memory(self):
+        self.setup()
+        loggers = len(logging.Logger.manager.loggerDict)
+        product = item.Item.read_product('1983')
+        self.assertFalse(hasattr(product, '__dict__'))
+        with self.assertRaises(AttributeError):
+            product.weight = 10
+        self.assertEqual(len(logging.Logger.manager.loggerDict), loggers)
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import random
+from src.supermarket import *
+from test_helpers import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestBatch(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.s = scheme.Scheme.read_scheme('default')
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def random_baskets(self, count):
+        rng = random.Random(1983)
+        skus = ['1983', '4900', '8873', '6732', '0923']
+        baskets = []
+        for i in range(count):
+            basket = {}
+            for sku in rng.sample(skus, rng.randint(0, len(skus))):
+                basket[sku] = rng.randint(1, 40)
+            baskets.append(basket)
+        return baskets
+
+    def test_get_totals(self):
+        self.setup()
+
+        baskets = self.random_baskets(500)
+        expected = [self.s.get_total(basket) for basket in baskets]
+        self.assertEqual(self.s.get_totals(baskets), expected)
+        self.assertEqual(self.s.get_totals(iter(baskets), chunk_size=7), expected)
+        self.assertEqual(self.s.get_totals([]), [])
+
+        self.teardown()
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_batch_pricer(self):
+        self.setup()
+
+        pricer = batch.BatchPricer(self.s.compile())
+        baskets = self.random_baskets(100) + [{'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1}]
+        totals = pricer.get_totals(baskets, chunk_size=16)
+        self.assertEqual(totals[-1], 3037)
+        self.assertEqual(totals, [self.s.get_total(basket) for basket in baskets])
+        self.assertEqual(list(pricer.iter_totals(baskets[:3])), totals[:3])
+
+        self.teardown()
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_pricer_is_cached(self):
+        self.setup()
+
+        plan = self.s.compile()
+        batch.get_totals(plan, [{'1983': 1}])
+        pricer = batch._pricers.get(plan)
+        self.assertNotEqual(pricer, None)
+        batch.get_totals(plan, [{'1983': 1}])
+        self.assertIs(batch._pricers.get(plan), pricer)
+
+        self.teardown()
+
+    def test_unknown_sku(self):
+        self.setup()
+
+        with self.assertRaises(ValueError):
+            self.s.get_totals([{'1983': 1}, {'0000': 1}])
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
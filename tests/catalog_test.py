@@ -0,0 +1,78 @@
+import unittest
+from src.supermarket import *
+from test_helpers import *
+import sqlite3
+
+
+class TestCatalog(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        database.Database.database_path = self.database_path
+        self.catalog = catalog.get_catalog()
+        self.catalog.reset_stats()
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_get_product(self):
+        self.setup()
+
+        toothbrush = self.catalog.get_product('1983')
+        self.assertEqual(toothbrush.sku, '1983')
+        self.assertEqual(toothbrush.name, 'toothbrush')
+        self.assertEqual(toothbrush.price, 199)
+        self.assertEqual(self.catalog.get_product('0000'), None)
+
+        self.teardown()
+
+    def test_bulk_load(self):
+        self.setup()
+
+        self.catalog.get_product('1983')
+        self.assertEqual(self.catalog.get_stats()['size'], 5)
+        self.catalog.get_product('4900')
+        self.catalog.get_product('4900')
+        stats = self.catalog.get_stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 0)
+
+        self.teardown()
+
+    def test_get_price(self):
+        self.setup()
+
+        self.assertEqual(self.catalog.get_price('0923'), 1549)
+        with self.assertRaises(ValueError):
+            self.catalog.get_price('0000')
+
+        self.teardown()
+
+    def test_create_product_invalidates(self):
+        self.setup()
+
+        self.assertEqual(self.catalog.get_product('5555'), None)
+        version = self.catalog.version
+        item.Item('5555', 'bread', 299).create_product()
+        self.assertGreater(self.catalog.version, version)
+        bread = self.catalog.get_product('5555')
+        self.assertEqual(bread.price, 299)
+
+        self.teardown()
+
+    def test_product_written_outside_item(self):
+        self.setup()
+
+        self.catalog.get_product('1983')  # bulk load before the write
+        connection = sqlite3.connect(self.database_path)
+        connection.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('5555', 'bread', 299))
+        connection.commit()
+        connection.close()
+        self.assertEqual(self.catalog.get_product('5555').price, 299)
+        self.assertEqual(self.catalog.get_stats()['misses'], 1)
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
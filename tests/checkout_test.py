@@ -35,6 +35,16 @@ class TestCheckout(unittest.TestCase):
 
         self.teardown()
 
+    def test_scan_unknown_sku(self):
+        self.setup()
+
+        self.c = checkout.Checkout(self.s)
+        with self.assertRaises(ValueError):
+            self.c.scan('0000')
+        self.assertEqual(self.c.items, {})
+
+        self.teardown()
+
     def test_get_total(self):
         self.setup()
 
@@ -51,5 +61,56 @@ class TestCheckout(unittest.TestCase):
 
         self.teardown()
 
+    def test_running_total(self):
+        self.setup()
+
+        self.c = checkout.Checkout(self.s, debug=True)  # debug checks each total against a full recompute
+        self.assertEqual(self.c.getTotal(), 0)
+        for sku in ['1983', '4900', '8873', '6732', '0923', '1983', '1983', '1983', '6732', '4900', '0923']:
+            self.c.scan(sku)
+            self.assertEqual(self.c.getTotal(), self.s.get_total(self.c.items))
+
+        self.teardown()
+
+    def test_unscan(self):
+        self.setup()
+
+        self.c = checkout.Checkout(self.s, debug=True)
+        for sku in ['1983', '4900', '8873', '6732', '0923', '1983', '1983', '1983']:
+            self.c.scan(sku)
+        self.c.unscan('0923')
+        self.assertNotIn('0923', self.c.items)
+        self.c.unscan('1983')
+        self.assertEqual(self.c.items['1983'], 3)
+        self.assertEqual(self.c.getTotal(), 3037 - 1549 - 143 - 199)
+        with self.assertRaises(ValueError):
+            self.c.unscan('0923')
+
+        self.teardown()
+
+    def test_running_total_after_price_change(self):
+        self.setup()
+
+        self.c = checkout.Checkout(self.s, debug=True)
+        self.c.scan('8873')
+        self.c.scan('8873')
+        self.assertEqual(self.c.getTotal(), 498)
+        item.Item('5555', 'bread', 299).create_product()  # recompiles the scheme's plan
+        self.c.scan('5555')
+        self.assertEqual(self.c.getTotal(), 797)
+
+        self.teardown()
+
+    def test_debug_mismatch(self):
+        self.setup()
+
+        self.c = checkout.Checkout(self.s, debug=True)
+        self.c.scan('1983')
+        self.c.simple_subtotal += 1  # corrupt the running total
+        with self.assertRaises(RuntimeError):
+            self.c.getTotal()
+
+        self.teardown()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,151 @@
+import unittest
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestDatabase(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_constructor(self):
+        self.setup()
+
+        db = database.Database(read_only=True)
+        self.assertEqual(db.database_path, self.database_path)
+        self.assertTrue(db.read_only)
+
+        self.teardown()
+
+    def test_context_database_path(self):
+        self.setup()
+
+        database.Database('other.db')  # an explicit path is only used by that instance
+        self.assertEqual(database.Database.database_path, self.database_path)
+        with database.Database.use('other.db'):
+            self.assertEqual(database.Database().database_path, 'other.db')
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # other threads keep the process-wide default
+                self.assertEqual(executor.submit(database.Database.get_database_path).result(), self.database_path)
+        self.assertEqual(database.Database().database_path, self.database_path)
+
+        self.teardown()
+
+    def test_persistent_connection(self):
+        self.setup()
+
+        with database.Database() as db:
+            first = db.connection
+        with database.Database(read_only=True) as db:
+            second = db.connection
+        self.assertIs(first, second)
+
+        self.teardown()
+
+    def test_pragmas(self):
+        self.setup()
+
+        with database.Database(read_only=True) as db:
+            db.execute('PRAGMA journal_mode')
+            journal_mode = db.fetchone()[0]
+            db.execute('PRAGMA synchronous')
+            synchronous = db.fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(synchronous, 1)  # NORMAL
+
+        self.teardown()
+
+    def test_read_only_skips_commit(self):
+        self.setup()
+
+        with database.Database(read_only=True) as db:
+            db.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('5555', 'bread', 299))
+        with database.Database() as db:
+            db.execute('SELECT * FROM products WHERE SKU=(?)', ('5555',))
+            result = db.fetchall()
+        self.assertEqual(result, [])
+
+        self.teardown()
+
+    def test_exception_rolls_back(self):
+        self.setup()
+
+        with self.assertRaises(KeyError):
+            with database.Database() as db:
+                db.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('5555', 'bread', 299))
+                raise KeyError('5555')
+        with database.Database() as db:
+            db.execute('SELECT * FROM products WHERE SKU=(?)', ('5555',))
+            result = db.fetchall()
+        self.assertEqual(result, [])
+
+        self.teardown()
+
+    def test_nested_blocks(self):
+        self.setup()
+
+        with database.Database() as db:
+            db.execute('DELETE FROM products')
+        with database.Database() as db:
+            db.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('1', 'one', 1))
+            self.assertIsNone(item.Item.read_product('9999'))  # a nested read only block
+            db.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('2', 'two', 2))
+            with database.Database() as nested:
+                nested.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('3', 'three', 3))
+            with self.assertRaises(KeyError):
+                with database.Database() as nested:
+                    nested.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('4', 'four', 4))
+                    raise KeyError('4')  # rolls back only the nested block
+        with database.Database(read_only=True) as db:
+            db.execute('SELECT SKU FROM products ORDER BY SKU')
+            self.assertEqual([record[0] for record in db.fetchall()], ['1', '2', '3'])
+
+        # an outer block that fails rolls back the nested blocks it contains
+        with self.assertRaises(KeyError):
+            with database.Database() as db:
+                with database.Database() as nested:
+                    nested.execute('INSERT INTO products(SKU, name, price) VALUES(?, ?, ?)', ('5', 'five', 5))
+                raise KeyError('5')
+        self.assertIsNone(item.Item.read_product('5'))
+
+        self.teardown()
+
+    def test_close_connections(self):
+        self.setup()
+
+        with database.Database() as db:
+            first = db.connection
+        database.Database.close_connections(self.database_path)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            first.execute('SELECT 1')
+        with database.Database() as db:
+            second = db.connection
+        self.assertIsNot(first, second)
+
+        self.teardown()
+
+    def test_thread_pool(self):
+        self.setup()
+
+        def read_connection(sku):
+            with database.Database(read_only=True) as db:
+                db.execute('SELECT price FROM products WHERE SKU=(?)', (sku,))
+                return db.connection, db.fetchone()[0]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(read_connection, ['1983', '4900', '8873', '6732', '0923'] * 20))
+        self.assertEqual([price for connection, price in results[:5]], [199, 349, 249, 249, 1549])
+        connections = set(id(connection) for connection, price in results)
+        self.assertLessEqual(len(connections), 4)  # at most one connection per worker thread
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from src.supermarket import *
 from test_helpers import *
+import os
 import sqlite3
 
 
@@ -61,5 +62,112 @@ class TestItem(unittest.TestCase):
 
         self.teardown()
 
+    def test_create_products(self):
+        self.setup()
+
+        Item('1983', 'toothbrush', 199).create_product()
+        products = [
+            Item('4900', 'salsa', 349),
+            ('8873', 'milk', 249),
+            ('1983', 'toothbrush', 189),  # existing SKU, updated
+            ('6732', 'chips', '249'),
+            ('6732', 'chips', 259),  # repeated SKU, updated
+            ('', 'nothing', 100),  # rejected: no SKU
+            ('0923', 'wine', 15.49),  # rejected: price is not in cents
+            ('0924', None, 100)  # rejected: no name
+        ]
+        counts = item.Item.create_products(products, chunk_size=3)
+        self.assertEqual(counts, {'inserted': 3, 'updated': 2, 'rejected': 3})
+
+        connection = sqlite3.connect(self.database_path)
+        cursor = connection.cursor()
+        cursor.execute('SELECT SKU, name, price FROM products ORDER BY SKU')
+        result = cursor.fetchall()
+        connection.close()
+        self.assertEqual(result, [('1983', 'toothbrush', 189), ('4900', 'salsa', 349), ('6732', 'chips', 259), ('8873', 'milk', 249)])
+        self.assertEqual(catalog.get_catalog().get_price('1983'), 189)
+
+        self.teardown()
+
+    def test_create_products_rejected_chunk(self):
+        self.setup()
+
+        connection = sqlite3.connect(self.database_path)
+        connection.execute("CREATE TRIGGER reject_negative_price BEFORE INSERT ON products WHEN NEW.price < 0 "
+                           "BEGIN SELECT RAISE(ABORT, 'negative price'); END")
+        connection.commit()
+        connection.close()
+
+        # a rejected chunk inside an outer block only rolls back its own rows
+        with database.Database() as db:
+            db.execute("INSERT INTO products(SKU, name, price) VALUES ('1983', 'toothbrush', 199)")
+            counts = item.Item.create_products([('4900', 'salsa', 349), ('8873', 'milk', 249), ('6732', 'chips', -1)], chunk_size=2)
+            db.execute("INSERT INTO products(SKU, name, price) VALUES ('0923', 'wine', 1549)")
+        self.assertEqual(counts, {'inserted': 2, 'updated': 0, 'rejected': 1})
+
+        connection = sqlite3.connect(self.database_path)
+        result = connection.execute('SELECT SKU FROM products ORDER BY SKU').fetchall()
+        connection.close()
+        self.assertEqual(result, [('0923',), ('1983',), ('4900',), ('8873',)])
+
+        self.teardown()
+
+    def test_import_csv(self):
+        self.setup()
+
+        csv_path = 'example_products.csv'
+        with open(csv_path, 'w', encoding='utf-8') as csv_file:
+            csv_file.write('sku,name,price\n1983,toothbrush,199\n4900,salsa,349\n8873,milk,two dollars\n')
+        try:
+            counts = item.Item.import_csv(csv_path)
+        finally:
+            os.remove(csv_path)
+        self.assertEqual(counts, {'inserted': 2, 'updated': 0, 'rejected': 1})
+        self.assertEqual(item.Item.read_product('4900').price, 349)
+
+        self.teardown()
+
+    def test_update_product(self):
+        self.setup()
+
+        Item('1983', 'toothbrush', 199).create_product()
+        self.assertEqual(catalog.get_catalog().get_price('1983'), 199)
+        toothbrush = item.Item('1983', 'electric toothbrush', 2999)
+        toothbrush.update_product()
+        result = item.Item.read_product('1983')
+        self.assertEqual(result.name, 'electric toothbrush')
+        self.assertEqual(result.price, 2999)
+        self.assertEqual(catalog.get_catalog().get_price('1983'), 2999)
+        with self.assertRaises(ValueError):
+            item.Item('0000', 'nothing', 1).update_product()
+
+        self.teardown()
+
+    def test_update_products(self):
+        self.setup()
+
+        item.Item.create_products([('1983', 'toothbrush', 199), ('4900', 'salsa', 349)])
+        updated = item.Item.update_products([('1983', 'toothbrush', 189), ('4900', 'salsa', 339), ('0000', 'nothing', 1)])
+        self.assertEqual(updated, 2)
+        self.assertEqual(item.Item.read_product('4900').price, 339)
+        self.assertEqual(item.Item.read_product('0000'), None)
+
+        self.teardown()
+
+    def test_delete_product(self):
+        self.setup()
+
+        item.Item.create_products([('1983', 'toothbrush', 199), ('4900', 'salsa', 349), ('8873', 'milk', 249)])
+        self.assertEqual(catalog.get_catalog().get_price('1983'), 199)
+        item.Item.delete_product('1983')
+        self.assertEqual(item.Item.read_product('1983'), None)
+        self.assertEqual(catalog.get_catalog().get_product('1983'), None)
+        with self.assertRaises(ValueError):
+            item.Item.delete_product('1983')
+        self.assertEqual(item.Item.delete_products(['4900', '8873', '0000']), 2)
+        self.assertEqual(item.Item.get_skus(), [])
+
+        self.teardown()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,114 @@
+import unittest
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestMetrics(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        metrics.registry.reset()
+        metrics.enable()
+
+    def teardown(self):
+        metrics.disable()
+        metrics.registry.reset()
+        kill_database(self.database_path)
+
+    def test_counter_and_histogram(self):
+        registry = metrics.Registry()
+        counter = registry.counter('requests', 'Requests served.', ['code'])
+        counter.inc(1, ('200',))
+        counter.inc(2, ('200',))
+        counter.inc(1, ('500',))
+        self.assertEqual(counter.get(('200',)), 3)
+        self.assertIs(registry.counter('requests', 'Requests served.', ['code']), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram('requests', 'Requests served.')
+
+        histogram = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.get_count(), 4)
+        self.assertAlmostEqual(histogram.get_sum(), 2.65)
+
+        samples = registry.get_samples()
+        self.assertEqual(samples['requests_total{code="200"}'], 3)
+        self.assertEqual(samples['latency_seconds_bucket{le="0.1"}'], 2)
+        self.assertEqual(samples['latency_seconds_bucket{le="1"}'], 3)
+        self.assertEqual(samples['latency_seconds_bucket{le="+Inf"}'], 4)
+        registry.reset()
+        self.assertEqual(registry.get_samples(), {})
+
+    def test_dump_prometheus(self):
+        registry = metrics.Registry()
+        registry.counter('scans', 'Items scanned.').inc(5)
+        registry.gauge('size', 'Catalog "size".', lambda: {('a\\b',): 1.5}, ['label'])
+        self.assertEqual(registry.dump_prometheus(),
+                         '# HELP scans Items scanned.\n'
+                         '# TYPE scans counter\n'
+                         'scans_total 5\n'
+                         '# HELP size Catalog "size".\n'
+                         '# TYPE size gauge\n'
+                         'size{label="a\\\\b"} 1.5\n')
+
+    def test_instrumentation(self):
+        self.setup()
+
+        s = scheme.Scheme.read_scheme('default')
+        scheme.Scheme.read_scheme('default')
+        c = checkout.Checkout(s)
+        for sku in ['1983', '4900', '8873', '6732', '0923', '1983', '1983', '1983']:
+            c.scan(sku)
+        self.assertEqual(c.getTotal(), 3037)
+        self.assertEqual(s.get_total(c.items), 3037)
+
+        self.assertEqual(metrics.SCHEME_READS.get(('miss',)), 1)
+        self.assertEqual(metrics.SCHEME_READS.get(('hit',)), 1)
+        self.assertEqual(metrics.CHECKOUT_SCAN_SECONDS.get_count(), 8)
+        self.assertEqual(metrics.CHECKOUT_TOTAL_SECONDS.get_count(), 1)
+        self.assertEqual(metrics.SCHEME_TOTAL_SECONDS.get_count(), 1)
+        self.assertEqual(metrics.RULE_SECONDS.get_count(('BuyXGetYFree',)), 1)
+        self.assertEqual(metrics.RULE_SECONDS.get_count(('Simple',)), 1)
+        self.assertGreater(metrics.DB_QUERIES.get(), 0)
+        self.assertGreater(metrics.DB_BLOCKS.get(('read',)), 0)
+        # only the first scan loads the catalog, every other scan is served from memory
+        samples = metrics.registry.get_samples()
+        self.assertGreater(metrics.CHECKOUT_SCAN_QUERIES.get_sum(), 0)
+        self.assertEqual(samples['supermarket_checkout_scan_queries_bucket{le="0"}'], 7)
+        self.assertEqual(samples['supermarket_catalog_products{database="example.db"}'], 5)
+
+        # totals served by a total cache are timed as well
+        cached = scheme.Scheme.load_scheme('default')
+        cached.use_total_cache(10)
+        self.assertEqual(cached.get_total(c.items), 3037)
+        self.assertEqual(cached.get_total(c.items), 3037)
+        self.assertEqual(metrics.SCHEME_TOTAL_CACHE.get(('hit',)), 1)
+        self.assertEqual(metrics.SCHEME_TOTAL_SECONDS.get_count(), 3)
+
+        dump = metrics.registry.dump_prometheus()
+        self.assertIn('# TYPE supermarket_rule_seconds histogram\n', dump)
+        self.assertIn('supermarket_scheme_reads_total{result="hit"} 1\n', dump)
+
+        self.teardown()
+
+    def test_disabled(self):
+        self.setup()
+        metrics.disable()
+
+        s = scheme.Scheme.read_scheme('default')
+        c = checkout.Checkout(s)
+        c.scan('1983')
+        c.getTotal()
+        self.assertEqual(metrics.CHECKOUT_SCAN_SECONDS.get_count(), 0)
+        self.assertEqual(metrics.SCHEME_READS.get(('miss',)), 0)
+        self.assertEqual(metrics.DB_QUERIES.get(), 0)
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
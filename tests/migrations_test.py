@@ -0,0 +1,118 @@
+import unittest
+import sqlite3
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestMigrations(unittest.TestCase):
+    def setup(self):
+        # a legacy database: original tables only, with comma joined pcrefids and bundle skus
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        connection = sqlite3.connect(self.database_path)
+        connection.execute("INSERT INTO pcrefs(pctype, name) VALUES ('bundled', 'chips_and_salsa')")
+        connection.execute("INSERT INTO pc_bundled(price, skus, name, pcrefid) VALUES (499, '6732,4900', 'chips_and_salsa', 1)")
+        connection.execute("INSERT INTO pcrefs(pctype, name) VALUES ('buyxgetyfree', 'buy2get1toothbrush')")
+        connection.execute("INSERT INTO pc_buyxgety(sku, x, y, name, pcrefid) VALUES ('1983', 2, 1, 'buy2get1toothbrush', 2)")
+        connection.execute("INSERT INTO schemes(name, pcrefids) VALUES ('default', '2,1')")
+        connection.commit()
+        connection.close()
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def query(self, sql, args = ()):
+        with database.Database(read_only=True) as db:
+            db.execute(sql, args)
+            return db.fetchall()
+
+    def test_migrate_in_place(self):
+        self.setup()
+
+        self.assertEqual(self.query('PRAGMA user_version'), [(migrations.LATEST_VERSION,)])
+        self.assertEqual(self.query('SELECT pcrefid FROM scheme_pcrefs ORDER BY position'), [(2,), (1,)])
+        self.assertEqual(self.query('SELECT sku FROM bundle_skus WHERE pcrefid=1 ORDER BY position'), [('6732',), ('4900',)])
+        default = scheme.Scheme.read_scheme('default')
+        self.assertEqual(default.pricing_category_refids, [2, 1])
+        self.assertEqual(default.price_adjustments[2].skus, ['6732', '4900'])
+
+        self.teardown()
+
+    def test_migrate_is_idempotent(self):
+        self.setup()
+
+        connection = database.Database.get_connection(self.database_path)
+        self.assertEqual(migrations.migrate(connection), [])
+        self.assertEqual(migrations.get_version(connection), migrations.LATEST_VERSION)
+
+        self.teardown()
+
+    def test_migrate_new_database(self):
+        self.assertEqual(migrations.migrate(sqlite3.connect(':memory:')), [1, 2, 3, 4])
+
+    def test_definitions_version(self):
+        self.setup()
+
+        version = self.query('SELECT version FROM definitions_version')[0][0]
+        with database.Database() as db:
+            db.execute("UPDATE schemes SET pcrefids='1' WHERE name='default'")
+            db.execute("INSERT INTO pc_taxes(sku, tax_rate, name, pcrefid) VALUES ('0923', 9.25, 'wine', 3)")
+            db.execute("DELETE FROM pc_buyxgety WHERE pcrefid=2")
+        self.assertEqual(self.query('SELECT version FROM definitions_version'), [(version + 3,)])
+        with database.Database() as db:
+            db.execute("INSERT INTO products(SKU, name, price) VALUES ('5555', 'bread', 299)")
+        self.assertEqual(self.query('SELECT version FROM definitions_version'), [(version + 3,)])
+
+        self.teardown()
+
+    def test_junction_tables(self):
+        self.setup()
+
+        # SKUs may hold any character but the comma
+        Bundled(299, ['67\t32', '49"00'], 'tabbed').create_pricing_category()
+        self.assertEqual(self.query('SELECT sku FROM bundle_skus WHERE pcrefid=3 ORDER BY position'), [('67\t32',), ('49"00',)])
+        self.assertEqual(Bundled.read_pricing_category(3).skus, ['67\t32', '49"00'])
+        self.assertEqual(self.query('SELECT skus FROM pc_bundled WHERE pcrefid=3'), [('67\t32,49"00',)])  # the legacy mirror
+
+        Scheme('tabbed', [3, 2]).create_scheme()
+        self.assertEqual(scheme.Scheme.load_scheme('tabbed').pricing_category_refids, [3, 2])
+
+        with database.Database() as db:
+            db.execute("DELETE FROM pc_bundled WHERE pcrefid=1")
+            db.execute("DELETE FROM schemes WHERE name='default'")
+        self.assertEqual(self.query('SELECT pcrefid FROM bundle_skus GROUP BY pcrefid'), [(3,)])
+        self.assertEqual(self.query('SELECT pcrefid FROM scheme_pcrefs ORDER BY position'), [(3,), (2,)])
+
+        self.teardown()
+
+    def test_split_legacy_columns(self):
+        self.setup()
+
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE legacy (Id INTEGER PRIMARY KEY, skus TEXT)')
+        connection.executemany('INSERT INTO legacy(skus) VALUES (?)', [('67\t32,4900',), ('a"b\\c',), ('',), (None,)])
+        self.assertEqual(connection.execute('SELECT * FROM (%s) ORDER BY id, position' % migrations.split_text_column('legacy', 'Id', 'skus')).fetchall(),
+                         [(1, 0, '67\t32'), (1, 1, '4900'), (2, 0, 'a"b\\c')])
+        connection.close()
+
+        self.teardown()
+
+    def test_pcrefids_for_sku(self):
+        self.setup()
+
+        AdditionalTaxes('4900', 5, 'salsa_tax').create_pricing_category()
+        self.assertEqual(pricing_category.get_pcrefids_for_sku('4900'), [1, 3])
+        self.assertEqual(pricing_category.get_pcrefids_for_sku('1983'), [2])
+        self.assertEqual(pricing_category.get_pcrefids_for_sku('0000'), [])
+        plan = ' '.join(str(row[-1]) for row in self.query(
+            'EXPLAIN QUERY PLAN SELECT pcrefid FROM pc_buyxgety WHERE sku=(?) UNION SELECT pcrefid FROM pc_taxes WHERE sku=(?) '
+            'UNION SELECT pcrefid FROM bundle_skus WHERE sku=(?)', ('4900', '4900', '4900')))
+        self.assertIn('pc_buyxgety_sku', plan)
+        self.assertIn('pc_taxes_sku', plan)
+        self.assertIn('bundle_skus_sku', plan)
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
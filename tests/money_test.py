@@ -0,0 +1,146 @@
+import unittest
+import random
+import fractions
+from src.supermarket import *
+from test_helpers import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestMoney(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.s = scheme.Scheme.read_scheme('default')
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def random_baskets(self, count):
+        rng = random.Random(1983)
+        skus = ['1983', '4900', '8873', '6732', '0923']
+        baskets = []
+        for i in range(count):
+            basket = {}
+            for sku in rng.sample(skus, rng.randint(0, len(skus))):
+                basket[sku] = rng.randint(1, 40)
+            baskets.append(basket)
+        return baskets
+
+    def test_divide(self):
+        # numerator / 4 for 2.25, 2.5, 2.75, 3.5 and their negatives, one column per rounding mode
+        cases = {
+            9:   {money.ROUND_HALF_UP: 2, money.ROUND_HALF_DOWN: 2, money.ROUND_HALF_EVEN: 2, money.ROUND_DOWN: 2,
+                  money.ROUND_UP: 3, money.ROUND_FLOOR: 2, money.ROUND_CEILING: 3},
+            10:  {money.ROUND_HALF_UP: 3, money.ROUND_HALF_DOWN: 2, money.ROUND_HALF_EVEN: 2, money.ROUND_DOWN: 2,
+                  money.ROUND_UP: 3, money.ROUND_FLOOR: 2, money.ROUND_CEILING: 3},
+            11:  {money.ROUND_HALF_UP: 3, money.ROUND_HALF_DOWN: 3, money.ROUND_HALF_EVEN: 3, money.ROUND_DOWN: 2,
+                  money.ROUND_UP: 3, money.ROUND_FLOOR: 2, money.ROUND_CEILING: 3},
+            14:  {money.ROUND_HALF_UP: 4, money.ROUND_HALF_DOWN: 3, money.ROUND_HALF_EVEN: 4, money.ROUND_DOWN: 3,
+                  money.ROUND_UP: 4, money.ROUND_FLOOR: 3, money.ROUND_CEILING: 4},
+            -10: {money.ROUND_HALF_UP: -3, money.ROUND_HALF_DOWN: -2, money.ROUND_HALF_EVEN: -2, money.ROUND_DOWN: -2,
+                  money.ROUND_UP: -3, money.ROUND_FLOOR: -3, money.ROUND_CEILING: -2},
+            -11: {money.ROUND_HALF_UP: -3, money.ROUND_HALF_DOWN: -3, money.ROUND_HALF_EVEN: -3, money.ROUND_DOWN: -2,
+                  money.ROUND_UP: -3, money.ROUND_FLOOR: -3, money.ROUND_CEILING: -2},
+        }
+        for numerator, expected in cases.items():
+            for rounding, quotient in expected.items():
+                self.assertEqual(money.divide(numerator, 4, rounding), quotient, (numerator, rounding))
+        for rounding in money.ROUNDING_MODES:
+            self.assertEqual(money.divide(12, 4, rounding), 3)
+        with self.assertRaises(ValueError):
+            money.divide(10, 4, 'ROUND_SIDEWAYS')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_divide_array(self):
+        numerators = numpy.arange(-1000, 1000, dtype=numpy.int64)
+        for denominator in (1, 4, 7, 400):
+            for rounding in money.ROUNDING_MODES:
+                expected = [money.divide(int(n), denominator, rounding) for n in numerators]
+                self.assertEqual(money.divide_array(numerators, denominator, rounding).tolist(), expected)
+
+    def test_tax_cents(self):
+        self.assertEqual(money.percent_fraction(9.25), fractions.Fraction(37, 400))
+        self.assertEqual(money.tax_cents(1549, 9.25), 143)  # 143.2825
+        self.assertEqual(money.tax_cents(200, 9.25, money.ROUND_HALF_UP), 19)  # 18.5
+        self.assertEqual(money.tax_cents(200, 9.25, money.ROUND_HALF_EVEN), 18)
+
+    def test_float_drift(self):
+        milk_tax = AdditionalTaxes('8873', 8.2, 'milk_tax')
+        get_price = lambda sku: 500
+        self.assertEqual(int(milk_tax.evaluate({'8873': 1}, get_price)), 40)
+        self.assertEqual(milk_tax.evaluate_cents({'8873': 1}, get_price, money.ROUND_DOWN), 41)
+        self.assertEqual(milk_tax.evaluate_cents({'8873': 3}, get_price, money.ROUND_HALF_EVEN), 123)
+        self.assertEqual(milk_tax.evaluate_cents({}, get_price), 0)
+
+    def test_get_total_cents(self):
+        self.setup()
+
+        self.assertEqual(self.s.get_total_cents({'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1}), 3037)
+        self.assertEqual(self.s.get_total_cents({}), 0)
+        plan = self.s.compile()
+        for basket in self.random_baskets(200):
+            self.assertEqual(plan.get_total_cents(basket), self.s.get_total_cents(basket))
+
+        self.teardown()
+
+    # the exact engine against the float engine on the default scheme's single tax line: truncating the tax
+    #   line reproduces the float totals, and rounding half up only differs where the exact tax has a
+    #   fractional part of at least half a cent
+    def test_differential(self):
+        self.setup()
+
+        rate = money.percent_fraction(9.25)
+        for basket in self.random_baskets(500):
+            float_total = self.s.get_total(basket)
+            self.assertEqual(self.s.get_total_cents(basket, money.ROUND_DOWN), float_total)
+            tax = 1549 * basket.get('0923', 0) * rate
+            bump = 1 if tax - int(tax) >= fractions.Fraction(1, 2) else 0
+            self.assertEqual(self.s.get_total_cents(basket, money.ROUND_HALF_UP), float_total + bump)
+
+        self.teardown()
+
+    # several tax lines with fractional rates: ROUND_DOWN truncates every line, so the exact total truncated
+    #   once is higher by the whole cents of the lines' fractional parts (at most lines - 1). the float engine
+    #   truncates once too, but may come out one cent lower where the exact total is a whole number of cents.
+    def test_differential_several_taxes(self):
+        prices = {'1983': 199, '4900': 349, '8873': 249, '6732': 249, '0923': 1549}
+        taxes = [AdditionalTaxes('0923', 9.25, 'wine'), AdditionalTaxes('4900', 7.125, 'salsa'),
+                 AdditionalTaxes('1983', 6.35, 'toothbrush'), AdditionalTaxes('8873', 0.1, 'milk')]
+        plan = pricing_plan.PricingPlan([Simple()] + taxes, prices)
+        rng = random.Random(5)
+        differences = 0
+        for i in range(2000):
+            basket = {sku: rng.randint(1, 40) for sku in rng.sample(sorted(prices), rng.randint(0, len(prices)))}
+            lines = [money.percent_fraction(tax.tax_rate_percent) * prices[tax.sku] * basket[tax.sku] for tax in taxes if tax.sku in basket]
+            exact = sum([prices[sku] * quantity for sku, quantity in basket.items()]) + sum(lines)
+            truncated = int(exact)
+            round_down = plan.get_total_cents(basket, money.ROUND_DOWN)
+            self.assertEqual(truncated - round_down, int(sum([line - int(line) for line in lines])))
+            self.assertLessEqual(truncated - round_down, max(len(lines) - 1, 0))
+            float_total = plan.get_total(basket)
+            if float_total != truncated:
+                self.assertEqual((float_total, exact), (truncated - 1, truncated))
+            differences += float_total != round_down
+        self.assertGreater(differences, 0)  # so ROUND_DOWN does not reproduce the float totals here
+
+    def test_get_totals_cents(self):
+        self.setup()
+
+        baskets = self.random_baskets(500)
+        for rounding in money.ROUNDING_MODES:
+            expected = [self.s.get_total_cents(basket, rounding) for basket in baskets]
+            self.assertEqual(self.s.get_totals_cents(baskets, rounding, chunk_size=64), expected)
+        self.assertEqual(self.s.get_totals_cents([]), [])
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import io
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestPipeline(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.s = scheme.Scheme.read_scheme('default')
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_read_scan_events(self):
+        lines = ['lane,basket,sku\n', '1,a,1983\n', '\n', '2, b ,4900\n']
+        self.assertEqual(list(pipeline.read_scan_events(lines)), [('1', 'a', '1983'), ('2', 'b', '4900')])
+        lines = ['{"lane": 1, "basket": "a", "sku": "1983"}\n', '\n']
+        self.assertEqual(list(pipeline.read_scan_events(lines, 'jsonl')), [('1', 'a', '1983')])
+        with self.assertRaises(ValueError):
+            list(pipeline.read_scan_events(['1,a\n']))
+        with self.assertRaises(ValueError):
+            list(pipeline.read_scan_events([], 'xml'))
+
+    def test_group_baskets(self):
+        events = [('1', 'a', '1983'), ('2', 'b', '4900'), ('1', 'a', '1983'), ('1', 'c', '8873'), ('2', 'b', '6732')]
+        baskets = list(pipeline.group_baskets(events))
+        self.assertEqual(baskets, [
+            ('1', 'a', {'1983': 2}),
+            ('1', 'c', {'8873': 1}),  # baskets still open at the end come out least recently scanned first
+            ('2', 'b', {'4900': 1, '6732': 1})
+        ])
+
+    def test_group_baskets_bounded(self):
+        events = [('1', 'a', '1983'), ('2', 'b', '4900'), ('3', 'c', '8873'), ('2', 'b', '4900')]
+        baskets = pipeline.group_baskets(iter(events), max_open_baskets=2)
+        self.assertEqual(next(baskets), ('1', 'a', {'1983': 1}))  # evicted as soon as lane 3 opens
+        self.assertEqual(list(baskets), [('3', 'c', {'8873': 1}), ('2', 'b', {'4900': 2})])
+
+    def test_run(self):
+        self.setup()
+
+        scans = ['1983', '4900', '8873', '6732', '0923', '1983', '1983', '1983']
+        lines = ['lane,basket,sku\n'] + ['7,1001,%s\n' % sku for sku in scans] + ['8,1002,8873\n']
+        output = io.StringIO()
+        count = pipeline.run(lines, self.s, output)
+        self.assertEqual(count, 2)
+        self.assertEqual(output.getvalue(), '7,1001,3037\n8,1002,249\n')
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -70,6 +70,43 @@ class TestBuyXGetYFreePricingCategory(TestPricingCategory):
 
         self.teardown()
 
+    # the original item by item implementation of the deal, kept as the reference behaviour
+    def reference_free_count(self, x, y, quantity):
+        progress = 0
+        free = 0
+        discount = 0
+        for i in range(quantity):
+            if progress < x and free < y:
+                progress += 1
+            elif progress == x and free < y:
+                free += 1
+                discount += 1
+            elif progress == x and free == y:
+                progress = 0
+                free = 0
+        return discount
+
+    def test_get_free_count(self):
+        pc = pricing_category.BuyXGetYFree('1983', 2, 1, 'buy2get1toothbrush')
+        # paid, paid, free, paid (cycle reset) | paid, paid, free, ...
+        self.assertEqual([pc.get_free_count(q) for q in range(9)], [0, 0, 0, 1, 1, 1, 1, 2, 2])
+        for x in range(5):
+            for y in range(5):
+                pc = pricing_category.BuyXGetYFree('1983', x, y, 'deal')
+                for quantity in range(60):
+                    self.assertEqual(pc.get_free_count(quantity), self.reference_free_count(x, y, quantity))
+
+    def test_get_free_count_bulk(self):
+        pc = pricing_category.BuyXGetYFree('1983', 3, 2, 'buy3get2')
+        self.assertEqual(pc.get_free_count(100000), self.reference_free_count(3, 2, 100000))
+
+    def test_get_free_counts(self):
+        pc = pricing_category.BuyXGetYFree('1983', 2, 1, 'buy2get1toothbrush')
+        quantities = list(range(50))
+        expected = [pc.get_free_count(q) for q in quantities]
+        self.assertEqual(list(pc.get_free_counts(quantities)), expected)
+        self.assertEqual(list(pc.get_subtotals(quantities, 199)), [-199 * free for free in expected])
+
     def test_read_pricing_category(self):
         self.setup()
 
@@ -247,6 +284,7 @@ class TestBundledPricingCategory(TestPricingCategory):
                 pcrefid = db.fetchone()[0]  # fetch the pcrefid from the pcref entry we just created
                 bundledargs = (pc.price, ','.join(pc.skus), pc.name, pcrefid)
                 db.execute('INSERT INTO pc_bundled(price, skus, name, pcrefid) VALUES (?, ?, ?, ?)', bundledargs)  # safe insertion of variables
+                Bundled.write_skus(db, pcrefid, pc.skus)  # bundles are read from bundle_skus
             except sqlite3.Error as err:
                 logging.getLogger('Bundled').error('Error occurred attempting to insert new Bundled entry into the database: %s' % str(err))
 
@@ -283,5 +321,43 @@ class TestBundledPricingCategory(TestPricingCategory):
 
         self.teardown()
 
+class TestMissingPricingCategory(TestPricingCategory):
+    def get_pricing_categories(self):
+        return [pricing_category.BuyXGetYFree('1983', 1, 1, 'toothbrush'),
+                pricing_category.AdditionalTaxes('1983', 10, 'toothbrush'),
+                pricing_category.Bundled(499, ['6732', '4900'], 'chips_and_salsa')]
+
+    def test_constructor(self):
+        pass
+
+    def test_get_subtotal(self):
+        pass
+
+    def test_read_missing_pricing_category(self):
+        self.setup()
+        for pc in self.get_pricing_categories():
+            pc.create_pricing_category()
+        for pc_class in pricing_category.PRICING_CATEGORY_TYPE_MAP.values():
+            self.assertIsNone(pc_class.read_pricing_category(1000))
+        self.teardown()
+
+    def test_create_without_pcref(self):
+        self.setup()
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("CREATE TRIGGER reject_pcrefs BEFORE INSERT ON pcrefs BEGIN SELECT RAISE(ABORT, 'no new pcrefs'); END")
+        connection.commit()
+        connection.close()
+        logging.disable(logging.ERROR)  # every insert logs its failure
+        try:
+            for pc in self.get_pricing_categories():
+                pc.create_pricing_category()
+        finally:
+            logging.disable(logging.NOTSET)
+        connection = sqlite3.connect(self.db_path)
+        for table in ['pc_buyxgety', 'pc_taxes', 'pc_bundled']:
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0], 0)
+        connection.close()
+        self.teardown()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
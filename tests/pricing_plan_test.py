@@ -0,0 +1,108 @@
+import unittest
+from src.supermarket import *
+from test_helpers import *
+
+# counts how many times it is evaluated, to check which categories a plan touches
+class CountingBundled(Bundled):
+    def __init__(self, price, skus, name):
+        Bundled.__init__(self, price, skus, name)
+        self.evaluations = 0
+
+    def evaluate(self, checkout_items, get_price):
+        self.evaluations += 1
+        return Bundled.evaluate(self, checkout_items, get_price)
+
+class TestPricingPlan(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.s = scheme.Scheme.read_scheme('default')
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_compile(self):
+        self.setup()
+
+        plan = self.s.compile()
+        self.assertEqual(len(plan.rules), 4)
+        self.assertEqual(plan.prices['0923'], 1549)
+        self.assertEqual(plan.always_rules, (0,))
+        self.assertEqual(plan.rules_by_sku['1983'], (1,))
+        self.assertEqual(plan.rules_by_sku['6732'], (3,))
+        self.assertEqual(plan.rules_by_sku['4900'], (3,))
+        self.assertNotIn('8873', plan.rules_by_sku)
+        with self.assertRaises(TypeError):
+            plan.prices['0923'] = 1  # plans are read only
+
+        self.teardown()
+
+    def test_compile_is_cached(self):
+        self.setup()
+
+        plan = self.s.compile()
+        self.assertIs(self.s.compile(), plan)
+        item.Item('5555', 'bread', 299).create_product()  # catalog changes invalidate the plan
+        new_plan = self.s.compile()
+        self.assertIsNot(new_plan, plan)
+        self.assertEqual(new_plan.prices['5555'], 299)
+        self.assertNotIn('5555', plan.prices)  # the old plan is left untouched
+
+        self.teardown()
+
+    def test_price_change_patches_plan(self):
+        self.setup()
+
+        plan = self.s.compile()
+        item.Item('1983', 'toothbrush', 99).update_product()
+        new_plan = self.s.compile()
+        self.assertIsNot(new_plan, plan)
+        self.assertIs(new_plan.rules_by_sku, plan.rules_by_sku)  # patched, not recompiled
+        self.assertEqual(new_plan.prices['1983'], 99)
+        self.assertEqual(plan.prices['1983'], 199)
+        self.assertEqual(new_plan.get_total({'1983': 3}), 198)
+
+        item.Item.delete_product('8873')
+        self.assertNotIn('8873', self.s.compile().prices)
+        with self.assertRaises(ValueError):
+            self.s.compile().get_total({'8873': 1})
+
+        self.teardown()
+
+    def test_get_total(self):
+        self.setup()
+
+        plan = self.s.compile()
+        baskets = [
+            {'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1},
+            {'1983': 5},
+            {'0923': 3, '8873': 2},
+            {'6732': 3, '4900': 2},
+            {}
+        ]
+        for basket in baskets:
+            self.assertEqual(plan.get_total(basket), self.s.get_total(basket))
+        self.assertEqual(plan.get_total(baskets[0]), 3037)
+        with self.assertRaises(ValueError):
+            plan.get_total({'0000': 1})
+
+        self.teardown()
+
+    def test_only_touched_rules_evaluated(self):
+        self.setup()
+
+        bundle = CountingBundled(499, ['6732', '4900'], 'chips_and_salsa')
+        plan = pricing_plan.PricingPlan([Simple(), bundle], self.s.compile().prices)
+        plan.get_total({'1983': 2, '8873': 1})
+        self.assertEqual(bundle.evaluations, 0)
+        self.assertEqual(plan.get_total({'6732': 1, '4900': 1}), 499)
+        self.assertEqual(bundle.evaluations, 1)
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
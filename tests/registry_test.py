@@ -0,0 +1,104 @@
+import unittest
+import sqlite3
+import time
+from src.supermarket import *
+from test_helpers import *
+
+ITEMS = {'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1}
+
+
+class TestRegistry(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.registry = registry.SchemeRegistry(self.database_path, poll_interval=0.01)
+
+    def teardown(self):
+        self.registry.stop()
+        kill_database(self.database_path)
+
+    def scan(self, scheme_snapshot, items):
+        c = checkout.Checkout(scheme_snapshot)
+        for sku, quantity in items.items():
+            for i in range(quantity):
+                c.scan(sku)
+        return c
+
+    def test_get_scheme(self):
+        self.setup()
+        default = self.registry.get_scheme('default')
+        self.assertIsInstance(default, scheme.SchemeSnapshot)
+        self.assertIs(self.registry.get_scheme('default'), default)
+        self.assertEqual(default.get_total(ITEMS), 3037)
+        self.assertEqual(self.registry.get_scheme_names(), ['default'])
+        with self.assertRaises(ValueError):
+            self.registry.get_scheme('missing')
+        self.assertFalse(self.registry.refresh())  # nothing changed
+        self.teardown()
+
+    def test_reload_promotions(self):
+        self.setup()
+        old = self.registry.get_scheme('default')
+        in_flight = self.scan(old, ITEMS)
+        AdditionalTaxes('1983', 10, 'toothbrush').create_pricing_category()
+        with database.Database() as db:
+            set_scheme_pcrefids(db, 'default', [1, 2, 3, 4])
+        self.assertTrue(self.registry.refresh())
+        new = self.registry.get_scheme('default')
+        self.assertIsNot(new, old)
+        self.assertEqual(len(new.price_adjustments), 5)
+        self.assertEqual(in_flight.getTotal(), 3037)  # the basket in progress keeps its snapshot
+        self.assertEqual(self.scan(new, ITEMS).getTotal(), int(3037 + 199 * 4 * 0.1))
+        self.assertFalse(self.registry.refresh())
+        self.teardown()
+
+    def test_reload_external_write(self):
+        self.setup()
+        old = self.registry.get_scheme('default')
+        # another process removes the bundle from the scheme
+        connection = sqlite3.connect(self.database_path)
+        set_scheme_pcrefids(connection.cursor(), 'default', [1, 2])
+        connection.commit()
+        connection.close()
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(len(self.registry.get_scheme('default').price_adjustments), 3)
+        self.assertEqual(len(old.price_adjustments), 4)
+        self.teardown()
+
+    def test_reload_prices(self):
+        self.setup()
+        old = self.registry.get_scheme('default')
+        item.Item('8873', 'milk', 299).update_product()
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(self.registry.get_scheme('default').get_total({'8873': 1}), 299)
+        self.assertEqual(old.get_total({'8873': 1}), 249)
+        self.teardown()
+
+    def test_failed_reload_keeps_snapshot(self):
+        self.setup()
+        old = self.registry.get_scheme('default')
+        with database.Database() as db:
+            db.execute("DELETE FROM schemes WHERE name='default'")
+        self.assertTrue(self.registry.refresh())
+        self.assertIs(self.registry.get_scheme('default'), old)
+        self.teardown()
+
+    def test_background_reload(self):
+        self.setup()
+        with self.registry:
+            old = self.registry.get_scheme('default')
+            with database.Database() as db:
+                set_scheme_pcrefids(db, 'default', [1, 2])
+            deadline = time.time() + 5
+            while self.registry.get_scheme('default') is old and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(self.registry.get_scheme('default').price_adjustments), 3)
+        self.assertIsNone(self.registry.thread)
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import io
+import os
+import json
+import random
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestRepricing(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        self.baskets_path = 'example_baskets.jsonl'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.s = scheme.Scheme.read_scheme('default')
+
+        rng = random.Random(4900)
+        skus = ['1983', '4900', '8873', '6732', '0923']
+        self.baskets = []
+        for i in range(200):
+            self.baskets.append({sku: rng.randint(1, 12) for sku in rng.sample(skus, rng.randint(1, len(skus)))})
+
+    def teardown(self):
+        kill_database(self.database_path)
+        if os.path.isfile(self.baskets_path):
+            os.remove(self.baskets_path)
+
+    def test_chunked(self):
+        self.assertEqual(list(repricing.chunked(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(repricing.chunked([], 3)), [])
+
+    def test_reprice(self):
+        self.setup()
+
+        engine = repricing.RepricingEngine('default', self.database_path, max_workers=2, chunk_size=9)
+        totals = list(engine.reprice(self.baskets))
+        self.assertEqual(totals, [self.s.get_total(basket) for basket in self.baskets])
+
+        self.teardown()
+
+    def test_reprice_file(self):
+        self.setup()
+
+        with open(self.baskets_path, 'w', encoding='utf-8') as baskets_file:
+            for basket in self.baskets:
+                baskets_file.write(json.dumps(basket) + '\n')
+            baskets_file.write('\n')
+        output = io.StringIO()
+        engine = repricing.RepricingEngine('default', self.database_path, max_workers=2, chunk_size=50)
+        count = engine.reprice_file(self.baskets_path, output)
+        self.assertEqual(count, len(self.baskets))
+        self.assertEqual([int(line) for line in output.getvalue().split()],
+                         [self.s.get_total(basket) for basket in self.baskets])
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import os
+import time
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestScanLog(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        self.log_path = 'example.scanlog'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+        self.remove_log()
+
+    def teardown(self):
+        kill_database(self.database_path)
+        self.remove_log()
+
+    def remove_log(self):
+        for path in (self.log_path, self.log_path + '.tmp'):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def query(self, sql):
+        with database.Database(read_only=True) as db:
+            db.execute(sql)
+            return db.fetchall()
+
+    def test_group_commit(self):
+        self.setup()
+        log = scan_log.ScanLog(self.log_path, flush_interval=60, flush_size=5, fsync=False)
+        c = checkout.Checkout(scheme.Scheme.read_scheme('default'), scan_log=log, lane='1')
+        for sku in ['1983', '4900', '8873', '6732']:
+            c.scan(sku)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM scan_log'), [(0,)])  # held in the log file only
+        self.assertEqual(len(open(self.log_path).readlines()), 4)
+        c.unscan('8873')  # the fifth record fills a batch
+        deadline = time.time() + 5
+        while self.query('SELECT COUNT(*) FROM scan_log') != [(5,)] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM scan_log'), [(5,)])
+        self.assertEqual(c.close(), 199 + 349 + 249 - 99)
+        log.close()
+        self.assertEqual(self.query('SELECT op, sku, total FROM scan_log ORDER BY seq'),
+                         [('scan', '1983', None), ('scan', '4900', None), ('scan', '8873', None), ('scan', '6732', None),
+                          ('unscan', '8873', None), ('close', None, 698)])
+        self.assertEqual(self.query('SELECT DISTINCT lane, basket FROM scan_log'), [('1', c.basket_id)])
+        self.assertEqual(os.path.getsize(self.log_path), 0)
+        self.teardown()
+
+    def test_recovery(self):
+        self.setup()
+        # a previous run acknowledged three scans and crashed while writing a fourth; the first scan
+        #   had already been committed
+        records = [(seq, '2', 'b1', 'scan', '1983', None, 1.0) for seq in (1, 2, 3)]
+        with open(self.log_path, 'w') as log_file:
+            log_file.write(''.join(['%r\n' % (record,) for record in records]) + "(4, '2', 'b1', 'sc")
+        with database.Database() as db:
+            db.execute('INSERT INTO scan_log(writer, seq, lane, basket, op, sku, total, logged_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       ('server-1',) + records[0])
+        with scan_log.ScanLog(self.log_path, fsync=False, writer='server-1') as log:
+            self.assertEqual(self.query('SELECT seq FROM scan_log ORDER BY seq'), [(1,), (2,), (3,)])
+            self.assertEqual(os.path.getsize(self.log_path), 0)
+            self.assertEqual(log.append('2', 'b1', 'scan', '4900'), 4)
+            open_baskets = log.read_open_baskets()
+        self.assertEqual(open_baskets, {'2': ('b1', [('scan', '1983')] * 3 + [('scan', '4900')])})
+
+        c = checkout.Checkout(scheme.Scheme.read_scheme('default'), basket_id='b1')
+        c.replay(open_baskets['2'][1])
+        self.assertEqual(c.getTotal(), 199 * 2 + 349)  # buy two get one free
+        self.teardown()
+
+    def test_two_writers(self):
+        self.setup()
+        other_path = self.log_path + '.other'
+        first = scan_log.ScanLog(self.log_path, flush_interval=60, fsync=False)
+        second = scan_log.ScanLog(other_path, flush_interval=60, fsync=False)
+        try:
+            self.assertNotEqual(first.writer, second.writer)
+            for i in range(5):
+                self.assertEqual(first.append('1', 'b1', 'scan', '1983'), i + 1)
+                self.assertEqual(second.append('2', 'b2', 'scan', '4900'), i + 1)
+            first.close()
+            second.close()
+            self.assertEqual(self.query('SELECT lane, COUNT(*) FROM scan_log GROUP BY lane ORDER BY lane'), [('1', 5), ('2', 5)])
+
+            # each log recovers and restores only its own lanes
+            with scan_log.ScanLog(other_path, fsync=False) as log:
+                self.assertEqual(log.append('2', 'b2', 'scan', '4900'), 6)
+                self.assertEqual(log.read_open_baskets(), {'2': ('b2', [('scan', '4900')] * 6)})
+        finally:
+            if os.path.isfile(other_path):
+                os.remove(other_path)
+        self.teardown()
+
+    def test_failed_flush_keeps_records(self):
+        self.setup()
+        log = scan_log.ScanLog(self.log_path, flush_interval=60, fsync=False)
+        log.append('1', 'b1', 'scan', '1983')
+        with database.Database() as db:
+            db.execute('ALTER TABLE scan_log RENAME TO scan_log_moved')
+        self.assertEqual(log.flush(), 0)
+        self.assertEqual(len(log.pending), 1)
+        self.assertEqual(len(open(self.log_path).readlines()), 1)
+        with database.Database() as db:
+            db.execute('ALTER TABLE scan_log_moved RENAME TO scan_log')
+        log.close()
+        self.assertEqual(self.query('SELECT COUNT(*) FROM scan_log'), [(1,)])
+        with self.assertRaises(ValueError):
+            log.append('1', 'b1', 'scan', '1983')
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,10 @@ class TestScheme(unittest.TestCase):
         test_scheme = scheme.Scheme('default', [1, 2, 3])
         self.assertEqual(test_scheme.name, 'default')
         self.assertEqual(test_scheme.pricing_category_refids, [1, 2, 3])
+        # schemes built without refids don't share one list
+        first = scheme.Scheme('first')
+        first.pricing_category_refids.append(1)
+        self.assertEqual(scheme.Scheme('second').pricing_category_refids, [])
 
     def test_read_scheme(self):
         self.setup()
@@ -27,6 +31,7 @@ class TestScheme(unittest.TestCase):
             try:
                 scheme_args = (test_scheme.name, ','.join([str(id) for id in test_scheme.pricing_category_refids]))
                 db.execute('INSERT INTO schemes(name, pcrefids) VALUES(?, ?)', scheme_args)
+                scheme.Scheme.write_pcrefids(db, db.lastrowid, test_scheme.pricing_category_refids)
             except sqlite3.Error as err:
                 logging.getLogger('TestScheme').error('Error occurred attempting to write a new Scheme to the database: %s' % str(err))
         scheme_result = scheme.Scheme.read_scheme(test_scheme.name)
@@ -74,5 +79,125 @@ class TestScheme(unittest.TestCase):
         total = test_scheme.get_total(checkout_items)
         self.assertEqual(total, 3037)
 
+    def test_read_scheme_query_count(self):
+        self.setup()
+        populate_products(self.database_path)
+        for i in range(50):
+            BuyXGetYFree('1983', 2, 1, 'buy2get1toothbrush_%d' % i).create_pricing_category()
+        scheme.Scheme('big', list(range(1, 51))).create_scheme()
+        scheme.Scheme.clear_cache()
+
+        statements = []
+        connection = database.Database.get_connection(self.database_path)
+        connection.set_trace_callback(statements.append)
+        try:
+            big_scheme = scheme.Scheme.read_scheme('big')
+        finally:
+            connection.set_trace_callback(None)
+        self.assertEqual(len(big_scheme.price_adjustments), 51)
+        # the definitions version, the scheme and one query per pricing category type
+        self.assertEqual(len([statement for statement in statements if statement.startswith('SELECT')]), 5)
+
+        self.teardown()
+
+    def test_rule_index(self):
+        self.setup()
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        for i in range(20):
+            BuyXGetYFree('1983', 2, 1, 'buy2get1toothbrush_%d' % i).create_pricing_category()
+        Bundled(599, ['8873', '8873', '6732'], 'milk_and_chips').create_pricing_category()
+        scheme.Scheme('indexed', list(range(1, 25))).create_scheme()
+
+        test_scheme = scheme.Scheme.read_scheme('indexed')
+        index = test_scheme.rule_index
+        self.assertEqual(index.always_rules, [0])
+        self.assertEqual(index.rules_by_sku['1983'], [1] + list(range(4, 24)))
+        self.assertEqual(index.rules_by_sku['8873'], [24])
+        self.assertEqual(index.rules_by_sku['6732'], [3, 24])
+        self.assertEqual(index.get_rule_indices(['0923', '4900']), [0, 2, 3])
+
+        get_price = get_catalog().get_price
+        for items in [{'1983': 7, '0923': 1}, {'8873': 2, '6732': 3, '4900': 1}, {'0923': 2}, {}]:
+            expected = int(sum([pa.get_subtotal(items, get_price) for pa in test_scheme.price_adjustments]))
+            self.assertEqual(test_scheme.get_total(items), expected)
+            expected = sum([pa.evaluate_cents(items, get_price) for pa in test_scheme.price_adjustments])
+            self.assertEqual(test_scheme.get_total_cents(items), expected)
+
+        self.teardown()
+
+    def test_read_scheme_cache(self):
+        self.setup()
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+
+        first = scheme.Scheme.read_scheme('default')
+        self.assertIs(scheme.Scheme.read_scheme('default'), first)
+        AdditionalTaxes('1983', 5, 'toothbrush').create_pricing_category()  # definitions changed
+        second = scheme.Scheme.read_scheme('default')
+        self.assertIsNot(second, first)
+
+        # so are definitions written with plain SQL, e.g. by another process
+        connection = sqlite3.connect(self.database_path)
+        connection.execute("UPDATE pc_taxes SET tax_rate = 10 WHERE name = 'wine'")
+        connection.commit()
+        connection.close()
+        third = scheme.Scheme.read_scheme('default')
+        self.assertIsNot(third, second)
+        self.assertEqual([pa.tax_rate_percent for pa in third.price_adjustments if isinstance(pa, AdditionalTaxes)], [10])
+        self.assertIs(scheme.Scheme.read_scheme('default'), third)
+
+        self.teardown()
+
+    def test_load_deduplicates(self):
+        self.setup()
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+
+        test_scheme = scheme.Scheme('duplicates', [1, 2, 3, 1, 3])
+        test_scheme.load_pricing_categories()
+        self.assertEqual(len(test_scheme.price_adjustments), 4)
+        self.assertEqual(test_scheme.adjustments_version, 3)
+
+        self.teardown()
+
+    def test_load_missing_pricing_category(self):
+        self.setup()
+        populate_pricing_categories(self.database_path)
+
+        test_scheme = scheme.Scheme('missing', [1, 99])
+        with self.assertRaises(ValueError):
+            test_scheme.load_pricing_categories()
+
+        self.teardown()
+
+    def test_snapshot(self):
+        self.setup()
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+
+        test_scheme = scheme.Scheme.read_scheme('default')
+        snapshot = test_scheme.snapshot()
+        basket = {'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1}
+        self.assertEqual(snapshot.get_total(basket), 3037)
+        self.assertEqual(snapshot.get_totals([basket, {}]), [3037, 0])
+        self.assertEqual(snapshot.pricing_category_refids, (1, 2, 3))
+        self.assertTrue(snapshot.has_product('1983'))
+        self.assertFalse(snapshot.has_product('5555'))
+        with self.assertRaises(AttributeError):
+            snapshot.plan = None
+        with self.assertRaises(AttributeError):
+            snapshot.name = 'other'
+
+        # later price changes reach the scheme but not the snapshot
+        item.Item('8873', 'milk', 1249).update_product()
+        self.assertEqual(test_scheme.get_total(basket), 4037)
+        self.assertEqual(snapshot.get_total(basket), 3037)
+        self.assertEqual(test_scheme.snapshot().get_total(basket), 4037)
+
+        self.teardown()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import unittest
+import asyncio
+import json
+import os
+from src.supermarket import *
+from test_helpers import *
+
+BASKET = ['1983', '4900', '8873', '6732', '0923', '1983', '1983', '1983']
+
+
+class TestService(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_async_checkout(self):
+        self.setup()
+
+        async def run():
+            c = service.AsyncCheckout(scheme.Scheme.read_scheme('default'))
+            for sku in BASKET:
+                await c.scan(sku)
+            self.assertEqual(await c.getTotal(), 3037)
+            await c.unscan('1983')
+            self.assertEqual(c.get_items()['1983'], 3)
+            with self.assertRaises(ValueError):
+                await c.scan('0000')
+            return await c.getTotal()
+
+        self.assertEqual(asyncio.run(run()), 3037 - 199)
+
+        self.teardown()
+
+    def test_server(self):
+        self.setup()
+
+        async def request(reader, writer, message):
+            writer.write((json.dumps(message) + '\n').encode('utf-8'))
+            await writer.drain()
+            return json.loads(await reader.readline())
+
+        async def lane(address, lane_id):
+            reader, writer = await asyncio.open_connection(*address)
+            for number, sku in enumerate(BASKET):
+                response = await request(reader, writer, {'id': number, 'op': 'scan', 'lane': lane_id, 'sku': sku})
+                self.assertEqual(response, {'id': number, 'ok': True})
+            running = await request(reader, writer, {'op': 'total', 'lane': lane_id})
+            final = await request(reader, writer, {'op': 'close', 'lane': lane_id})
+            writer.close()
+            await writer.wait_closed()
+            return running['total'], final['total']
+
+        async def run():
+            server = service.CheckoutServer('default', self.database_path, max_workers=2)
+            await server.start()
+            address = server.get_address()
+            try:
+                totals = await asyncio.gather(*[lane(address, str(i)) for i in range(50)])
+                self.assertEqual(server.sessions, {})  # every lane closed its basket
+
+                reader, writer = await asyncio.open_connection(*address)
+                self.assertEqual(await request(reader, writer, {'id': 'a', 'op': 'ping'}), {'id': 'a', 'ok': True})
+                error = await request(reader, writer, {'op': 'scan', 'lane': '1', 'sku': '0000'})
+                self.assertFalse(error['ok'])
+                self.assertIn('0000', error['error'])
+                self.assertFalse((await request(reader, writer, {'op': 'fly', 'lane': '1'}))['ok'])
+                self.assertFalse((await request(reader, writer, {'op': 'total'}))['ok'])
+                writer.write(b'not json\n')
+                self.assertFalse(json.loads(await reader.readline())['ok'])
+                writer.close()
+                await writer.wait_closed()
+            finally:
+                await server.close()
+            return totals
+
+        self.assertEqual(asyncio.run(run()), [(3037, 3037)] * 50)
+
+        self.teardown()
+
+    def test_max_lanes(self):
+        self.setup()
+
+        async def run():
+            server = service.CheckoutServer('default', self.database_path, max_workers=1, max_lanes=2)
+            await server.start()
+            try:
+                await server.handle_request({'op': 'scan', 'lane': '1', 'sku': '1983'})
+                await server.handle_request({'op': 'scan', 'lane': '2', 'sku': '1983'})
+                with self.assertRaises(ValueError):
+                    await server.handle_request({'op': 'scan', 'lane': '3', 'sku': '1983'})
+                self.assertEqual(await server.handle_request({'op': 'close', 'lane': '1'}), {'total': 199})
+                await server.handle_request({'op': 'scan', 'lane': '3', 'sku': '1983'})
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+
+        self.teardown()
+
+    def test_hot_reload(self):
+        self.setup()
+
+        async def run():
+            server = service.CheckoutServer('default', self.database_path, max_workers=1, reload_interval=0.01)
+            await server.start()
+            try:
+                await server.handle_request({'op': 'scan', 'lane': '1', 'sku': '6732'})
+                await server.handle_request({'op': 'scan', 'lane': '1', 'sku': '4900'})
+                with database.Database(self.database_path) as db:
+                    set_scheme_pcrefids(db, 'default', [1, 2])  # drop the chips and salsa bundle
+                old = server.registry.get_scheme('default')
+                for i in range(500):
+                    if server.registry.get_scheme('default') is not old:
+                        break
+                    await asyncio.sleep(0.01)
+                await server.handle_request({'op': 'scan', 'lane': '2', 'sku': '6732'})
+                await server.handle_request({'op': 'scan', 'lane': '2', 'sku': '4900'})
+                # the open basket keeps the bundle, the basket opened after the reload does not
+                self.assertEqual(await server.handle_request({'op': 'close', 'lane': '1'}), {'total': 499})
+                self.assertEqual(await server.handle_request({'op': 'close', 'lane': '2'}), {'total': 598})
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+
+        self.teardown()
+
+    def test_restart_restores_lanes(self):
+        self.setup()
+        log_path = 'example.scanlog'
+
+        async def run(requests):
+            server = service.CheckoutServer('default', self.database_path, max_workers=1, scan_log_path=log_path)
+            await server.start()
+            try:
+                return [await server.handle_request(request) for request in requests]
+            finally:
+                await server.close()
+
+        asyncio.run(run([{'op': 'scan', 'lane': '1', 'sku': sku} for sku in BASKET] + [{'op': 'unscan', 'lane': '1', 'sku': '1983'}]))
+        # the basket left open on lane 1 is picked up by the next server
+        self.assertEqual(asyncio.run(run([{'op': 'close', 'lane': '1'}, {'op': 'close', 'lane': '1'}])), [{'total': 3037 - 199}, {'total': 0}])
+        os.remove(log_path)
+
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestSnapshot(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        self.snapshot_path = 'example.snapshot'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+        database.Database.database_path = self.database_path
+        if os.path.isfile(self.snapshot_path):
+            os.remove(self.snapshot_path)
+
+    def test_prices(self):
+        self.setup()
+        self.assertEqual(snapshot.export_snapshot(self.snapshot_path), 5)
+        expected = get_catalog(self.database_path).snapshot_prices()[1]
+        with snapshot.CatalogSnapshot(self.snapshot_path) as s:
+            self.assertEqual(len(s.prices), 5)
+            self.assertEqual(dict(s.prices.items()), expected)
+            self.assertEqual(sorted(s.prices), sorted(expected))
+            self.assertEqual(s.get_price('1983'), expected['1983'])
+            self.assertTrue(s.has_product('0923'))
+            self.assertFalse(s.has_product('0000'))
+            self.assertFalse(s.has_product('19830'))
+            with self.assertRaises(ValueError):
+                s.get_price('0000')
+            self.assertEqual(s.get_scheme_names(), ['default'])
+            with self.assertRaises(ValueError):
+                s.get_scheme('missing')
+        self.teardown()
+
+    def test_checkout_without_database(self):
+        self.setup()
+        items = {'1983': 4, '4900': 3, '8873': 2, '6732': 1, '0923': 2}
+        expected = scheme.Scheme.read_scheme('default').get_total(items)
+        snapshot.export_snapshot(self.snapshot_path, ['default'])
+        # the terminal has no database at all
+        kill_database(self.database_path)
+        database.Database.database_path = None
+        with snapshot.CatalogSnapshot(self.snapshot_path) as s:
+            mapped_scheme = s.get_scheme('default')
+            self.assertIs(s.get_scheme('default'), mapped_scheme)
+            self.assertEqual(mapped_scheme.get_total(items), expected)
+            c = checkout.Checkout(mapped_scheme)
+            for sku, quantity in items.items():
+                for i in range(quantity):
+                    c.scan(sku)
+            self.assertEqual(c.getTotal(), expected)
+            with self.assertRaises(ValueError):
+                c.scan('0000')
+        self.assertFalse(os.path.isfile(self.database_path))
+        self.teardown()
+
+    def test_replace_while_open(self):
+        self.setup()
+        snapshot.export_snapshot(self.snapshot_path)
+        with snapshot.CatalogSnapshot(self.snapshot_path) as old:
+            price = old.get_price('1983')
+            item.Item('1983', 'toothbrush', price + 100).update_product()
+            snapshot.export_snapshot(self.snapshot_path)
+            with snapshot.CatalogSnapshot(self.snapshot_path) as new:
+                self.assertEqual(new.get_price('1983'), price + 100)
+            # the old mapping still reads the snapshot it was opened with
+            self.assertEqual(old.prices.get_price_at(old.prices.find('1983')), price)
+        self.teardown()
+
+    def test_invalid_file(self):
+        self.setup()
+        with open(self.snapshot_path, 'wb') as snapshot_file:
+            snapshot_file.write(b'not a snapshot' * 10)
+        with self.assertRaises(ValueError):
+            snapshot.CatalogSnapshot(self.snapshot_path)
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()
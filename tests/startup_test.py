@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+import subprocess
+from src.supermarket import *
+from test_helpers import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules a lane terminal pricing baskets must not load at startup
+LAZY_MODULES = ['logging', 'argparse', 'csv', 'fractions', 'asyncio', 'numpy', 'concurrent.futures']
+
+
+class TestStartup(unittest.TestCase):
+    # runs a script in a fresh interpreter and returns the names of the modules it loaded
+    def get_loaded_modules(self, script):
+        script = 'import sys\nsys.path.insert(0, %r)\n%s\nprint(" ".join(sorted(sys.modules)))\n' % (ROOT, script)
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        return set(result.stdout.split())
+
+    def test_package_imports_no_submodules(self):
+        loaded = self.get_loaded_modules('import src.supermarket as supermarket\nsupermarket.money.divide(1, 2)')
+        self.assertIn('src.supermarket.money', loaded)
+        self.assertNotIn('src.supermarket.scheme', loaded)
+        with self.assertRaises(AttributeError):
+            import src.supermarket
+            src.supermarket.missing
+
+    def test_lane_imports(self):
+        loaded = self.get_loaded_modules('from src.supermarket.checkout import Checkout\n'
+                                         'from src.supermarket.scheme import Scheme\n'
+                                         'from src.supermarket import snapshot')
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, loaded)
+        loaded = self.get_loaded_modules('from src.supermarket import service')
+        for module in ['argparse', 'json']:
+            self.assertNotIn(module, loaded)
+
+    def test_tool_imports(self):
+        loaded = self.get_loaded_modules('from src.supermarket import pipeline, repricing')
+        for module in ['argparse', 'csv', 'json', 'concurrent.futures', 'multiprocessing']:
+            self.assertNotIn(module, loaded)
+
+    def test_lazy_logger(self):
+        logger = log.get_logger('TestStartup')
+        self.assertIs(log.get_logger('TestStartup'), logger)
+        with self.assertLogs('TestStartup', level='ERROR') as logs:
+            logger.error('lazy %s', 'logger')
+        self.assertEqual(logs.output, ['ERROR:TestStartup:lazy logger'])
+
+if __name__ == '__main__':
+    unittest.main()
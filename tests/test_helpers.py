@@ -7,10 +7,15 @@ from src.supermarket.item import Item
 from src.supermarket.database import Database
 from src.supermarket.pricing_category import *
 from src.supermarket.scheme import Scheme
+from src.supermarket.catalog import get_catalog
 
 def kill_database(database_path):
-    if (os.path.isfile(database_path)):
-        os.remove(database_path)
+    get_catalog(database_path).invalidate()  # cached products and schemes belong to the database being removed
+    Scheme.clear_cache()
+    Database.close_connections(database_path)
+    for path in (database_path, database_path + '-wal', database_path + '-shm'):
+        if (os.path.isfile(path)):
+            os.remove(path)
 
 def init_empty_database(database_path):
     kill_database(database_path)
@@ -47,6 +52,13 @@ def populate_pricing_categories(database_path):
     bundled_chips_and_salsa = Bundled(499, ['6732', '4900'], 'chips_and_salsa')
     bundled_chips_and_salsa.create_pricing_category()
 
+# points a scheme at a new list of pcrefids, as an edit by another tool would: the legacy comma joined
+#   column and the scheme_pcrefs rows, through any sqlite3 cursor
+def set_scheme_pcrefids(cursor, name, pcrefids):
+    cursor.execute('UPDATE schemes SET pcrefids=(?) WHERE name=(?)', (','.join([str(id) for id in pcrefids]), name))
+    cursor.execute('SELECT Id FROM schemes WHERE name=(?)', (name,))
+    Scheme.write_pcrefids(cursor, cursor.fetchone()[0], pcrefids)
+
 # assignment assumes populate_pricing_categories was run first
 def populate_schemes(database_path):
     Database.database_path = database_path
@@ -0,0 +1,114 @@
+import unittest
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestThreading(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def random_scans(self, count, seed):
+        rng = random.Random(seed)
+        skus = ['1983', '4900', '8873', '6732', '0923']
+        return [[rng.choice(skus) for i in range(rng.randint(1, 30))] for j in range(count)]
+
+    def count(self, scans):
+        items = {}
+        for sku in scans:
+            items[sku] = items.get(sku, 0) + 1
+        return items
+
+    def scan_all(self, shared_scheme, baskets, start = None):
+        if start is not None:
+            start.wait()
+        totals = []
+        for scans in baskets:
+            c = checkout.Checkout(shared_scheme)
+            for sku in scans:
+                c.scan(sku)
+            totals.append(c.getTotal())
+        return totals
+
+    # many threads pricing on one shared snapshot must give exactly the single threaded totals
+    def test_stress_snapshot(self):
+        self.setup()
+
+        snapshot = scheme.Scheme.read_scheme('default').snapshot()
+        prices = dict(snapshot.plan.prices)
+        work = [self.random_scans(200, seed) for seed in range(8)]
+        expected = [[snapshot.get_total(self.count(scans)) for scans in baskets] for baskets in work]
+        for threads in (1, 2, 4, 8):
+            start = threading.Barrier(threads)
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = [executor.submit(self.scan_all, snapshot, work[i], start) for i in range(threads)]
+                results = [future.result() for future in futures]
+            self.assertEqual(results, expected[:threads])
+        self.assertEqual(dict(snapshot.plan.prices), prices)  # nothing wrote to the shared snapshot
+
+        self.teardown()
+
+    # a shared Scheme stays correct while its prices change under the running checkouts
+    def test_stress_shared_scheme(self):
+        self.setup()
+
+        shared = scheme.Scheme.read_scheme('default')
+        old_prices = shared.snapshot()
+        work = [self.random_scans(100, seed) for seed in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(self.scan_all, shared, baskets) for baskets in work]
+            item.Item('8873', 'milk', 299).update_product()
+            results = [future.result() for future in futures]
+        new_prices = shared.snapshot()
+        # every basket is priced entirely at the old milk price or entirely at the new one
+        for baskets, totals in zip(work, results):
+            for scans, total in zip(baskets, totals):
+                items = self.count(scans)
+                self.assertIn(total, (old_prices.get_total(items), new_prices.get_total(items)))
+        basket = {'1983': 4, '4900': 1, '8873': 1, '6732': 1, '0923': 1}
+        self.assertEqual(self.scan_all(shared, [['1983'] * 4 + ['4900', '8873', '6732', '0923']]), [3087])
+        self.assertEqual(shared.get_total(basket), 3087)
+
+        self.teardown()
+
+    # threads pricing against different databases at once, each chosen with Database.use
+    def test_context_databases(self):
+        self.setup()
+        other_path = 'example_other.db'
+        init_empty_database(other_path)
+        with database.Database.use(other_path):
+            populate_products(other_path)
+            populate_pricing_categories(other_path)
+            populate_schemes(other_path)
+        database.Database.database_path = self.database_path
+        with database.Database.use(other_path):
+            item.Item('0923', 'wine', 2549).update_product()
+
+        def price(path):
+            with database.Database.use(path):
+                s = scheme.Scheme.read_scheme('default')
+                return [self.scan_all(s, [['1983'] * 4 + ['4900', '8873', '6732', '0923']])[0] for i in range(50)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(price, path) for path in [self.database_path, other_path] * 2]
+            results = [future.result() for future in futures]
+        # 9.25% tax on wine that is 1000 cents dearer in the other database
+        self.assertEqual(results, [[3037] * 50, [4129] * 50] * 2)
+        self.assertEqual(catalog.get_catalog(self.database_path).get_price('0923'), 1549)
+        self.assertEqual(catalog.get_catalog(other_path).get_price('0923'), 2549)
+
+        kill_database(other_path)
+        self.teardown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from src.supermarket import *
+from test_helpers import *
+
+
+class TestTotalCache(unittest.TestCase):
+    def setup(self):
+        self.database_path = 'example.db'
+        init_empty_database(self.database_path)
+        populate_products(self.database_path)
+        populate_pricing_categories(self.database_path)
+        populate_schemes(self.database_path)
+        database.Database.database_path = self.database_path
+
+    def teardown(self):
+        kill_database(self.database_path)
+
+    def test_signature(self):
+        first = total_cache.get_signature({'1983': 2, '4900': 1, '8873': 0})
+        self.assertEqual(first, total_cache.get_signature({'4900': 1, '1983': 2}))
+        self.assertNotEqual(first, total_cache.get_signature({'4900': 1, '1983': 3}))
+        self.assertEqual(total_cache.get_signature({}), frozenset())
+        self.assertEqual(total_cache.get_signature(basket.Basket([('4900', 1), ('1983', 2)])),
+                         total_cache.get_signature(basket.Basket([('1983', 2), ('4900', 1)])))
+
+    def test_lru(self):
+        cache = total_cache.TotalCache(2, 'lru')
+        cache.put('a', 1, 100)
+        cache.put('b', 1, 200)
+        self.assertEqual(cache.get('a', 1), 100)  # 'b' is now the least recently used
+        cache.put('c', 1, 300)
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), 100)
+        self.assertEqual(cache.get('c', 1), 300)
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (3, 1, 1, 2))
+        self.assertEqual(stats['hit_rate'], 0.75)
+
+    def test_lfu(self):
+        cache = total_cache.TotalCache(2, 'lfu')
+        cache.put('a', 1, 100)
+        for i in range(3):
+            cache.get('a', 1)
+        cache.put('b', 1, 200)
+        cache.put('c', 1, 300)  # evicts 'b', used less often than 'a'
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), 100)
+        cache.get('c', 1)
+        cache.put('d', 1, 400)  # 'c' was used twice, 'a' five times
+        self.assertIsNone(cache.get('c', 1))
+        self.assertEqual(cache.get('d', 1), 400)
+        self.assertEqual(cache.get_stats()['evictions'], 2)
+
+        with self.assertRaises(ValueError):
+            total_cache.TotalCache(10, 'fifo')
+
+    def test_version_change_empties_cache(self):
+        cache = total_cache.TotalCache(10)
+        cache.put('a', 1, 100)
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get_stats()['invalidations'], 1)
+
+    def test_scheme_total_cache(self):
+        self.setup()
+        test_scheme = scheme.Scheme.load_scheme('default')
+        items = {'1983': 3, '4900': 1, '6732': 1, '0923': 1}
+        expected = test_scheme.get_total(items)
+        cache = test_scheme.use_total_cache(100, 'lfu')
+        self.assertEqual(test_scheme.get_total(items), expected)
+        self.assertEqual(test_scheme.get_total({'0923': 1, '6732': 1, '4900': 1, '1983': 3}), expected)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+        # a price change is picked up on the next total
+        toothbrush = item.Item('1983', 'toothbrush', 299)
+        toothbrush.update_product()
+        self.assertEqual(test_scheme.get_total(items), expected + 200)
+        self.assertEqual(cache.get_stats()['invalidations'], 1)
+
+        # so is a change to the scheme's price adjustments
+        AdditionalTaxes('1983', 10, 'toothbrush').create_pricing_category()
+        test_scheme.pricing_category_refids.append(4)
+        test_scheme.load_pricing_categories()
+        get_price = get_catalog().get_price
+        expected = int(sum([pa.get_subtotal(items, get_price) for pa in test_scheme.price_adjustments]))
+        self.assertEqual(test_scheme.get_total(items), expected)
+        self.assertEqual(cache.get_stats()['invalidations'], 2)
+
+        test_scheme.use_total_cache(None)
+        self.assertIsNone(test_scheme.total_cache)
+        self.teardown()
+
+if __name__ == '__main__':
+    unittest.main()